@@ -5,49 +5,65 @@ from __future__ import annotations
 import logging
 from typing import Any, Dict
 
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
-
 from .fallbacks import fallback_behaviors
-from .utils import get_language_from_state, get_model_name, localize_phrase
+from .llm import ainvoke_llm, invoke_llm
+from .prompts import register_prompt
+from .utils import get_language_from_state, localize_phrase
 
 
 logger = logging.getLogger(__name__)
 
 
-def behavior(state: Dict[str, Any]) -> Dict[str, str]:
-    try:
-        llm = ChatOllama(
-            model=get_model_name("behavior_agent", state),
-            base_url="http://localhost:11434",
-            temperature=0,
-        )
+AGENT_KEY = "behavior_agent"
+
+
+PROMPT = register_prompt(
+    "behavior",
+    """
+    Extract only information about the car's behavior from the description at the end.
+    This includes driving dynamics and performance issues (e.g., shaking, vibrations, steering problems, braking issues, acceleration issues, stalling, pulling, loss of power).
+    Ignore noises, replaced parts, or vehicle specifications.
 
-        prompt = f"""
-Extract only information about the car's behavior from the following description.
-This includes driving dynamics and performance issues (e.g., shaking, vibrations, steering problems, braking issues, acceleration issues, stalling, pulling, loss of power).
-Ignore noises, replaced parts, or vehicle specifications.
+    Normalize the behaviors into clear, concise automotive terms.
+    If the user uses informal phrases, rewrite them as standard behavior descriptions.
 
-Normalize the behaviors into clear, concise automotive terms.
-If the user uses informal phrases, rewrite them as standard behavior descriptions.
+    Response format (no explanations, no extra text):
+    <Translate "Affected behaviors" into the input language>:
+    - behavior1
+    - behavior2
+    - behavior3
 
-Description:
-{state.get('description_text', '')}
+    If no behaviors can be identified, respond exactly with the translation of
+    "No affected behaviors identified" in the language used by the user.
 
-Response format (no explanations, no extra text):
-<Translate "Affected behaviors" into the input language>:
-- behavior1
-- behavior2
-- behavior3
+    Always answer in the same language as the input.
+    """,
+    """
+    Description:
+    {description}
+    """,
+)
 
-If no behaviors can be identified, respond exactly with the translation of
-"No affected behaviors identified" in the language used by the user.
 
-Always answer in the same language as the input.
-"""
+def _build_prompt(state: Dict[str, Any]) -> str:
+    return PROMPT.render(description=state.get("description_text", ""))
 
-        response = llm.invoke([HumanMessage(content=prompt)])
-        result = response.content.strip()
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("[Behavior Agent] Error: %s", exc)
+    language = get_language_from_state(state)
+    fallback = fallback_behaviors(state.get("description_text", ""), language)
+    if not fallback:
+        fallback = localize_phrase("behavior_none", language)
+    return {
+        "affected_behaviors": fallback,
+        "warning": str(exc)
+    }
+
+
+def behavior(state: Dict[str, Any]) -> Dict[str, str]:
+    try:
+        result = invoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
 
         logger.info("[Behavior Agent] Output: %s", result)
 
@@ -56,13 +72,15 @@ Always answer in the same language as the input.
         }
 
     except Exception as e:  # pylint: disable=broad-except
-        logger.error("[Behavior Agent] Error: %s", e)
-        language = get_language_from_state(state)
-        fallback = fallback_behaviors(state.get("description_text", ""), language)
-        if not fallback:
-            fallback = localize_phrase("behavior_none", language)
-        return {
-            "affected_behaviors": fallback,
-            "warning": str(e)
-        }
+        return _fallback(state, e)
+
 
+async def abehavior(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`behavior` bounded by the agent timeout."""
+
+    try:
+        result = await ainvoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
+        logger.info("[Behavior Agent] Output: %s", result)
+        return {"affected_behaviors": result}
+    except Exception as e:  # pylint: disable=broad-except
+        return _fallback(state, e)
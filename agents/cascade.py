@@ -0,0 +1,288 @@
+"""Cascade execution: cheapest model first, escalate on invalid answers.
+
+Most descriptions are answered well by the small models, yet the cause and
+solution agents jump to the large tier as soon as the complexity score
+crosses a cutoff. In cascade mode the agent's tier models are tried from the
+smallest to the largest. Every answer except the last one is checked by a
+cheap structural validator:
+
+- the expected header line is present,
+- the answer contains a list (``- item``), and
+- it is not an ``X: None`` answer although the evidence it is based on is
+  non-empty.
+
+Only an answer that fails validation escalates to the next tier. Settings
+live in the ``cascade`` section of ``bots_settings.json``; escalation rates
+per agent are available from :func:`cascade_stats`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List
+
+from .circuit_breaker import OllamaUnavailable, is_outage
+from .llm import ainvoke_llm, invoke_llm, stream_llm
+from .utils import get_agent_timeout, get_tier_models, load_bot_settings, localized_variants
+
+
+logger = logging.getLogger(__name__)
+
+
+Validator = Callable[[str, Dict[str, Any]], bool]
+
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+\S")
+_MARKUP = re.compile(r"[*#_`]+")
+
+
+def _none_words() -> frozenset[str]:
+    words = {"none"}
+    for key in ("possible_causes_none", "possible_solutions_none", "noise_none", "new_parts_none"):
+        words.update(phrase.rsplit(":", 1)[-1].strip().lower() for phrase in localized_variants(key))
+    return frozenset(words)
+
+
+_NONE_WORDS = _none_words()
+_EMPTY_EVIDENCE = frozenset(phrase.lower() for phrase in localized_variants("behavior_none"))
+
+
+def _lines(text: str) -> List[str]:
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def _is_header(line: str) -> bool:
+    """A short ``LABEL:`` line, optionally wrapped in markdown emphasis."""
+
+    label, colon, _ = _MARKUP.sub(" ", line).partition(":")
+    label = label.strip()
+    return bool(colon and label and len(label.split()) <= 4 and not _LIST_ITEM.match(line))
+
+
+def _is_none_answer(text: str) -> bool:
+    """``X: None`` (in any supported language) without any list items."""
+
+    lines = _lines(text)
+    if not lines or any(_LIST_ITEM.match(line) for line in lines):
+        return False
+    body = " ".join(_MARKUP.sub(" ", line).rsplit(":", 1)[-1] for line in lines)
+    return body.strip(" .").lower() in _NONE_WORDS
+
+
+def has_evidence(value: Any) -> bool:
+    """Whether an extracted field holds more than a "nothing found" answer."""
+
+    if isinstance(value, (list, dict)):
+        return any(has_evidence(item) for item in (value.values() if isinstance(value, dict) else value))
+    text = str(value or "").strip()
+    if not text or text.lower().strip(" .") in _EMPTY_EVIDENCE:
+        return False
+    return not _is_none_answer(text)
+
+
+def _validate_list_answer(text: str, evidence: Iterable[Any]) -> bool:
+    lines = _lines(text)
+    if not lines or not _is_header(lines[0]):
+        return False
+    if _is_none_answer(text):
+        return not any(has_evidence(value) for value in evidence)
+    return any(_LIST_ITEM.match(line) for line in lines[1:])
+
+
+def validate_possible_causes(text: str, state: Dict[str, Any]) -> bool:
+    return _validate_list_answer(
+        text,
+        (state.get(field) for field in ("affected_behaviors", "noises", "changed_parts")),
+    )
+
+
+def validate_possible_solutions(text: str, state: Dict[str, Any]) -> bool:
+    return _validate_list_answer(text, (state.get("possible_causes"),))
+
+
+VALIDATORS: Dict[str, Validator] = {
+    "possible_cause_agent": validate_possible_causes,
+    "possible_solution_agent": validate_possible_solutions,
+}
+
+
+class CascadeStats:
+    """Counts cascaded requests, escalations and the model that answered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, agent_key: str, model: str, escalations: int) -> None:
+        with self._lock:
+            stats = self._agents.setdefault(
+                agent_key, {"requests": 0, "escalated": 0, "escalations": 0, "answered_by": {}}
+            )
+            stats["requests"] += 1
+            stats["escalated"] += 1 if escalations else 0
+            stats["escalations"] += escalations
+            stats["answered_by"][model] = stats["answered_by"].get(model, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                agent_key: {
+                    **stats,
+                    "answered_by": dict(stats["answered_by"]),
+                    "escalation_rate": round(stats["escalated"] / stats["requests"], 3),
+                }
+                for agent_key, stats in self._agents.items()
+            }
+
+
+_stats = CascadeStats()
+
+
+@lru_cache(maxsize=1)
+def _cascade_agents() -> frozenset[str]:
+    settings = load_bot_settings().get("cascade")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return frozenset()
+    return frozenset(settings.get("agents", VALIDATORS))
+
+
+def cascade_models(agent_key: str) -> List[str]:
+    """The distinct tier models of *agent_key*, smallest tier first.
+
+    Empty when the agent does not run in cascade mode.
+    """
+
+    if agent_key not in _cascade_agents() or agent_key not in VALIDATORS:
+        return []
+    models: List[str] = []
+    for model in get_tier_models(agent_key).values():
+        if model not in models:
+            models.append(model)
+    return models if len(models) > 1 else []
+
+
+def cascade_stats() -> Dict[str, Dict[str, Any]]:
+    """Escalation counters per agent (empty when no cascade ran)."""
+
+    return _stats.snapshot()
+
+
+def _server_down(exc: BaseException) -> bool:
+    # A larger model on the same unreachable server will not do better.
+    return isinstance(exc, OllamaUnavailable) or is_outage(exc)
+
+
+def _accept(agent_key: str, model: str, escalations: int) -> None:
+    _stats.record(agent_key, model, escalations)
+    if escalations:
+        logger.info(
+            "⤴️ %s: Antwort nach %s Eskalation(en) von %s übernommen.",
+            agent_key,
+            escalations,
+            model,
+        )
+
+
+def _reject(agent_key: str, model: str, reason: str) -> None:
+    logger.info("⤴️ %s: Antwort von %s verworfen (%s), nächste Stufe.", agent_key, model, reason)
+
+
+def invoke_cascade(
+    agent_key: str,
+    state: Dict[str, Any],
+    prompt: str,
+    temperature: float = 0,
+    on_token: Callable[[str], None] | None = None,
+) -> str:
+    """Answer *prompt* through the cascade, or with a single call if it is off.
+
+    With *on_token* only the largest tier streams live; an accepted answer
+    of a smaller tier is handed over as a single token, like a cache hit.
+    """
+
+    models = cascade_models(agent_key)
+    if not models:
+        if on_token is not None:
+            return stream_llm(agent_key, state, prompt, on_token, temperature=temperature)
+        return invoke_llm(agent_key, state, prompt, temperature=temperature)
+
+    validate = VALIDATORS[agent_key]
+    for escalations, model in enumerate(models[:-1]):
+        try:
+            result = invoke_llm(agent_key, state, prompt, temperature=temperature, model=model)
+        except Exception as exc:  # pylint: disable=broad-except
+            if _server_down(exc):
+                raise
+            _reject(agent_key, model, f"Fehler: {exc}")
+            continue
+        if validate(result, state):
+            _accept(agent_key, model, escalations)
+            if on_token is not None:
+                on_token(result)
+            return result
+        _reject(agent_key, model, "Validierung fehlgeschlagen")
+
+    model = models[-1]
+    if on_token is not None:
+        result = stream_llm(
+            agent_key, state, prompt, on_token, temperature=temperature, model=model
+        )
+    else:
+        result = invoke_llm(agent_key, state, prompt, temperature=temperature, model=model)
+    _accept(agent_key, model, len(models) - 1)
+    return result
+
+
+async def ainvoke_cascade(
+    agent_key: str,
+    state: Dict[str, Any],
+    prompt: str,
+    temperature: float = 0,
+) -> str:
+    """Async variant of :func:`invoke_cascade`; all tiers share the agent timeout."""
+
+    models = cascade_models(agent_key)
+    if not models:
+        return await ainvoke_llm(agent_key, state, prompt, temperature=temperature)
+
+    validate = VALIDATORS[agent_key]
+    deadline = get_agent_timeout(agent_key)
+    started = time.perf_counter()
+
+    def remaining() -> float | None:
+        if deadline is None:
+            return None
+        left = deadline - (time.perf_counter() - started)
+        if left <= 0:
+            # Do not start a tier that cannot finish.
+            raise asyncio.TimeoutError()
+        return left
+
+    for escalations, model in enumerate(models[:-1]):
+        try:
+            result = await ainvoke_llm(
+                agent_key, state, prompt, temperature=temperature, timeout=remaining(), model=model
+            )
+        except asyncio.TimeoutError:
+            # The deadline covers the whole cascade; no time left to escalate.
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            if _server_down(exc):
+                raise
+            _reject(agent_key, model, f"Fehler: {exc}")
+            continue
+        if validate(result, state):
+            _accept(agent_key, model, escalations)
+            return result
+        _reject(agent_key, model, "Validierung fehlgeschlagen")
+
+    model = models[-1]
+    result = await ainvoke_llm(
+        agent_key, state, prompt, temperature=temperature, timeout=remaining(), model=model
+    )
+    _accept(agent_key, model, len(models) - 1)
+    return result
@@ -1,18 +1,71 @@
-"""Chat agent that answers user questions based on earlier analysis."""
+"""Chat agent that answers user questions based on earlier analysis.
+
+The answer is requested in Ollama's structured-output mode: the
+``format`` field carries :data:`RESPONSE_SCHEMA`, so the server constrains
+generation to an object with these fields (``structured_output`` in
+``bots_settings.json``; ``"schema": false`` sends plain ``"json"`` for
+servers without schema support). Answers that still are not valid JSON,
+e.g. because generation stopped mid-object, are salvaged with
+:mod:`agents.json_stream` instead of being thrown away.
+"""
 
 from __future__ import annotations
 
-import json
 import logging
-from typing import Any, Dict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Tuple
+
+from .chat_context import estimate_tokens, get_chat_context_builder
+from .json_stream import (
+    FAILED,
+    PLAIN,
+    SALVAGED,
+    StreamingJSONParser,
+    parse_json_object,
+    record_parse,
+)
+from .llm import ainvoke_llm, invoke_llm, stream_llm
+from .prompts import register_prompt
+from .utils import load_bot_settings
 
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
 
-from .utils import get_model_name
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+AGENT_KEY = "chat_agent"
+
+UPDATE_FIELDS = (
+    "car_details",
+    "affected_behaviors",
+    "noises",
+    "changed_parts",
+    "possible_causes",
+    "possible_solutions",
+)
+
+_OPTIONAL_TEXT = {"type": ["string", "null"]}
+
+# chat_response comes first so it can be streamed before the updates.
+RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "chat_response": {"type": "string"},
+        "description_append": _OPTIONAL_TEXT,
+        **{field: _OPTIONAL_TEXT for field in UPDATE_FIELDS},
+        "regenerate": {"type": "boolean"},
+    },
+    "required": ["chat_response", "regenerate"],
+}
+
+
+@lru_cache(maxsize=1)
+def get_response_format() -> str | Dict[str, Any] | None:
+    """Ollama ``format`` for the chat answer, ``None`` when structured output is disabled."""
+
+    settings = load_bot_settings().get("structured_output")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+    return RESPONSE_SCHEMA if settings.get("schema", True) else "json"
 
 
 def _normalise_update(value: Any) -> str:
@@ -30,122 +83,229 @@ def _normalise_update(value: Any) -> str:
     return str(value).strip()
 
 
-def chat_node(state: Dict[str, Any]) -> Dict[str, Any]:
-    """Answer follow-up questions using the collected diagnostic context."""
+PROMPT = register_prompt(
+    "chat",
+    """
+    You are a car diagnostic assistant AI.
+    Answer the user's question based on the collected analysis and the conversation that follow these instructions. Keep answers concise, factual and reference the findings explicitly when useful.
+    Long fields may be shortened (marked with "…"); earlier turns of the conversation are summarized as "F: question → A: answer".
+
+    If the user message adds NEW factual information (e.g., new symptoms, noises, car details, replaced parts, clarified causes or solutions), capture it so the main diagnosis can be updated. Minor confirmations without new facts should not trigger an update.
+
+    Respond ONLY in valid JSON with the following structure (use null when a field has no update):
+    {
+      "chat_response": "...",
+      "description_append": "..." | null,
+      "car_details": "..." | null,
+      "affected_behaviors": "..." | null,
+      "noises": "..." | null,
+      "changed_parts": "..." | null,
+      "possible_causes": "..." | null,
+      "possible_solutions": "..." | null,
+      "regenerate": true | false
+    }
+
+    "description_append" should contain only the new facts to append to the original description if the user shared additional context. Leave all fields null if no updates are required. Always reply in the same language as the user.
+    """,
+    """
+    Problem description:
+    {description}
+
+    Car details:
+    {car_details}
+
+    Affected behaviors:
+    {affected_behaviors}
+
+    Detected noises:
+    {noises}
+
+    Changed parts:
+    {changed_parts}
+
+    Possible causes:
+    {possible_causes}
+
+    Possible solutions:
+    {possible_solutions}
+
+    Earlier conversation (summary):
+    {summary}
+
+    Recent conversation:
+    {recent_turns}
+
+    User message:
+    {question}
+    """,
+)
+
+# Static part of the prompt, counted against the chat context budget.
+_FIXED_TOKENS = estimate_tokens(PROMPT.prefix + PROMPT.suffix)
+
+
+def _build_prompt(state: Dict[str, Any], question: str) -> Tuple[str, Dict[str, Any]]:
+    """Return the prompt and the updated running summary of older chat turns."""
+
+    values, summary = get_chat_context_builder().build(state, question, _FIXED_TOKENS)
+    return PROMPT.render(**values), summary
+
+
+def _no_question_result(state: Dict[str, Any]) -> Dict[str, Any]:
+    logger.info("[Chat Agent] Keine Frage übergeben – LLM-Aufruf übersprungen.")
+    return {
+        "chat_response": "",
+        "chat_history": state.get("chat_history", []),
+    }
+
+
+def _parse_answer(result: str) -> Dict[str, Any]:
+    """Parse the model answer, salvaging what is usable from invalid JSON.
+
+    Only ``chat_response`` may be taken from a cut-off string; the update
+    fields are kept only if their values are complete, so a truncated
+    ``description_append`` never lands in the diagnosis input.
+    """
+
+    parsed, outcome = parse_json_object(result)
+    if outcome == SALVAGED:
+        complete, _ = parse_json_object(result, partial_strings=False)
+        dropped = sorted(set(parsed) - set(complete) - {"chat_response"})
+        if dropped:
+            logger.warning("⚠️ Unvollständige Chat-Felder verworfen: %s", dropped)
+        response = parsed.get("chat_response")
+        parsed = {key: value for key, value in complete.items() if key != "chat_response"}
+        if response is not None:
+            parsed["chat_response"] = response
+    if outcome == FAILED and "{" not in result and result.strip():
+        # The model ignored the format and answered in prose.
+        parsed, outcome = {"chat_response": result.strip()}, PLAIN
+    record_parse(AGENT_KEY, outcome)
+
+    if outcome == FAILED:
+        logger.warning("⚠️ LLM-Antwort konnte nicht als JSON interpretiert werden: %s", result)
+        raise ValueError("Antwort war kein gültiges JSON")
+    if outcome == SALVAGED:
+        logger.warning(
+            "⚠️ Chat-Antwort war kein gültiges JSON – Felder %s gerettet.", sorted(parsed)
+        )
+    elif outcome == PLAIN:
+        logger.warning("⚠️ Chat-Antwort ohne JSON – Text als Antwort übernommen.")
+    return parsed
+
+
+def _apply_response(state: Dict[str, Any], question: str, result: str) -> Dict[str, Any]:
+    """Turn the raw JSON answer of the model into state updates."""
+
+    parsed = _parse_answer(result)
+    response = _normalise_update(parsed.get("chat_response"))
+
+    updates: Dict[str, Any] = {}
+    updated_fields: set[str] = set()
+
+    description_append = _normalise_update(parsed.get("description_append"))
+    if description_append:
+        existing_description = state.get("description_text", "").strip()
+        if existing_description:
+            updates["description_text"] = f"{existing_description}\n\n{description_append}".strip()
+        else:
+            updates["description_text"] = description_append
+        updated_fields.add("description_text")
+
+    for key in UPDATE_FIELDS:
+        value = _normalise_update(parsed.get(key))
+        if value:
+            updates[key] = value
+            updated_fields.add(key)
+
+    regenerate_flag = bool(parsed.get("regenerate", False)) or bool(updates)
+
+    chat_entry = {
+        "question": question,
+        "response": response,
+    }
+    chat_history = state.get("chat_history", []) + [chat_entry]
+
+    result_state = {
+        "chat_response": response,
+        "chat_history": chat_history,
+        "regenerate": regenerate_flag,
+        "locked_fields": sorted(updated_fields),
+    }
+    result_state.update(updates)
+    return result_state
+
+
+def _error_result(exc: BaseException) -> Dict[str, Any]:
+    logger.error("❌ Fehler im Chat-Agent: %s", exc)
+    return {
+        "chat_response": "",
+        "warning": str(exc),
+    }
+
+
+class _ResponseStream:
+    """Token callback that forwards only the growing ``chat_response`` text."""
+
+    def __init__(self, on_token: Callable[[str], None]):
+        self.on_token = on_token
+        self.parser = StreamingJSONParser()
+        self.sent = ""
+
+    def __call__(self, token: str) -> None:
+        response = self.parser.feed(token).get("chat_response")
+        if isinstance(response, str) and response.startswith(self.sent):
+            delta, self.sent = response[len(self.sent) :], response
+            if delta:
+                self.on_token(delta)
+
+
+def chat_node(
+    state: Dict[str, Any], on_token: Callable[[str], None] | None = None
+) -> Dict[str, Any]:
+    """Answer follow-up questions using the collected diagnostic context.
+
+    With *on_token* the answer is streamed: the callback receives the text
+    of ``chat_response`` as it is generated.
+    """
 
     question = state.get("user_question", "").strip()
     if not question:
-        logger.info("[Chat Agent] Keine Frage übergeben – LLM-Aufruf übersprungen.")
-        return {
-            "chat_response": "",
-            "chat_history": state.get("chat_history", []),
-        }
-
-    model_name = get_model_name("chat_agent", state)
-    llm = ChatOllama(model=model_name, base_url="http://localhost:11434", temperature=0)
-
-    prompt = f"""
-You are a car diagnostic assistant AI.
-Answer the user's question based on the collected analysis below. Keep answers concise, factual and reference the findings explicitly when useful.
-
-If the user message adds NEW factual information (e.g., new symptoms, noises, car details, replaced parts, clarified causes or solutions), capture it so the main diagnosis can be updated. Minor confirmations without new facts should not trigger an update.
+        return _no_question_result(state)
 
-Problem description:
-{json.dumps(state.get('description_text', ''), indent=2, ensure_ascii=False)}
-
-Car details:
-{json.dumps(state.get('car_details', ''), indent=2, ensure_ascii=False)}
-
-Affected behaviors:
-{json.dumps(state.get('affected_behaviors', ''), indent=2, ensure_ascii=False)}
-
-Detected noises:
-{json.dumps(state.get('noises', ''), indent=2, ensure_ascii=False)}
-
-Changed parts:
-{json.dumps(state.get('changed_parts', ''), indent=2, ensure_ascii=False)}
-
-Possible causes:
-{json.dumps(state.get('possible_causes', ''), indent=2, ensure_ascii=False)}
-
-Possible solutions:
-{json.dumps(state.get('possible_solutions', ''), indent=2, ensure_ascii=False)}
+    try:
+        prompt, summary = _build_prompt(state, question)
+        response_format = get_response_format()
+        if on_token is None:
+            result = invoke_llm(
+                AGENT_KEY, state, prompt, temperature=0, response_format=response_format
+            )
+        else:
+            result = stream_llm(
+                AGENT_KEY,
+                state,
+                prompt,
+                _ResponseStream(on_token),
+                temperature=0,
+                response_format=response_format,
+            )
+        return {**_apply_response(state, question, result), "chat_summary": summary}
+    except Exception as e:  # pylint: disable=broad-except
+        return _error_result(e)
 
-User message:
-{question}
 
-Respond ONLY in valid JSON with the following structure (use null when a field has no update):
-{{
-  "chat_response": "...",
-  "description_append": "..." | null,
-  "car_details": "..." | null,
-  "affected_behaviors": "..." | null,
-  "noises": "..." | null,
-  "changed_parts": "..." | null,
-  "possible_causes": "..." | null,
-  "possible_solutions": "..." | null,
-  "regenerate": true | false
-}}
+async def achat_node(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Async variant of :func:`chat_node` bounded by the agent timeout."""
 
-"description_append" should contain only the new facts to append to the original description if the user shared additional context. Leave all fields null if no updates are required. Always reply in the same language as the user.
-"""
+    question = state.get("user_question", "").strip()
+    if not question:
+        return _no_question_result(state)
 
     try:
-        result = llm.invoke([HumanMessage(content=prompt)]).content.strip()
-
-        try:
-            parsed = json.loads(result)
-        except json.JSONDecodeError as exc:  # pragma: no cover - LLM specific
-            logger.warning("⚠️ LLM-Antwort konnte nicht als JSON interpretiert werden: %s", result)
-            raise ValueError("Antwort war kein gültiges JSON") from exc
-
-        response = parsed.get("chat_response", "").strip()
-
-        updates: Dict[str, Any] = {}
-        updated_fields: set[str] = set()
-
-        description_append = _normalise_update(parsed.get("description_append"))
-        if description_append:
-            existing_description = state.get("description_text", "").strip()
-            if existing_description:
-                updates["description_text"] = f"{existing_description}\n\n{description_append}".strip()
-            else:
-                updates["description_text"] = description_append
-            updated_fields.add("description_text")
-
-        for key in (
-            "car_details",
-            "affected_behaviors",
-            "noises",
-            "changed_parts",
-            "possible_causes",
-            "possible_solutions",
-        ):
-            value = _normalise_update(parsed.get(key))
-            if value:
-                updates[key] = value
-                updated_fields.add(key)
-
-        regenerate_flag = bool(parsed.get("regenerate", False)) or bool(updates)
-
-        chat_entry = {
-            "question": question,
-            "response": response,
-        }
-        chat_history = state.get("chat_history", []) + [chat_entry]
-
-        result_state = {
-            "chat_response": response,
-            "chat_history": chat_history,
-            "regenerate": regenerate_flag,
-            "locked_fields": sorted(updated_fields),
-        }
-        result_state.update(updates)
-        return result_state
-
+        prompt, summary = _build_prompt(state, question)
+        result = await ainvoke_llm(
+            AGENT_KEY, state, prompt, temperature=0, response_format=get_response_format()
+        )
+        return {**_apply_response(state, question, result), "chat_summary": summary}
     except Exception as e:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im Chat-Agent: %s", e)
-        return {
-            "chat_response": "",
-            "warning": str(e),
-        }
+        return _error_result(e)
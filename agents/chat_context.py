@@ -0,0 +1,202 @@
+"""Token-budgeted context for the chat agent.
+
+The chat prompt used to carry every diagnosis field pretty-printed with
+``json.dumps(indent=2)`` and grew with every field the chat updated. The
+:class:`ChatContextBuilder` fits the variable part of the prompt into a
+fixed token budget instead:
+
+- state fields are serialized compactly (plain text, collapsed whitespace),
+- the last ``recent_turns`` chat turns are kept verbatim,
+- older turns are folded into a running summary that is stored in the state
+  (``chat_summary``) and only extended by the turns that aged out since the
+  previous question, and
+- if the sections still exceed the budget, the longest ones are shortened
+  until everything fits.
+
+A conversation therefore costs about the same number of prompt tokens on
+its fiftieth turn as on its fifth. Settings live in the ``chat_context``
+section of ``bots_settings.json``.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+from .utils import load_bot_settings
+
+
+# Rough size of a token for the mostly German/English prompt text.
+_CHARS_PER_TOKEN = 4
+
+_WHITESPACE = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+_ELLIPSIS = " …"
+
+# Context fields in the order they appear in the prompt.
+CONTEXT_FIELDS: Dict[str, str] = {
+    "description": "description_text",
+    "car_details": "car_details",
+    "affected_behaviors": "affected_behaviors",
+    "noises": "noises",
+    "changed_parts": "changed_parts",
+    "possible_causes": "possible_causes",
+    "possible_solutions": "possible_solutions",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+def compact(value: Any) -> str:
+    """Serialize a state value with as few tokens as possible."""
+
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in value.strip().splitlines())
+    return _BLANK_LINES.sub("\n", "\n".join(lines))
+
+
+def truncate(text: str, tokens: int, keep_end: bool = False) -> str:
+    """Cut *text* to about *tokens* tokens at a word boundary.
+
+    With *keep_end* the beginning is dropped instead of the end.
+    """
+
+    limit = max(tokens, 0) * _CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    size = max(limit - len(_ELLIPSIS), 0)
+    if keep_end:
+        cut = text[len(text) - size :]
+        if " " in cut:
+            cut = cut.split(" ", 1)[1]
+        return _ELLIPSIS.strip() + " " + cut.lstrip()
+    cut = text[:size]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + _ELLIPSIS
+
+
+def _first_sentence(text: str, max_words: int) -> str:
+    sentence = _SENTENCE_END.split(compact(text).replace("\n", " "), 1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + _ELLIPSIS
+    return sentence
+
+
+def summarize_turn(turn: Mapping[str, str]) -> str:
+    """One summary line for a chat turn."""
+
+    question = _first_sentence(turn.get("question", ""), 20)
+    answer = _first_sentence(turn.get("response", ""), 30)
+    return f"- F: {question} → A: {answer}"
+
+
+def fit_sections(
+    sections: Dict[str, str], budget: int, keep_end: Sequence[str] = ()
+) -> Dict[str, str]:
+    """Shorten the longest *sections* until their total fits *budget* tokens.
+
+    Finds the largest per-section cap that fits (so short sections stay
+    intact) and truncates everything above it; sections named in *keep_end*
+    lose their beginning rather than their end.
+    """
+
+    costs = {name: estimate_tokens(text) for name, text in sections.items()}
+    if sum(costs.values()) <= budget:
+        return dict(sections)
+
+    remaining = max(budget, 0)
+    cap = 0
+    ordered = sorted(costs.values())
+    for index, cost in enumerate(ordered):
+        share = remaining // (len(ordered) - index)
+        if cost > share:
+            cap = share
+            break
+        remaining -= cost
+    return {
+        name: text if costs[name] <= cap else truncate(text, cap, name in keep_end)
+        for name, text in sections.items()
+    }
+
+
+class ChatContextBuilder:
+    """Builds the template values of the chat prompt within a token budget."""
+
+    def __init__(self, token_budget: int = 1500, recent_turns: int = 4, summary_tokens: int = 250):
+        self.token_budget = token_budget
+        self.recent_turns = max(recent_turns, 0)
+        self.summary_tokens = summary_tokens
+
+    def update_summary(
+        self, history: Sequence[Mapping[str, str]], summary: Mapping[str, Any] | None
+    ) -> Dict[str, Any]:
+        """Fold the turns that left the verbatim window into the running summary.
+
+        *summary* is the cached ``{"turns": n, "text": ...}`` of the previous
+        call; only turns beyond ``n`` are summarized. The summary keeps its
+        newest lines within ``summary_tokens``.
+        """
+
+        folded = int((summary or {}).get("turns", 0))
+        text = str((summary or {}).get("text", ""))
+        cutoff = max(len(history) - self.recent_turns, 0)
+        if cutoff < folded:
+            # History was reset or replaced: start over.
+            folded, text = 0, ""
+        if cutoff == folded:
+            return {"turns": folded, "text": text}
+
+        lines = [line for line in text.splitlines() if line]
+        lines.extend(summarize_turn(turn) for turn in history[folded:cutoff])
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return {"turns": cutoff, "text": "\n".join(lines)}
+
+    def build(
+        self, state: Mapping[str, Any], question: str, fixed_tokens: int = 0
+    ) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Return the prompt values and the updated summary for *state*.
+
+        *fixed_tokens* is the size of the static prompt prefix, which counts
+        against the budget as well.
+        """
+
+        history: List[Mapping[str, str]] = list(state.get("chat_history") or [])
+        summary = self.update_summary(history, state.get("chat_summary"))
+        recent = history[summary["turns"] :]
+
+        sections = {name: compact(state.get(field)) for name, field in CONTEXT_FIELDS.items()}
+        sections["summary"] = summary["text"]
+        sections["recent_turns"] = "\n".join(
+            f"F: {compact(turn.get('question'))}\nA: {compact(turn.get('response'))}"
+            for turn in recent
+        )
+        available = self.token_budget - fixed_tokens - estimate_tokens(question)
+        # The newest turns and summary lines are at the end.
+        values = fit_sections(sections, available, keep_end=("summary", "recent_turns"))
+        values = {name: text or "-" for name, text in values.items()}
+        values["question"] = question
+        return values, summary
+
+
+@lru_cache(maxsize=1)
+def get_chat_context_builder() -> ChatContextBuilder:
+    settings = load_bot_settings().get("chat_context")
+    settings = settings if isinstance(settings, dict) else {}
+    return ChatContextBuilder(
+        token_budget=settings.get("token_budget", 1500),
+        recent_turns=settings.get("recent_turns", 4),
+        summary_tokens=settings.get("summary_tokens", 250),
+    )
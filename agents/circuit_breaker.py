@@ -0,0 +1,221 @@
+"""Circuit breaker around the Ollama endpoint.
+
+The agents fall back to the rule-based answers in ``fallbacks.py`` once a
+model call fails, but with a dead or overloaded server every call first waits
+for its connection error or timeout. :class:`CircuitBreaker` counts
+consecutive outage errors (connection failures, HTTP and socket timeouts,
+5xx answers) of the HTTP requests themselves; an agent deadline that runs
+out while a call waits for its scheduler slot is not an outage;
+after ``failure_threshold`` of them it opens and every further call fails
+immediately with :class:`OllamaUnavailable`, so the agents answer from their
+fallbacks at once. While open, a background thread probes the server every
+``probe_interval_seconds`` and closes the breaker when it answers again.
+
+Settings live in the ``circuit_breaker`` section of ``bots_settings.json``.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict
+
+import aiohttp
+import requests
+
+from .ollama_pool import OLLAMA_BASE_URL, OllamaServerError, get_http_session
+from .utils import load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED = "closed"
+OPEN = "open"
+
+_OUTAGE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    # Includes aiohttp.ServerTimeoutError, raised for HTTP timeouts of async calls.
+    aiohttp.ClientConnectionError,
+    OllamaServerError,
+)
+
+
+class OllamaUnavailable(ConnectionError):
+    """Raised instead of calling Ollama while the circuit breaker is open."""
+
+
+def is_outage(exc: BaseException) -> bool:
+    """Whether *exc* indicates an unreachable or overloaded server."""
+
+    return isinstance(exc, _OUTAGE_ERRORS)
+
+
+class CircuitBreaker:
+    """Opens after consecutive outage errors and closes after a successful probe."""
+
+    def __init__(
+        self,
+        base_url: str,
+        failure_threshold: int = 3,
+        probe_interval: float = 10,
+        probe_timeout: float = 3,
+    ):
+        self.base_url = base_url
+        self.failure_threshold = max(failure_threshold, 1)
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._last_error = ""
+        self._rejected = 0
+        self._prober: threading.Thread | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._state == OPEN
+
+    def check(self) -> None:
+        """Raise :class:`OllamaUnavailable` while the breaker is open."""
+
+        if self._state != OPEN:
+            return
+        with self._lock:
+            self._rejected += 1
+        raise OllamaUnavailable(
+            f"Ollama nicht erreichbar (Circuit Breaker offen): {self._last_error}"
+        )
+
+    def record_success(self) -> None:
+        if self._failures:
+            with self._lock:
+                self._failures = 0
+
+    def record_failure(self, exc: BaseException) -> None:
+        """Count *exc* if it is an outage error; open after the threshold."""
+
+        if not is_outage(exc):
+            return
+        with self._lock:
+            self._failures += 1
+            self._last_error = f"{type(exc).__name__}: {exc}"[:200]
+            if self._state == OPEN or self._failures < self.failure_threshold:
+                return
+            self._state = OPEN
+            self._opened_at = time.time()
+        logger.error(
+            "🔌 Ollama nach %s Fehlern nicht erreichbar – Circuit Breaker offen, "
+            "Agenten verwenden ihre Fallbacks. Letzter Fehler: %s",
+            self._failures,
+            self._last_error,
+        )
+        self._start_probing()
+
+    def probe(self) -> bool:
+        """One health check against ``/api/tags``."""
+
+        try:
+            response = get_http_session().get(
+                f"{self.base_url}/api/tags", timeout=self.probe_timeout
+            )
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _close(self) -> None:
+        with self._lock:
+            opened_at, self._opened_at = self._opened_at, None
+            self._state = CLOSED
+            self._failures = 0
+            self._prober = None
+        logger.info(
+            "✅ Ollama wieder erreichbar – Circuit Breaker geschlossen (nach %.0fs).",
+            time.time() - (opened_at or time.time()),
+        )
+
+    def _start_probing(self) -> None:
+        with self._lock:
+            if self._prober is not None:
+                return
+
+            def run() -> None:
+                while True:
+                    time.sleep(self.probe_interval)
+                    if self.probe():
+                        self._close()
+                        return
+                    logger.debug("[CircuitBreaker] Ollama antwortet weiterhin nicht.")
+
+            self._prober = threading.Thread(target=run, name="ollama-probe", daemon=True)
+            self._prober.start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "open_seconds": round(time.time() - self._opened_at, 1)
+                if self._opened_at
+                else 0.0,
+                "rejected_calls": self._rejected,
+                "last_error": self._last_error,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_circuit_breaker() -> CircuitBreaker | None:
+    """Return the shared breaker, ``None`` when ``circuit_breaker`` is disabled."""
+
+    settings = load_bot_settings().get("circuit_breaker")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+
+    return CircuitBreaker(
+        OLLAMA_BASE_URL,
+        failure_threshold=settings.get("failure_threshold", 3),
+        probe_interval=settings.get("probe_interval_seconds", 10),
+        probe_timeout=settings.get("probe_timeout_seconds", 3),
+    )
+
+
+def check_ollama() -> None:
+    """Fail fast while the circuit breaker is open, before queueing for a slot."""
+
+    breaker = get_circuit_breaker()
+    if breaker is not None:
+        breaker.check()
+
+
+@contextmanager
+def ollama_call():
+    """Report the outcome of the HTTP request in the block to the circuit breaker.
+
+    Only the request itself is covered: time spent waiting for a scheduler
+    slot or an agent deadline running out says nothing about the server.
+    """
+
+    breaker = get_circuit_breaker()
+    if breaker is None:
+        yield
+        return
+
+    breaker.check()
+    try:
+        yield
+    except BaseException as exc:
+        breaker.record_failure(exc)
+        raise
+    breaker.record_success()
+
+
+def ollama_status() -> Dict[str, Any]:
+    """Breaker state for reports (empty when the breaker is disabled)."""
+
+    breaker = get_circuit_breaker()
+    return breaker.snapshot() if breaker is not None else {}
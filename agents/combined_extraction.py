@@ -0,0 +1,142 @@
+"""Agent that extracts car details, behaviors, noises and new parts in one call."""
+
+from __future__ import annotations
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Iterable
+
+from .behavior import behavior
+from .identify_car import identify_car
+from .json_stream import FAILED, SALVAGED, parse_json_object, record_parse
+from .llm import invoke_llm
+from .new_parts import new_parts
+from .noise import noise
+from .prompts import register_prompt
+
+
+logger = logging.getLogger(__name__)
+
+
+AGENT_KEY = "combined_extraction_agent"
+
+
+# Extracted field and the single-purpose agent used when the combined answer
+# does not contain a usable value for it.
+FIELD_AGENTS: Dict[str, Callable[[Dict[str, Any]], Dict[str, str]]] = {
+    "car_details": identify_car,
+    "affected_behaviors": behavior,
+    "noises": noise,
+    "changed_parts": new_parts,
+}
+
+
+PROMPT = register_prompt(
+    "combined_extraction",
+    """
+    Task: Extract the following information from the problem description at the end and return it as one JSON object.
+    Always write the values in the same language as the description. Do not translate.
+
+    - "car_details": vehicle details. Normalize model names and technical details (e.g., Golf VII → Golf 7).
+      Write "Unknown" for details that cannot be identified or inferred with certainty. Format:
+      "<Translate "CAR_DETAILS" into the input language>:\\n- <Translate "Brand">: ...\\n- <Translate "Model">: ...\\n- <Translate "Engine">: ...\\n- <Translate "Transmission">: ...\\n- <Translate "Year">: ..."
+    - "affected_behaviors": only driving dynamics and performance issues (e.g., shaking, vibrations, steering, braking, acceleration, stalling, pulling, loss of power), normalized into concise automotive terms. Ignore noises, replaced parts and specifications. Format:
+      "<Translate "Affected behaviors" into the input language>:\\n- behavior1\\n- behavior2"
+      If none are described, use the translation of "No affected behaviors identified".
+    - "noises": only noise- or sound-related information. Format:
+      "<Translate "NOISES" into the input language>:\\n1. <Translate "Sound">: ...\\n   <Translate "Pattern">: ...\\n   <Translate "Frequency">: ...\\n   <Translate "Details">: ..."
+      If none are described, use the translation of "NOISES: None".
+    - "changed_parts": only parts explicitly mentioned as already replaced, exchanged or newly installed, normalized to standard part names. Do not include broken, old or suggested parts. Format:
+      "<Translate "NEW_PARTS" into the input language>:\\n- part1\\n- part2"
+      If none are mentioned, use the translation of "NEW_PARTS: None".
+
+    Respond ONLY in valid JSON with exactly these string fields:
+    {
+      "car_details": "...",
+      "affected_behaviors": "...",
+      "noises": "...",
+      "changed_parts": "..."
+    }
+    """,
+    """
+    Description:
+    {description}
+    """,
+)
+
+
+def _build_prompt(state: Dict[str, Any]) -> str:
+    description = state.get("description_text", "")
+    return PROMPT.render(description=json.dumps(description, indent=2, ensure_ascii=False))
+
+
+def _clean_value(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        value = "\n".join(str(item) for item in value if str(item).strip())
+    if isinstance(value, str):
+        return value.strip()
+    return ""
+
+
+def _parse_fields(raw: str, fields: Iterable[str]) -> Dict[str, str]:
+    """Return the usable fields of the JSON answer.
+
+    Members completed before invalid JSON broke off are kept; truncated
+    values are dropped and left to the single-purpose agents.
+    """
+
+    parsed, outcome = parse_json_object(raw, partial_strings=False)
+    record_parse(AGENT_KEY, outcome)
+    if outcome == FAILED:
+        logger.warning("⚠️ Kombinierte Extraktion lieferte kein gültiges JSON: %s", raw)
+        return {}
+    if outcome == SALVAGED:
+        logger.warning(
+            "⚠️ Kombinierte Extraktion lieferte unvollständiges JSON – Felder %s gerettet.",
+            sorted(parsed),
+        )
+
+    values: Dict[str, str] = {}
+    for field in fields:
+        value = _clean_value(parsed.get(field))
+        if value:
+            values[field] = value
+    return values
+
+
+def combined_extraction(
+    state: Dict[str, Any], fields: Iterable[str] | None = None
+) -> Dict[str, str]:
+    """Extract the requested *fields* (default: all four) with a single LLM call.
+
+    Fields that are missing from the answer, or the whole answer if it is not
+    valid JSON, are filled by the corresponding single-purpose agents.
+    """
+
+    requested = [field for field in (fields or FIELD_AGENTS) if field in FIELD_AGENTS]
+    result: Dict[str, str] = {}
+
+    try:
+        raw = invoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0, format="json")
+        result.update(_parse_fields(raw, requested))
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("❌ Fehler im Combined-Extraction-Agent: %s", exc)
+
+    missing = [field for field in requested if field not in result]
+    if not missing:
+        return result
+
+    logger.info("[Combined Extraction] Einzel-Agenten für fehlende Felder: %s", missing)
+    with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+        futures = [
+            executor.submit(copy_context().run, FIELD_AGENTS[field], state) for field in missing
+        ]
+        outputs = [future.result() for future in futures]
+
+    for field, output in zip(missing, outputs):
+        result[field] = output.get(field, "")
+        if "warning" in output:
+            result["warning"] = output["warning"]
+    return result
@@ -1,9 +1,22 @@
-"""Fallback generators that provide meaningful output when the LLM is unavailable."""
+"""Fallback generators that provide meaningful output when the LLM is unavailable.
+
+Issue profiles and the vehicle catalog come from the data files of
+:mod:`agents.knowledge_base`. During an outage these generators answer
+every request, so a description is normalized and matched only once: the
+result (:func:`analyse_description`) is cached and shared by all
+generators of a pipeline run. Vehicle details come from
+:mod:`agents.vehicle_recognizer`.
+"""
 
 from __future__ import annotations
 
-import re
-from typing import Dict, Iterable, List
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .keyword_matcher import KeywordMatcher
+from .knowledge_base import get_knowledge_base, text_grams
+from .vehicle_recognizer import VehicleMatch, get_vehicle_recognizer
 
 _LANG_STRINGS: Dict[str, Dict[str, str]] = {
     "en": {
@@ -45,6 +58,12 @@ _REPLACED_TRIGGERS: Dict[str, Iterable[str]] = {
 }
 
 
+def is_localized(language: str) -> bool:
+    """Whether the fallbacks answer in *language* instead of English."""
+
+    return language in _LANG_STRINGS
+
+
 def _normalise_language(language: str) -> str:
     if language in _LANG_STRINGS:
         return language
@@ -62,179 +81,83 @@ def _normalise_text(text: str) -> str:
     return text
 
 
-_ISSUE_PROFILES: List[Dict[str, object]] = [
-    {
-        "id": "vibration",
-        "keywords": {
-            "en": ("vibration", "vibrations", "shaking", "shudder", "wobble"),
-            "de": (
-                "vibration",
-                "vibrationen",
-                "ruckeln",
-                "schuettel",
-                "schuttel",
-                "zittern",
-                "wackeln",
-            ),
-        },
-        "behaviors": {
-            "en": ("- Persistent vibrations while driving",),
-            "de": ("- Anhaltende Vibrationen während der Fahrt",),
-        },
-        "causes": {
-            "en": (
-                "- Wheel imbalance or worn suspension components → vibrations at all speeds",
-            ),
-            "de": (
-                "- Unwucht der Räder oder verschlissene Fahrwerkskomponenten → Vibrationen bei allen Geschwindigkeiten",
-            ),
-        },
-        "mechanic_steps": {
-            "en": (
-                "Check wheel balance and tire condition",
-                "Inspect tie rods, control arms and suspension bushings",
-                "Perform an alignment after repairs",
-            ),
-            "de": (
-                "Radauswuchtung und Reifen prüfen",
-                "Spurstangen, Querlenker und Fahrwerkslager kontrollieren",
-                "Nach Reparaturen eine Achsvermessung durchführen",
-            ),
-        },
-        "user_advice": {
-            "en": (
-                "Avoid high speeds until the vibration is resolved",
-                "Monitor the replaced tie rod for play or looseness",
-            ),
-            "de": (
-                "Hohe Geschwindigkeiten vermeiden, bis die Vibration behoben ist",
-                "Die ersetzte Spurstange auf Spiel oder Lockerheit beobachten",
-            ),
-        },
-        "replaced_parts": {
-            "en": (
-                {"keywords": ("tie rod",), "label": "Tie rod (right side)"},
-            ),
-            "de": (
-                {"keywords": ("spurstange",), "label": "Spurstange (rechte Seite)"},
-            ),
-        },
-    }
-]
-
-
-_BRAND_PATTERNS: Dict[str, Dict[str, object]] = {
-    "volvo": {"brand": "Volvo", "models": ("c30", "s60", "xc60", "xc90")},
-    "bmw": {"brand": "BMW", "models": ("x5", "x3", "3er", "5er", "i3")},
-    "audi": {"brand": "Audi", "models": ("a3", "a4", "a6", "q5")},
-    "mercedes": {"brand": "Mercedes-Benz", "models": ("c-klasse", "e-klasse", "glc")},
-    "vw": {"brand": "Volkswagen", "models": ("golf", "passat", "tiguan")},
-    "volkswagen": {"brand": "Volkswagen", "models": ("golf", "passat", "tiguan")},
-    "ford": {"brand": "Ford", "models": ("focus", "fiesta", "mustang")},
-    "toyota": {"brand": "Toyota", "models": ("corolla", "yaris", "rav4")},
-}
+@lru_cache(maxsize=None)
+def _trigger_matcher(lang: str) -> KeywordMatcher[str]:
+    triggers = _REPLACED_TRIGGERS.get(lang, ()) or _REPLACED_TRIGGERS.get("en", ())
+    return KeywordMatcher((trigger, trigger) for trigger in triggers)
+
+
+@dataclass(frozen=True)
+class DescriptionAnalysis:
+    """Normalized description and everything the fallbacks match in it."""
 
+    lang: str
+    text: str
+    profiles: Tuple[Dict[str, Any], ...]
+    vehicle: VehicleMatch
+    replaced_parts: Tuple[str, ...]
 
-def _detect_profiles(description: str, language: str) -> List[Dict[str, object]]:
+
+@lru_cache(maxsize=256)
+def analyse_description(description: str, language: str) -> DescriptionAnalysis:
+    """Normalize and match *description* once for all fallback generators."""
+
+    knowledge_base = get_knowledge_base()
     text = _normalise_text(description)
     lang = _normalise_language(language)
-    matches: List[Dict[str, object]] = []
-    for profile in _ISSUE_PROFILES:
-        keywords: Iterable[str] = profile["keywords"].get(lang) or profile["keywords"].get("en", ())
-        if any(keyword in text for keyword in keywords):
-            matches.append(profile)
-    return matches
+    index = knowledge_base.profiles(lang)
+    grams = text_grams(text)
+    parts: Tuple[str, ...] = ()
+    if _trigger_matcher(lang).search(text):
+        parts = tuple(index.replaced_parts(text, grams))
+    return DescriptionAnalysis(
+        lang=lang,
+        text=text,
+        profiles=tuple(index.profile(profile_id) for profile_id in index.match(text, grams)),
+        vehicle=get_vehicle_recognizer().recognize(text),
+        replaced_parts=parts,
+    )
+
+
+def _detect_profiles(description: str, language: str) -> Tuple[Dict[str, Any], ...]:
+    return analyse_description(description, language).profiles
 
 
 def fallback_car_details(description: str, language: str) -> str:
     strings = _strings(language)
-    text = _normalise_text(description)
-
-    brand_output = strings["unknown_value"]
-    model_output = strings["unknown_value"]
-
-    for key, info in _BRAND_PATTERNS.items():
-        if key in text:
-            brand_output = info["brand"]
-            model_output = strings["unknown_value"]
-            model_candidates: Iterable[str] = info.get("models", ())
-            pattern = re.compile(rf"{re.escape(key)}\s+([a-z0-9\-]+)")
-            match = pattern.search(text)
-            if match:
-                model_output = match.group(1).upper()
-            else:
-                for model in model_candidates:
-                    if model in text:
-                        model_output = model.upper()
-                        break
-            break
+    vehicle = analyse_description(description, language).vehicle
+    unknown = strings["unknown_value"]
 
     lines = [
         f"{strings['car_details_header']}:",
-        f"- {strings['brand_label']}: {brand_output}",
-        f"- {strings['model_label']}: {model_output}",
-        f"- {strings['engine_label']}: {strings['unknown_value']}",
-        f"- {strings['transmission_label']}: {strings['unknown_value']}",
-        f"- {strings['year_label']}: {strings['unknown_value']}",
+        f"- {strings['brand_label']}: {vehicle.brand or unknown}",
+        f"- {strings['model_label']}: {vehicle.model_name or unknown}",
+        f"- {strings['engine_label']}: {vehicle.engine or unknown}",
+        f"- {strings['transmission_label']}: {vehicle.transmission or unknown}",
+        f"- {strings['year_label']}: {vehicle.year or unknown}",
     ]
     return "\n".join(lines)
 
 
-def _extract_sentences(text: str) -> List[str]:
-    if not text:
-        return []
-    sentences = re.split(r"[.!?\n]", text)
-    return [sentence.strip() for sentence in sentences if sentence.strip()]
-
-
 def fallback_behaviors(description: str, language: str) -> str:
     strings = _strings(language)
     matches = _detect_profiles(description, language)
+    if not matches:
+        return ""
 
-    if matches:
-        lines: List[str] = [f"{strings['behaviors_header']}:"]
-        seen: List[str] = []
-        lang = _normalise_language(language)
-        for profile in matches:
-            behaviours: Iterable[str] = profile["behaviors"].get(lang) or profile["behaviors"].get("en", ())
-            for entry in behaviours:
-                if entry not in seen:
-                    seen.append(entry)
-        lines.extend(seen)
-        return "\n".join(lines)
-
-    sentences = _extract_sentences(description)
-    text = _normalise_text(description)
-    lang = _normalise_language(language)
-    keywords: Iterable[str] = tuple({kw for profile in _ISSUE_PROFILES for kw in profile["keywords"].get(lang, ())})
-
-    for sentence in sentences:
-        lowered = _normalise_text(sentence)
-        if any(keyword in lowered for keyword in keywords):
-            return "\n".join([f"{strings['behaviors_header']}:", f"- {sentence.strip()}"])
-
-    return ""
+    lines: List[str] = [f"{strings['behaviors_header']}:"]
+    seen: List[str] = []
+    for profile in matches:
+        for entry in profile["behaviors"]:
+            if entry not in seen:
+                seen.append(entry)
+    lines.extend(seen)
+    return "\n".join(lines)
 
 
 def fallback_changed_parts(description: str, language: str) -> str:
     strings = _strings(language)
-    text = _normalise_text(description)
-    lang = _normalise_language(language)
-
-    triggers = _REPLACED_TRIGGERS.get(lang, ()) or _REPLACED_TRIGGERS.get("en", ())
-    if not any(trigger in text for trigger in triggers):
-        return ""
-
-    parts: List[str] = []
-    for profile in _ISSUE_PROFILES:
-        entries: Iterable[Dict[str, object]] = profile["replaced_parts"].get(lang) or profile["replaced_parts"].get("en", ())
-        for entry in entries:
-            keywords: Iterable[str] = entry.get("keywords", ())
-            if any(keyword in text for keyword in keywords):
-                label = str(entry.get("label", "")).strip()
-                if label and label not in parts:
-                    parts.append(label)
-
+    parts = analyse_description(description, language).replaced_parts
     if not parts:
         return ""
 
@@ -250,12 +173,10 @@ def fallback_possible_causes(state: Dict[str, str], language: str) -> str:
     if not matches:
         return ""
 
-    lang = _normalise_language(language)
     lines = [f"{strings['possible_causes_header']}:"]
     seen: List[str] = []
     for profile in matches:
-        causes: Iterable[str] = profile["causes"].get(lang) or profile["causes"].get("en", ())
-        for cause in causes:
+        for cause in profile["causes"]:
             if cause not in seen:
                 seen.append(cause)
     lines.extend(seen)
@@ -269,16 +190,13 @@ def fallback_possible_solutions(state: Dict[str, str], language: str) -> str:
     if not matches:
         return ""
 
-    lang = _normalise_language(language)
     mechanic_steps: List[str] = []
     user_advice: List[str] = []
     for profile in matches:
-        mech_entries: Iterable[str] = profile["mechanic_steps"].get(lang) or profile["mechanic_steps"].get("en", ())
-        user_entries: Iterable[str] = profile["user_advice"].get(lang) or profile["user_advice"].get("en", ())
-        for step in mech_entries:
+        for step in profile["mechanic_steps"]:
             if step not in mechanic_steps:
                 mechanic_steps.append(step)
-        for tip in user_entries:
+        for tip in profile["user_advice"]:
             if tip not in user_advice:
                 user_advice.append(tip)
 
@@ -6,54 +6,102 @@ import json
 import logging
 from typing import Any, Dict
 
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
-
-from .fallbacks import fallback_car_details
-from .utils import get_language_from_state, get_model_name
+from .fallbacks import analyse_description, fallback_car_details, is_localized
+from .llm import ainvoke_llm, invoke_llm
+from .prompts import register_prompt
+from .utils import get_language_from_state
+from .vehicle_recognizer import get_min_confidence
 
 
 logger = logging.getLogger(__name__)
 
 
-def identify_car(state: Dict[str, Any]) -> Dict[str, str]:
-    """Extract normalized car details from the problem description."""
+AGENT_KEY = "identify_car_agent"
+
+
+PROMPT = register_prompt(
+    "identify_car",
+    """
+    Task: Extract vehicle details from the problem description at the end.
+    - Normalize model names and technical details (e.g., Golf VII → Golf 7).
+    - If a detail can be reasonably inferred from the description (e.g., "Golf VII" → Brand: VW, Model: Golf 7), include it.
+    - If a detail cannot be identified or inferred with certainty, write "Unknown".
+    - Always respond in the same language as the description. Do not translate.
+
+    Response format (no extra words, no explanations):
+    <Translate "CAR_DETAILS" into the input language>:
+    - <Translate "Brand" into the input language>: ...
+    - <Translate "Model" into the input language>: ...
+    - <Translate "Engine" into the input language>: ...
+    - <Translate "Transmission" into the input language>: ...
+    - <Translate "Year" into the input language>: ...
+    """,
+    """
+    Description:
+    {description}
+    """,
+)
 
+
+def _build_prompt(state: Dict[str, Any]) -> str:
     description = state.get("description_text", "")
-    model_name = get_model_name("identify_car_agent", state)
+    return PROMPT.render(description=json.dumps(description, indent=2, ensure_ascii=False))
+
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("❌ Fehler im Identify-Car-Agent: %s", exc)
+    language = get_language_from_state(state)
+    fallback = fallback_car_details(state.get("description_text", ""), language)
+    return {"car_details": fallback, "warning": str(exc)}
+
+
+def _recognized(state: Dict[str, Any]) -> Dict[str, str] | None:
+    """Car details of a confidently recognized catalog vehicle, without a model call.
 
-    llm = ChatOllama(
-        model=model_name,
-        base_url="http://localhost:11434",
-        temperature=0,
+    Only for languages the fallback labels exist in; the model answers in
+    the description's language, the fallbacks otherwise in English.
+    """
+
+    threshold = get_min_confidence()
+    if threshold is None:
+        return None
+    language = get_language_from_state(state)
+    if not is_localized(language):
+        return None
+    description = state.get("description_text", "")
+    vehicle = analyse_description(description, language).vehicle
+    if vehicle.confidence < threshold:
+        return None
+    logger.info(
+        "🚗 Fahrzeug lokal erkannt: %s %s (Konfidenz %.2f) – Modellaufruf übersprungen.",
+        vehicle.brand,
+        vehicle.model_name,
+        vehicle.confidence,
     )
+    return {"car_details": fallback_car_details(description, language)}
+
 
-    prompt = f"""
-Task: Extract vehicle details from the following problem description.
-- Normalize model names and technical details (e.g., Golf VII → Golf 7).
-- If a detail can be reasonably inferred from the description (e.g., "Golf VII" → Brand: VW, Model: Golf 7), include it.
-- If a detail cannot be identified or inferred with certainty, write "Unknown".
-- Always respond in the same language as the description. Do not translate.
-
-Description:
-{json.dumps(description, indent=2, ensure_ascii=False)}
-
-Response format (no extra words, no explanations):
-<Translate "CAR_DETAILS" into the input language>:
-- <Translate "Brand" into the input language>: ...
-- <Translate "Model" into the input language>: ...
-- <Translate "Engine" into the input language>: ...
-- <Translate "Transmission" into the input language>: ...
-- <Translate "Year" into the input language>: ...
-"""
+def identify_car(state: Dict[str, Any]) -> Dict[str, str]:
+    """Extract normalized car details from the problem description."""
 
+    recognized = _recognized(state)
+    if recognized is not None:
+        return recognized
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        result = response.content.strip()
+        result = invoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
         return {"car_details": result}
     except Exception as exc:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im Identify-Car-Agent: %s", exc)
-        language = get_language_from_state(state)
-        fallback = fallback_car_details(description, language)
-        return {"car_details": fallback, "warning": str(exc)}
+        return _fallback(state, exc)
 
+
+async def aidentify_car(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`identify_car` bounded by the agent timeout."""
+
+    recognized = _recognized(state)
+    if recognized is not None:
+        return recognized
+    try:
+        result = await ainvoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
+        return {"car_details": result}
+    except Exception as exc:  # pylint: disable=broad-except
+        return _fallback(state, exc)
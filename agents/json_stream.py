@@ -0,0 +1,211 @@
+"""Tolerant parsing of JSON objects produced by the models.
+
+Small models in JSON mode still stop mid-object (``num_predict``, a timeout,
+a dropped stream) or wrap the object in prose or code fences. Instead of
+discarding the whole answer when ``json.loads`` fails,
+:class:`StreamingJSONParser` scans the text incrementally as it streams in
+and can close an unfinished object at any point:
+
+- an unterminated string value is closed (``partial_strings``) or dropped,
+- dangling commas, colons and keys without a value are removed, and
+- all open objects and arrays are closed.
+
+:func:`parse_json_object` does the same for a complete answer, and
+:class:`JSONParseStats` counts per agent how many answers were valid JSON,
+had to be salvaged or were lost, so the parse-failure rate can be watched
+(``GET /health``) instead of guessed.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Dict, List, Tuple
+
+
+# Outcomes of parsing one answer.
+PARSED = "parsed"
+SALVAGED = "salvaged"
+PLAIN = "plain"
+FAILED = "failed"
+OUTCOMES = (PARSED, SALVAGED, PLAIN, FAILED)
+
+
+class StreamingJSONParser:
+    """Incremental scanner for the first JSON object in a text stream."""
+
+    def __init__(self, partial_strings: bool = True):
+        self.partial_strings = partial_strings
+        self.text = ""
+        self._scanned = 0
+        self._start = -1
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        # Per open object: whether the next string is a key.
+        self._expect_key: List[bool] = []
+        self._string_is_key = False
+        # Last position where a member had just been completed, with the
+        # containers open at that point.
+        self._safe: Tuple[int, Tuple[str, ...]] | None = None
+        self._done = False
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Add *chunk* and return the best object parsed so far."""
+
+        self.text += chunk
+        self._scan()
+        return self.partial()
+
+    def _scan(self) -> None:
+        text = self.text
+        for index in range(self._scanned, len(text)):
+            if self._done:
+                break
+            char = text[index]
+            if self._start < 0:
+                if char == "{":
+                    self._start = index
+                    self._stack.append("{")
+                    self._expect_key.append(True)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = bool(self._stack[-1] == "{" and self._expect_key[-1])
+            elif char == ":" and self._stack[-1] == "{":
+                self._expect_key[-1] = False
+            elif char == ",":
+                self._safe = (index, tuple(self._stack))
+                if self._stack[-1] == "{":
+                    self._expect_key[-1] = True
+            elif char in "{[":
+                self._stack.append(char)
+                self._expect_key.append(char == "{")
+            elif char in "}]":
+                self._stack.pop()
+                self._expect_key.pop()
+                if not self._stack:
+                    self._done = True
+                    self._safe = (index + 1, ())
+                else:
+                    self._safe = (index + 1, tuple(self._stack))
+        self._scanned = len(text)
+
+    @staticmethod
+    def _closers(stack: Tuple[str, ...] | List[str]) -> str:
+        return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+    @staticmethod
+    def _loads(candidate: str) -> Dict[str, Any] | None:
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            return None
+        return value if isinstance(value, dict) else None
+
+    def _completions(self) -> List[str]:
+        body = self.text[self._start : self._scanned]
+        candidates = []
+        if self._in_string:
+            if self.partial_strings and not self._string_is_key:
+                value = body[:-1] if self._escape else body
+                candidates.append(value + '"' + self._closers(self._stack))
+        else:
+            trimmed = body.rstrip().rstrip(",")
+            candidates.append(trimmed + self._closers(self._stack))
+        if self._safe is not None:
+            end, stack = self._safe
+            candidates.append(self.text[self._start : end] + self._closers(stack))
+        return candidates
+
+    @property
+    def complete(self) -> bool:
+        """Whether a whole object has been read."""
+
+        return self._done
+
+    def partial(self) -> Dict[str, Any]:
+        if self._start < 0:
+            return {}
+        if self._done:
+            end, _ = self._safe
+            parsed = self._loads(self.text[self._start : end])
+            if parsed is not None:
+                return parsed
+        for candidate in self._completions():
+            parsed = self._loads(candidate)
+            if parsed is not None:
+                return parsed
+        return {}
+
+
+def parse_json_object(text: str, partial_strings: bool = True) -> Tuple[Dict[str, Any], str]:
+    """Return the first object in *text* and how it was obtained.
+
+    The outcome is :data:`PARSED` for valid JSON, :data:`SALVAGED` when the
+    object had to be cut out of surrounding text or completed, and
+    :data:`FAILED` (with an empty dict) when nothing could be recovered.
+    """
+
+    try:
+        value = json.loads(text)
+        if isinstance(value, dict):
+            return value, PARSED
+    except json.JSONDecodeError:
+        pass
+
+    parsed = StreamingJSONParser(partial_strings=partial_strings).feed(text)
+    return parsed, SALVAGED if parsed else FAILED
+
+
+class JSONParseStats:
+    """How the JSON answers of each agent could be parsed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, int]] = {}
+
+    def record(self, agent_key: str, outcome: str) -> None:
+        if outcome not in OUTCOMES:
+            raise ValueError(f"Unbekanntes Parse-Ergebnis: {outcome}")
+        with self._lock:
+            counts = self._agents.setdefault(agent_key, dict.fromkeys(OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            report = {}
+            for agent_key, counts in self._agents.items():
+                calls = sum(counts.values())
+                report[agent_key] = {
+                    "calls": calls,
+                    **counts,
+                    # Answers that were not valid JSON as returned ...
+                    "failure_rate": round((calls - counts[PARSED]) / calls, 3),
+                    # ... and those nothing could be recovered from.
+                    "lost_rate": round(counts[FAILED] / calls, 3),
+                }
+            return report
+
+
+_parse_stats = JSONParseStats()
+
+
+def record_parse(agent_key: str, outcome: str) -> None:
+    _parse_stats.record(agent_key, outcome)
+
+
+def json_parse_stats() -> Dict[str, Dict[str, Any]]:
+    """Parse outcomes per agent since the process started."""
+
+    return _parse_stats.snapshot()
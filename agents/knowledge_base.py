@@ -0,0 +1,472 @@
+"""Issue profiles and vehicle catalog for the rule-based fallbacks.
+
+Both live in versioned data files instead of Python literals:
+
+- ``data/issue_profiles.json``: ``{"version": 1, "profiles": [...]}``, each
+  profile with localized ``keywords``, ``behaviors``, ``causes``,
+  ``mechanic_steps``, ``user_advice`` and ``replaced_parts``;
+- ``data/vehicle_catalog.json``: ``{"version": 1, "makes": [...]}`` with the
+  brand, its aliases and known models, each with its own aliases and
+  optional generations (``{"7": ["7", "vii"]}``); a plain string is a model
+  whose only alias is its lower-case name.
+
+The profile source is compiled per language (with English as the default
+for missing translations) into a compact binary index in ``cache_dir``.
+The file name carries a hash of the source, so an edited source is
+recompiled on first use. An index is only built or opened when its
+language is first needed. It is memory-mapped, so only the pages a lookup
+touches are read, and decoded profiles are kept in a bounded LRU cache.
+
+Lookups use an inverted trigram index. Every keyword is filed under the
+rarest of its character trigrams; a description only verifies
+(``keyword in text``) the keywords filed under trigrams it contains. The
+cost grows with the description, not with the number of profiles, and the
+result equals testing every keyword (see ``benchmark_knowledge_base.py``).
+
+Settings live in the ``knowledge_base`` section of ``bots_settings.json``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Set, Tuple
+
+from .utils import load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+PROFILES_PATH = DATA_DIR / "issue_profiles.json"
+CATALOG_PATH = DATA_DIR / "vehicle_catalog.json"
+
+SOURCE_VERSION = 1
+
+_MAGIC = b"CDKB"
+_FORMAT = 1
+_HEADER = struct.Struct("<4sII")
+_ALIGN = 8
+
+# Keywords shorter than a trigram are checked for every description.
+_GRAM = 3
+
+_LOCALIZED_FIELDS = ("behaviors", "causes", "mechanic_steps", "user_advice")
+
+
+def _gram_key(gram: str) -> int:
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+def text_grams(text: str) -> Set[int]:
+    """The character trigrams of *text*, as index keys."""
+
+    return {_gram_key(text[index : index + _GRAM]) for index in range(len(text) - _GRAM + 1)}
+
+
+def _localized(entries: Mapping[str, Any], lang: str) -> Any:
+    return entries.get(lang) or entries.get("en", ())
+
+
+def load_source(path: Path, key: str) -> List[Dict[str, Any]]:
+    """Read a versioned data file and return its *key* list."""
+
+    with path.open(encoding="utf-8") as file:
+        data = json.load(file)
+    version = data.get("version")
+    if version != SOURCE_VERSION:
+        raise ValueError(f"{path}: Version {version} wird nicht unterstützt (erwartet {SOURCE_VERSION}).")
+    return list(data.get(key, []))
+
+
+# --- Binary keyword index --------------------------------------------------
+
+
+class _KeywordTable:
+    """Keyword → value ids, laid out as arrays for the index file.
+
+    Sections: ``grams`` (sorted trigram keys), ``gram_starts`` and
+    ``gram_keywords`` (keyword ids per trigram), ``short`` (keywords without
+    a trigram), ``kw_starts`` (offsets of the keyword strings in ``text``),
+    ``val_starts`` and ``values`` (value ids per keyword).
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[str, int]]):
+        values: Dict[str, List[int]] = {}
+        for keyword, value in pairs:
+            if keyword:
+                bucket = values.setdefault(keyword, [])
+                if value not in bucket:
+                    bucket.append(value)
+        self.keywords = list(values)
+        self.values = [values[keyword] for keyword in self.keywords]
+
+    def sections(self, prefix: str) -> Dict[str, array | bytes]:
+        frequency = Counter(gram for keyword in self.keywords for gram in text_grams(keyword))
+        filed: Dict[int, List[int]] = {}
+        short = array("I")
+        for keyword_id, keyword in enumerate(self.keywords):
+            grams = text_grams(keyword)
+            if not grams:
+                short.append(keyword_id)
+                continue
+            rarest = min(grams, key=lambda gram: (frequency[gram], gram))
+            filed.setdefault(rarest, []).append(keyword_id)
+
+        grams = array("Q", sorted(filed))
+        gram_starts, gram_keywords = array("I", [0]), array("I")
+        for gram in grams:
+            gram_keywords.extend(filed[gram])
+            gram_starts.append(len(gram_keywords))
+
+        text = bytearray()
+        kw_starts, val_starts, value_ids = array("I", [0]), array("I", [0]), array("I")
+        for keyword, keyword_values in zip(self.keywords, self.values):
+            text += keyword.encode("utf-8")
+            kw_starts.append(len(text))
+            value_ids.extend(keyword_values)
+            val_starts.append(len(value_ids))
+
+        return {
+            f"{prefix}.grams": grams,
+            f"{prefix}.gram_starts": gram_starts,
+            f"{prefix}.gram_keywords": gram_keywords,
+            f"{prefix}.short": short,
+            f"{prefix}.kw_starts": kw_starts,
+            f"{prefix}.text": bytes(text),
+            f"{prefix}.val_starts": val_starts,
+            f"{prefix}.values": value_ids,
+        }
+
+
+def _blob_sections(prefix: str, items: Sequence[bytes]) -> Dict[str, array | bytes]:
+    starts = array("I", [0])
+    blob = bytearray()
+    for item in items:
+        blob += item
+        starts.append(len(blob))
+    return {f"{prefix}.starts": starts, f"{prefix}.data": bytes(blob)}
+
+
+def _write_index(path: Path, sections: Dict[str, array | bytes]) -> None:
+    """Write *sections* behind a JSON table of contents, 8-byte aligned."""
+
+    layout: Dict[str, List[Any]] = {}
+    offset = 0
+    for name, section in sections.items():
+        size = len(section) * section.itemsize if isinstance(section, array) else len(section)
+        typecode = section.typecode if isinstance(section, array) else "B"
+        layout[name] = [offset, size, typecode]
+        offset += size + (-size % _ALIGN)
+    toc = json.dumps({"byteorder": sys.byteorder, "sections": layout}).encode("utf-8")
+    base = _HEADER.size + len(toc)
+    base += -base % _ALIGN
+
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with tmp_path.open("wb") as file:
+        file.write(_HEADER.pack(_MAGIC, _FORMAT, len(toc)))
+        file.write(toc)
+        file.write(b"\0" * (base - _HEADER.size - len(toc)))
+        for section in sections.values():
+            data = section.tobytes() if isinstance(section, array) else section
+            file.write(data)
+            file.write(b"\0" * (-len(data) % _ALIGN))
+    tmp_path.replace(path)
+
+
+def compile_profiles(profiles: Sequence[Mapping[str, Any]], lang: str, path: Path) -> None:
+    """Compile the *lang* view of *profiles* into an index file at *path*."""
+
+    payloads = []
+    part_labels: Dict[str, int] = {}
+    part_pairs: List[Tuple[str, int]] = []
+    for profile in profiles:
+        payload = {"id": profile.get("id", "")}
+        for field in _LOCALIZED_FIELDS:
+            payload[field] = list(_localized(profile.get(field, {}), lang))
+        payloads.append(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+        for entry in _localized(profile.get("replaced_parts", {}), lang):
+            label = str(entry.get("label", "")).strip()
+            if label:
+                label_id = part_labels.setdefault(label, len(part_labels))
+                part_pairs.extend((keyword, label_id) for keyword in entry.get("keywords", ()))
+
+    sections: Dict[str, array | bytes] = {}
+    sections.update(
+        _KeywordTable(
+            (keyword, index)
+            for index, profile in enumerate(profiles)
+            for keyword in _localized(profile.get("keywords", {}), lang)
+        ).sections("profile_keywords")
+    )
+    sections.update(_KeywordTable(part_pairs).sections("part_keywords"))
+    sections.update(_blob_sections("profiles", payloads))
+    sections.update(_blob_sections("parts", [label.encode("utf-8") for label in part_labels]))
+    _write_index(path, sections)
+
+
+class _KeywordLookup:
+    """Read side of :class:`_KeywordTable` over memory-mapped sections."""
+
+    def __init__(self, index: "ProfileIndex", prefix: str):
+        section = index.section
+        self.grams = section(f"{prefix}.grams")
+        self.gram_starts = section(f"{prefix}.gram_starts")
+        self.gram_keywords = section(f"{prefix}.gram_keywords")
+        self.short = section(f"{prefix}.short")
+        self.kw_starts = section(f"{prefix}.kw_starts")
+        self.text = section(f"{prefix}.text")
+        self.val_starts = section(f"{prefix}.val_starts")
+        self.values = section(f"{prefix}.values")
+
+    def __len__(self) -> int:
+        return len(self.kw_starts) - 1
+
+    def _keyword(self, keyword_id: int) -> str:
+        return bytes(self.text[self.kw_starts[keyword_id] : self.kw_starts[keyword_id + 1]]).decode(
+            "utf-8"
+        )
+
+    def find(self, text: str, grams: Set[int]) -> List[int]:
+        """Sorted value ids of all keywords contained in *text*."""
+
+        size = len(self.grams)
+        if size <= len(grams):
+            # Small index: walk its trigrams instead of searching for the text's.
+            positions = [position for position, gram in enumerate(self.grams) if gram in grams]
+        else:
+            positions = []
+            for gram in grams:
+                position = bisect_left(self.grams, gram)
+                if position < size and self.grams[position] == gram:
+                    positions.append(position)
+        candidates = set(self.short)
+        for position in positions:
+            candidates.update(
+                self.gram_keywords[self.gram_starts[position] : self.gram_starts[position + 1]]
+            )
+        found: Set[int] = set()
+        for keyword_id in candidates:
+            if self._keyword(keyword_id) in text:
+                found.update(self.values[self.val_starts[keyword_id] : self.val_starts[keyword_id + 1]])
+        return sorted(found)
+
+
+class ProfileIndex:
+    """A compiled, memory-mapped profile index for one language."""
+
+    def __init__(self, path: Path, profile_cache_size: int = 256):
+        self.path = path
+        self._file = path.open("rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, toc_size = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or file_format != _FORMAT:
+            raise ValueError(f"{path}: kein gültiger Wissensbasis-Index.")
+        toc = json.loads(self._map[_HEADER.size : _HEADER.size + toc_size])
+        if toc["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path}: Index wurde auf einer anderen Plattform erstellt.")
+        self._base = _HEADER.size + toc_size + (-(_HEADER.size + toc_size) % _ALIGN)
+        self._sections = toc["sections"]
+        self._view = memoryview(self._map)
+
+        self._profiles = _KeywordLookup(self, "profile_keywords")
+        self._parts = _KeywordLookup(self, "part_keywords")
+        self._profile_starts = self.section("profiles.starts")
+        self._profile_data = self.section("profiles.data")
+        self._part_starts = self.section("parts.starts")
+        self._part_data = self.section("parts.data")
+        self.profile = lru_cache(maxsize=profile_cache_size)(self._load_profile)
+
+    def section(self, name: str) -> memoryview:
+        offset, size, typecode = self._sections[name]
+        view = self._view[self._base + offset : self._base + offset + size]
+        return view.cast(typecode) if typecode != "B" else view
+
+    def __len__(self) -> int:
+        return len(self._profile_starts) - 1
+
+    @property
+    def keyword_count(self) -> int:
+        return len(self._profiles)
+
+    def _load_profile(self, profile_id: int) -> Dict[str, Any]:
+        start, end = self._profile_starts[profile_id], self._profile_starts[profile_id + 1]
+        return json.loads(bytes(self._profile_data[start:end]))
+
+    def match(self, text: str, grams: Set[int] | None = None) -> List[int]:
+        """Ids of the profiles with a keyword in the normalized *text*, in source order."""
+
+        return self._profiles.find(text, grams if grams is not None else text_grams(text))
+
+    def replaced_parts(self, text: str, grams: Set[int] | None = None) -> List[str]:
+        """Labels of the replaceable parts mentioned in *text*, in source order."""
+
+        label_ids = self._parts.find(text, grams if grams is not None else text_grams(text))
+        return [
+            bytes(self._part_data[self._part_starts[label] : self._part_starts[label + 1]]).decode(
+                "utf-8"
+            )
+            for label in label_ids
+        ]
+
+
+# --- Vehicle catalog -------------------------------------------------------
+
+
+def _catalog_model(model: str | Mapping[str, Any]) -> Dict[str, Any]:
+    if isinstance(model, str):
+        return {"name": model.upper(), "aliases": (model.lower(),), "generations": {}}
+    name = str(model["name"])
+    return {
+        "name": name,
+        "aliases": tuple(model.get("aliases") or (name.lower(),)),
+        "generations": {
+            str(label): tuple(aliases) for label, aliases in (model.get("generations") or {}).items()
+        },
+    }
+
+
+class VehicleCatalog:
+    """Makes with their aliases and models from ``vehicle_catalog.json``."""
+
+    def __init__(self, makes: Sequence[Mapping[str, Any]]):
+        self.makes: Tuple[Dict[str, Any], ...] = tuple(
+            {
+                "brand": str(make["brand"]),
+                "aliases": tuple(make.get("aliases") or (str(make["brand"]).lower(),)),
+                "models": tuple(_catalog_model(model) for model in make.get("models", ())),
+            }
+            for make in makes
+        )
+        # Aliases in catalog order: an alias shared by two makes belongs to the first.
+        self.aliases: Dict[str, Dict[str, Any]] = {}
+        for make in self.makes:
+            for alias in make["aliases"]:
+                self.aliases.setdefault(alias, make)
+
+    def __len__(self) -> int:
+        return len(self.makes)
+
+
+# --- Knowledge base --------------------------------------------------------
+
+
+def _source_digest(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()[:12]
+
+
+class KnowledgeBase:
+    """Lazily compiled, per-language profile indexes plus the vehicle catalog."""
+
+    def __init__(
+        self,
+        profiles_path: Path = PROFILES_PATH,
+        catalog_path: Path = CATALOG_PATH,
+        cache_dir: Path = Path("kb_cache"),
+        profile_cache_size: int = 256,
+    ):
+        self.profiles_path = Path(profiles_path)
+        self.catalog_path = Path(catalog_path)
+        self.cache_dir = Path(cache_dir)
+        self.profile_cache_size = profile_cache_size
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, ProfileIndex] = {}
+        self._catalog: VehicleCatalog | None = None
+
+    def index_path(self, lang: str) -> Path:
+        # The file format is part of the name, so a format change recompiles.
+        digest = _source_digest(self.profiles_path)
+        return self.cache_dir / f"{self.profiles_path.stem}.{lang}.{digest}.f{_FORMAT}.kbi"
+
+    def build(self, lang: str) -> Path:
+        """Compile the index for *lang* (if it is not up to date) and return its path."""
+
+        path = self.index_path(lang)
+        if path.exists():
+            return path
+        profiles = load_source(self.profiles_path, "profiles")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        compile_profiles(profiles, lang, path)
+        for stale in self.cache_dir.glob(f"{self.profiles_path.stem}.{lang}.*.kbi"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+        logger.info("📚 Wissensbasis für %s kompiliert: %s Profile → %s", lang, len(profiles), path)
+        return path
+
+    def profiles(self, lang: str) -> ProfileIndex:
+        """The profile index for *lang*, compiled and opened on first use."""
+
+        index = self._indexes.get(lang)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._indexes.get(lang)
+            if index is None:
+                path = self.build(lang)
+                try:
+                    index = ProfileIndex(path, self.profile_cache_size)
+                except ValueError as exc:
+                    # Written by another version or platform: compile it anew.
+                    logger.warning("⚠️ Wissensbasis-Index unbrauchbar, wird neu kompiliert: %s", exc)
+                    path.unlink(missing_ok=True)
+                    index = ProfileIndex(self.build(lang), self.profile_cache_size)
+                self._indexes[lang] = index
+        return index
+
+    @property
+    def catalog(self) -> VehicleCatalog:
+        if self._catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = VehicleCatalog(load_source(self.catalog_path, "makes"))
+        return self._catalog
+
+
+@lru_cache(maxsize=1)
+def get_knowledge_base() -> KnowledgeBase:
+    """Return the knowledge base shared by all fallbacks."""
+
+    settings = load_bot_settings().get("knowledge_base")
+    settings = settings if isinstance(settings, dict) else {}
+    return KnowledgeBase(
+        profiles_path=Path(settings.get("profiles_path") or PROFILES_PATH),
+        catalog_path=Path(settings.get("catalog_path") or CATALOG_PATH),
+        cache_dir=Path(settings.get("cache_dir", "kb_cache")),
+        profile_cache_size=settings.get("profile_cache_size", 256),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compile the fallback knowledge base.")
+    parser.add_argument(
+        "--languages", nargs="+", default=["en", "de"], help="Languages to compile."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    knowledge_base = get_knowledge_base()
+    for lang in args.languages:
+        index = knowledge_base.profiles(lang)
+        print(
+            f"{lang}: {len(index)} Profile, {index.keyword_count} Schlüsselwörter, "
+            f"{index.path.stat().st_size} Bytes → {index.path}"
+        )
+    print(f"Fahrzeugkatalog: {len(knowledge_base.catalog)} Marken")
+
+
+if __name__ == "__main__":
+    main()
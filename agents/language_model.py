@@ -0,0 +1,76 @@
+"""Compact character n-gram language identification for the supported languages.
+
+``langdetect`` loads profiles for more than 50 languages on first use and
+samples its n-grams randomly, which is slow for what the agents need: picking
+one of the handful of languages the fallback phrases exist for. This module
+builds a naive Bayes model over the 1-3 character n-grams of only those
+languages (taken from the profiles shipped with ``langdetect``) and scores a
+text with a single matrix lookup.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langdetect.detector_factory import PROFILES_DIRECTORY
+
+
+PROFILE_DIR = Path(PROFILES_DIRECTORY)
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def _ngrams(text: str) -> List[str]:
+    grams: List[str] = []
+    for word in _WORD_PATTERN.findall(text):
+        padded = f" {word} "
+        for size in (1, 2, 3):
+            for start in range(len(padded) - size + 1):
+                gram = padded[start : start + size]
+                if gram != " ":
+                    grams.append(gram)
+    return grams
+
+
+class NgramLanguageModel:
+    """Naive Bayes language scorer restricted to *languages*.
+
+    :meth:`detect` returns the best language and a confidence in ``[0, 1]``
+    (the average per-n-gram log-likelihood lead over the runner-up, squashed),
+    so callers can fall back to a slower detector for ambiguous input.
+    """
+
+    def __init__(self, languages: Iterable[str], profile_dir: Path = PROFILE_DIR):
+        self.languages: Tuple[str, ...] = tuple(languages)
+        profiles = []
+        for language in self.languages:
+            with (profile_dir / language).open(encoding="utf-8") as file:
+                profiles.append(json.load(file))
+
+        vocabulary = sorted({gram for profile in profiles for gram in profile["freq"]})
+        self._index: Dict[str, int] = {gram: row for row, gram in enumerate(vocabulary)}
+        self._log_probs = np.empty((len(vocabulary), len(self.languages)), dtype=np.float32)
+        for column, profile in enumerate(profiles):
+            totals = profile["n_words"]
+            frequencies = profile["freq"]
+            for gram, row in self._index.items():
+                # Half a count for n-grams the language never produced.
+                count = frequencies.get(gram, 0.5)
+                self._log_probs[row, column] = math.log(count / totals[len(gram) - 1])
+
+    def detect(self, text: str) -> Tuple[str | None, float]:
+        rows = [self._index[gram] for gram in _ngrams(text) if gram in self._index]
+        if not rows:
+            return None, 0.0
+
+        scores = self._log_probs[rows].sum(axis=0)
+        ranking = np.argsort(scores)[::-1]
+        best, runner_up = ranking[0], ranking[1] if len(ranking) > 1 else ranking[0]
+        lead = float(scores[best] - scores[runner_up]) / len(rows)
+        confidence = 1.0 - math.exp(-lead * 4) if len(ranking) > 1 else 1.0
+        return self.languages[best], round(confidence, 3)
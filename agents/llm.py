@@ -0,0 +1,263 @@
+"""Shared helpers for calling the local Ollama models from the agents."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict
+
+from langchain_core.messages import HumanMessage
+
+from .circuit_breaker import check_ollama, ollama_call
+from .llm_cache import get_llm_cache, is_cacheable, make_cache_key
+from .ollama_pool import OLLAMA_BASE_URL, PooledChatOllama, get_chat_model
+from .prompts import observe_prompt_eval
+from .residency import get_residency_manager
+from .router import get_router
+from .scheduler import get_scheduler
+from .utils import get_agent_timeout, get_model_name
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def model_slot(model_name: str):
+    """Wait for the scheduler to admit a call to *model_name*.
+
+    Yields the seconds spent waiting for the slot.
+    """
+
+    with get_scheduler().slot(model_name) as waited:
+        yield waited
+
+
+@asynccontextmanager
+async def amodel_slot(model_name: str):
+    """Async variant of :func:`model_slot` that never blocks the event loop."""
+
+    async with get_scheduler().aslot(model_name) as waited:
+        yield waited
+
+
+def create_llm(
+    agent_key: str,
+    state: Dict[str, Any] | None,
+    temperature: float = 0,
+    model: str | None = None,
+    **options: Any,
+) -> PooledChatOllama:
+    """Return the shared chat model for *agent_key* and the tier selected for *state*.
+
+    An explicit *model* wins; otherwise the latency router picks the model
+    when it has throughput data for the candidates, and the complexity
+    heuristic decides when it has none. Additional *options* (e.g.
+    ``format="json"``) are passed to ``ChatOllama``.
+    """
+
+    router = get_router()
+    if model is None and router is not None:
+        model = router.route(agent_key, state)
+    return get_chat_model(
+        model or get_model_name(agent_key, state), OLLAMA_BASE_URL, temperature, **options
+    )
+
+
+def _call_options(model: str, response_format: str | Dict[str, Any] | None) -> Dict[str, Any]:
+    """Per-call request fields: ``keep_alive`` and the answer ``format``.
+
+    ``keep_alive`` is chosen by the residency manager; the format is passed
+    per call because ChatOllama only accepts a string in its constructor.
+    """
+
+    options: Dict[str, Any] = {}
+    residency = get_residency_manager()
+    if residency is not None:
+        options["keep_alive"] = residency.before_call(model)
+    if response_format is not None:
+        options["format"] = response_format
+    return options
+
+
+def _format_options(response_format: str | Dict[str, Any] | None) -> Dict[str, Any]:
+    """Cache key options for *response_format*."""
+
+    return {"format": response_format} if response_format is not None else {}
+
+
+def _observe_response(
+    agent_key: str,
+    model: str,
+    metadata: Dict[str, Any] | None,
+    queue_wait: float,
+    prompt: str,
+) -> None:
+    """Feed the response metadata to the prompt statistics, residency and router."""
+
+    if not metadata:
+        return
+    observe_prompt_eval(agent_key, model, metadata, len(prompt))
+    residency = get_residency_manager()
+    if residency is not None:
+        residency.observe_response(model, metadata)
+    router = get_router()
+    if router is not None:
+        router.observe(model, metadata, queue_wait, agent_key)
+
+
+class _CachedCall:
+    """Cache lookup for a single call; a no-op when caching does not apply."""
+
+    def __init__(
+        self,
+        agent_key: str,
+        llm: PooledChatOllama,
+        prompt: str,
+        temperature: float,
+        options: Dict[str, Any],
+        enabled: bool,
+    ):
+        self.cache = get_llm_cache() if enabled and is_cacheable(agent_key, temperature) else None
+        self.model = llm.model
+        self.key = ""
+        if self.cache is not None:
+            self.key = make_cache_key(llm.model, prompt, {"temperature": temperature, **options})
+
+    def lookup(self) -> str | None:
+        if self.cache is None:
+            return None
+        return self.cache.get(self.key)
+
+    def store(self, response: str) -> None:
+        if self.cache is not None and response:
+            self.cache.set(self.key, self.model, response)
+
+
+def invoke_llm(
+    agent_key: str,
+    state: Dict[str, Any] | None,
+    prompt: str,
+    temperature: float = 0,
+    cache: bool = True,
+    model: str | None = None,
+    response_format: str | Dict[str, Any] | None = None,
+    **options: Any,
+) -> str:
+    """Send *prompt* to the agent's model and return the stripped answer.
+
+    Deterministic calls are answered from the response cache when possible;
+    pass ``cache=False`` to force a fresh generation. *model* overrides the
+    tier selection. *response_format* is sent as Ollama's ``format`` field:
+    ``"json"`` or a JSON schema the answer has to follow.
+    """
+
+    llm = create_llm(agent_key, state, temperature, model, **options)
+    cached_call = _CachedCall(
+        agent_key, llm, prompt, temperature, {**options, **_format_options(response_format)}, cache
+    )
+    cached = cached_call.lookup()
+    if cached is not None:
+        return cached
+
+    call_options = _call_options(llm.model, response_format)
+    check_ollama()
+    with model_slot(llm.model) as waited, ollama_call():
+        response = llm.invoke([HumanMessage(content=prompt)], **call_options)
+    _observe_response(agent_key, llm.model, response.response_metadata, waited, prompt)
+    result = response.content.strip()
+    cached_call.store(result)
+    return result
+
+
+def stream_llm(
+    agent_key: str,
+    state: Dict[str, Any] | None,
+    prompt: str,
+    on_token: Callable[[str], None],
+    temperature: float = 0,
+    cache: bool = True,
+    model: str | None = None,
+    response_format: str | Dict[str, Any] | None = None,
+) -> str:
+    """Stream the answer through ``ChatOllama.stream``.
+
+    Every non-empty chunk is handed to *on_token* as soon as it arrives; the
+    complete, stripped answer is returned once the model is done. A cached
+    answer is handed over as a single token.
+    """
+
+    llm = create_llm(agent_key, state, temperature, model)
+    cached_call = _CachedCall(
+        agent_key, llm, prompt, temperature, _format_options(response_format), cache
+    )
+    cached = cached_call.lookup()
+    if cached is not None:
+        on_token(cached)
+        return cached
+
+    parts = []
+    call_options = _call_options(llm.model, response_format)
+    check_ollama()
+    with model_slot(llm.model) as waited, ollama_call():
+        for chunk in llm.stream([HumanMessage(content=prompt)], **call_options):
+            token = chunk.content
+            if token:
+                parts.append(token)
+                on_token(token)
+            elif chunk.response_metadata:
+                _observe_response(
+                    agent_key, llm.model, chunk.response_metadata, waited, prompt
+                )
+    result = "".join(parts).strip()
+    cached_call.store(result)
+    return result
+
+
+async def ainvoke_llm(
+    agent_key: str,
+    state: Dict[str, Any] | None,
+    prompt: str,
+    temperature: float = 0,
+    timeout: float | None = None,
+    cache: bool = True,
+    model: str | None = None,
+    response_format: str | Dict[str, Any] | None = None,
+) -> str:
+    """Async counterpart of :func:`invoke_llm`.
+
+    The call is cancelled after *timeout* seconds (defaulting to the agent's
+    entry in the ``timeouts`` section of ``bots_settings.json``) and raises
+    :class:`asyncio.TimeoutError`, which the agents route to their fallbacks.
+    """
+
+    llm = create_llm(agent_key, state, temperature, model)
+    cached_call = _CachedCall(
+        agent_key, llm, prompt, temperature, _format_options(response_format), cache
+    )
+    cached = cached_call.lookup()
+    if cached is not None:
+        return cached
+
+    deadline = timeout if timeout is not None else get_agent_timeout(agent_key)
+
+    call_options = _call_options(llm.model, response_format)
+
+    async def call():
+        async with amodel_slot(llm.model) as waited:
+            # A deadline cancels the request with CancelledError, which the
+            # breaker does not count.
+            with ollama_call():
+                response = await llm.ainvoke([HumanMessage(content=prompt)], **call_options)
+        return response, waited
+
+    check_ollama()
+    try:
+        response, waited = await asyncio.wait_for(call(), timeout=deadline)
+    except asyncio.TimeoutError:
+        logger.warning("⏰ Zeitlimit von %ss für %s überschritten.", deadline, agent_key)
+        raise
+    _observe_response(agent_key, llm.model, response.response_metadata, waited, prompt)
+    result = response.content.strip()
+    cached_call.store(result)
+    return result
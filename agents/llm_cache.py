@@ -0,0 +1,162 @@
+"""Persistent, content-addressed cache for deterministic LLM answers."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict
+
+from .utils import load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model: str, prompt: str, options: Dict[str, Any]) -> str:
+    """Hash of model name, rendered prompt and generation options."""
+
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "options": options},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite backed response cache with TTL and size based eviction.
+
+    Entries older than *ttl_seconds* are treated as misses and removed; once
+    more than *max_entries* are stored, the least recently used ones are
+    evicted. All methods are safe to call from several threads.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, ttl_seconds: float | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl_seconds:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        if self.max_entries:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> LLMCache | None:
+    """Return the shared cache configured in ``bots_settings.json``.
+
+    ``None`` when the ``cache`` section is missing or disabled, or when the
+    database cannot be opened.
+    """
+
+    settings = load_bot_settings().get("cache")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+
+    try:
+        return LLMCache(
+            settings.get("path", "llm_cache.sqlite3"),
+            max_entries=int(settings.get("max_entries", 5000)),
+            ttl_seconds=settings.get("ttl_seconds"),
+        )
+    except sqlite3.Error as exc:
+        logger.warning("⚠️ LLM-Cache konnte nicht geöffnet werden: %s", exc)
+        return None
+
+
+def is_cacheable(agent_key: str, temperature: float) -> bool:
+    """Only deterministic calls of agents not listed in ``bypass_agents`` are cached."""
+
+    if temperature:
+        return False
+    settings = load_bot_settings().get("cache", {})
+    return agent_key not in settings.get("bypass_agents", ())
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the shared cache (empty when disabled)."""
+
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {}
@@ -6,49 +6,69 @@ import json
 import logging
 from typing import Any, Dict
 
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
-
 from .fallbacks import fallback_changed_parts
-from .utils import get_language_from_state, get_model_name, localize_phrase
+from .llm import ainvoke_llm, invoke_llm
+from .prompts import register_prompt
+from .utils import get_language_from_state, localize_phrase
 
 
 logger = logging.getLogger(__name__)
 
 
+AGENT_KEY = "new_parts_agent"
+
+
+PROMPT = register_prompt(
+    "new_parts",
+    """
+    Task: Extract only the parts that the user explicitly mentions as already replaced, exchanged, or newly installed in the description at the end.
+    Normalize all mentioned parts to their standard automotive part names.
+    Do not include broken, old, or suggested parts.
+    Always respond in the same language as the description. Do not translate into another language.
+
+    Response format (no explanations, no extra text):
+    <Translate "NEW_PARTS" into the input language>:
+    - part1
+    - part2
+    - part3
+
+    If no replaced parts are mentioned, respond exactly with the translated
+    equivalent of "NEW_PARTS: None" in the input language.
+    """,
+    """
+    Description:
+    {description}
+    """,
+)
+
+
+def _build_prompt(state: Dict[str, Any]) -> str:
+    description = state.get("description_text", "")
+    return PROMPT.render(description=json.dumps(description, indent=2, ensure_ascii=False))
+
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("❌ Fehler im New-Parts-Agent: %s", exc)
+    language = get_language_from_state(state)
+    fallback = fallback_changed_parts(state.get("description_text", ""), language)
+    if not fallback:
+        fallback = localize_phrase("new_parts_none", language)
+    return {"changed_parts": fallback, "warning": str(exc)}
+
+
 def new_parts(state: Dict[str, Any]) -> Dict[str, str]:
-    llm = ChatOllama(
-        model=get_model_name("new_parts_agent", state),
-        base_url="http://localhost:11434",
-        temperature=0,
-    )
-
-    prompt = f"""
-Task: Extract only the parts that the user explicitly mentions as already replaced, exchanged, or newly installed.
-Normalize all mentioned parts to their standard automotive part names.
-Do not include broken, old, or suggested parts.
-Always respond in the same language as the description. Do not translate into another language.
-
-Description:
-{json.dumps(state.get('description_text', ''), indent=2, ensure_ascii=False)}
-
-Response format (no explanations, no extra text):
-<Translate "NEW_PARTS" into the input language>:
-- part1
-- part2
-- part3
-
-If no replaced parts are mentioned, respond exactly with the translated
-equivalent of "NEW_PARTS: None" in the input language.
-"""
+    try:
+        result = invoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
+        return {"changed_parts": result}
+    except Exception as exc:  # pylint: disable=broad-except
+        return _fallback(state, exc)
+
+
+async def anew_parts(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`new_parts` bounded by the agent timeout."""
 
     try:
-        result = llm.invoke([HumanMessage(content=prompt)]).content.strip()
+        result = await ainvoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
         return {"changed_parts": result}
     except Exception as exc:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im New-Parts-Agent: %s", exc)
-        language = get_language_from_state(state)
-        fallback = fallback_changed_parts(state.get("description_text", ""), language)
-        if not fallback:
-            fallback = localize_phrase("new_parts_none", language)
-        return {"changed_parts": fallback, "warning": str(exc)}
+        return _fallback(state, exc)
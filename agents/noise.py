@@ -6,30 +6,24 @@ import json
 import logging
 from typing import Any, Dict
 
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
-
-from .utils import get_language_from_state, get_model_name, localize_phrase
+from .llm import ainvoke_llm, invoke_llm
+from .prompts import register_prompt
+from .utils import get_language_from_state, localize_phrase
 
 
 logger = logging.getLogger(__name__)
 
 
-def noise(state: Dict[str, Any]) -> Dict[str, str]:
-    llm = ChatOllama(
-        model=get_model_name("noise_agent", state),
-        base_url="http://localhost:11434",
-        temperature=0,
-    )
-
-    prompt = f"""
-    Task: Extract only noise- or sound-related information from the following user description.
+AGENT_KEY = "noise_agent"
+
+
+PROMPT = register_prompt(
+    "noise",
+    """
+    Task: Extract only noise- or sound-related information from the user description at the end.
     Ignore all unrelated information. If no noise is described, respond with the translation of "NOISES: None".
     Always respond in the same language as the description. Do not translate into another language.
 
-    Description:
-    {json.dumps(state.get('description_text', ''), indent=2, ensure_ascii=False)}
-
     Response format (no explanations, no extra text):
     <Translate "NOISES" into the input language>:
     1. <Translate "Sound" into the input language>: ...
@@ -40,13 +34,38 @@ def noise(state: Dict[str, Any]) -> Dict[str, str]:
     If multiple noises are described, list them as 1, 2, 3, ...
     If no noises are described, respond exactly with the translated
     equivalent of "NOISES: None" in the input language.
+    """,
     """
+    Description:
+    {description}
+    """,
+)
+
+
+def _build_prompt(state: Dict[str, Any]) -> str:
+    description = state.get("description_text", "")
+    return PROMPT.render(description=json.dumps(description, indent=2, ensure_ascii=False))
 
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("❌ Fehler im Noise-Agent: %s", exc)
+    language = get_language_from_state(state)
+    return {"noises": localize_phrase("noise_none", language), "warning": str(exc)}
+
+
+def noise(state: Dict[str, Any]) -> Dict[str, str]:
     try:
-        result = llm.invoke([HumanMessage(content=prompt)]).content.strip()
+        result = invoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
         return {"noises": result}
     except Exception as exc:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im Noise-Agent: %s", exc)
-        language = get_language_from_state(state)
-        return {"noises": localize_phrase("noise_none", language), "warning": str(exc)}
+        return _fallback(state, exc)
+
 
+async def anoise(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`noise` bounded by the agent timeout."""
+
+    try:
+        result = await ainvoke_llm(AGENT_KEY, state, _build_prompt(state), temperature=0)
+        return {"noises": result}
+    except Exception as exc:  # pylint: disable=broad-except
+        return _fallback(state, exc)
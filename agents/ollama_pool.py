@@ -0,0 +1,229 @@
+"""Shared ``ChatOllama`` clients with pooled HTTP connections.
+
+``langchain_community``'s ``ChatOllama`` opens a new connection for every
+request (``requests.post`` and a fresh ``aiohttp.ClientSession`` per call).
+:class:`PooledChatOllama` sends the same payload through one shared
+``requests.Session``, so consecutive agent calls reuse keep-alive
+connections. Async calls share one ``aiohttp.ClientSession`` inside an
+:func:`async_http_session` block. :func:`get_chat_model` hands out one client
+per ``(base_url, model, temperature, options)``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import requests
+from langchain_community.chat_models import ChatOllama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+POOL_SIZE = 16
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str, float, str], "PooledChatOllama"] = {}
+_http_session: requests.Session | None = None
+_async_session: ContextVar[aiohttp.ClientSession | None] = ContextVar(
+    "ollama_async_session", default=None
+)
+
+
+def get_http_session() -> requests.Session:
+    """Return the shared, connection-pooling ``requests`` session."""
+
+    global _http_session
+
+    with _lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
+
+
+@asynccontextmanager
+async def async_http_session():
+    """Share one ``aiohttp`` session among all async Ollama calls in the block.
+
+    The session belongs to the running event loop and is closed on exit;
+    tasks started inside the block (e.g. via ``asyncio.gather``) inherit it.
+    Nested blocks reuse the outer session.
+    """
+
+    if _async_session.get() is not None:
+        yield
+        return
+
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=POOL_SIZE))
+    token = _async_session.set(session)
+    try:
+        yield
+    finally:
+        _async_session.reset(token)
+        await session.close()
+
+
+class OllamaServerError(ValueError):
+    """Ollama answered with a 5xx status (overloaded or crashed runner)."""
+
+
+def _raise_for_status(status: int, model: str, detail: str) -> None:
+    if status >= 500:
+        raise OllamaServerError(
+            f"Ollama call failed with status code {status}. Details: {detail}"
+        )
+    if status == 404:
+        raise OllamaEndpointNotFoundError(
+            "Ollama call failed with status code 404. "
+            "Maybe your model is not found "
+            f"and you should pull the model with `ollama pull {model}`."
+        )
+    raise ValueError(f"Ollama call failed with status code {status}. Details: {detail}")
+
+
+class PooledChatOllama(ChatOllama):
+    """``ChatOllama`` that sends its requests through the shared HTTP sessions."""
+
+    def _request_payload(
+        self, payload: Any, stop: Optional[List[str]], kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        # Same payload as ChatOllama._create_stream builds.
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            return {"messages": payload.get("messages", []), **params}
+        return {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            **(self.headers if isinstance(self.headers, dict) else {}),
+        }
+
+    def _create_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[str]:
+        response = get_http_session().post(
+            url=api_url,
+            headers=self._headers(),
+            auth=self.auth,
+            json=self._request_payload(payload, stop, kwargs),
+            stream=True,
+            timeout=self.timeout,
+        )
+        response.encoding = "utf-8"
+        if response.status_code != 200:
+            _raise_for_status(response.status_code, self.model, response.text)
+        return response.iter_lines(decode_unicode=True)
+
+    async def _acreate_stream(
+        self,
+        api_url: str,
+        payload: Any,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        request_payload = self._request_payload(payload, stop, kwargs)
+        session = _async_session.get()
+        if session is not None:
+            async for line in self._apost(session, api_url, request_payload):
+                yield line
+            return
+
+        # Outside of async_http_session() behave like ChatOllama.
+        async with aiohttp.ClientSession() as own_session:
+            async for line in self._apost(own_session, api_url, request_payload):
+                yield line
+
+    async def _apost(
+        self, session: aiohttp.ClientSession, api_url: str, request_payload: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        timeout = aiohttp.ClientTimeout(total=self.timeout) if self.timeout else None
+        try:
+            async with session.post(
+                url=api_url,
+                headers=self._headers(),
+                auth=self.auth,  # type: ignore[arg-type]
+                json=request_payload,
+                timeout=timeout,
+            ) as response:
+                if response.status != 200:
+                    _raise_for_status(response.status, self.model, await response.text())
+                async for line in response.content:
+                    yield line.decode("utf-8")
+        except aiohttp.ServerTimeoutError:
+            raise
+        except asyncio.TimeoutError as exc:
+            # aiohttp's total timeout is a bare TimeoutError; make it
+            # distinguishable from an agent deadline for the circuit breaker.
+            raise aiohttp.ServerTimeoutError(
+                f"Ollama hat nicht innerhalb von {self.timeout}s geantwortet."
+            ) from exc
+
+
+def get_chat_model(
+    model: str, base_url: str, temperature: float = 0, **options: Any
+) -> PooledChatOllama:
+    """Return the shared client for this model configuration.
+
+    Clients are immutable after construction and hold no per-call state, so
+    the same instance is handed to all threads and event loops.
+    """
+
+    key = (base_url, model, float(temperature), json.dumps(options, sort_keys=True, default=str))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = PooledChatOllama(
+                model=model, base_url=base_url, temperature=temperature, **options
+            )
+            _clients[key] = client
+            logger.debug("[LLM] Neuer Client für %s (%s Clients im Pool)", model, len(_clients))
+        return client
+
+
+def close_http_sessions() -> None:
+    """Close the shared synchronous HTTP session (e.g. on shutdown)."""
+
+    global _http_session
+
+    with _lock:
+        session, _http_session = _http_session, None
+    if session is not None:
+        session.close()
@@ -4,39 +4,31 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Any, Dict
-
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
+from typing import Any, Callable, Dict
 
+from .cascade import ainvoke_cascade, invoke_cascade
 from .fallbacks import fallback_possible_causes
-from .utils import get_language_from_state, get_model_name, localize_phrase
+from .prompts import register_prompt
+from .utils import get_language_from_state, localize_phrase
 
 
 logger = logging.getLogger(__name__)
 
 
-def possible_cause(state: Dict[str, Any]) -> Dict[str, str]:
-    llm = ChatOllama(
-        model=get_model_name("possible_cause_agent", state),
-        base_url="http://localhost:11434",
-        temperature=0.5,
-    )
+AGENT_KEY = "possible_cause_agent"
+TEMPERATURE = 0.5
+
 
-    prompt = f"""
-    Task: Suggest one or more possible technical causes of the reported problem based strictly on the provided information.
+PROMPT = register_prompt(
+    "possible_cause",
+    """
+    Task: Suggest one or more possible technical causes of the reported problem based strictly on the information at the end.
     - Consider car details, affected behaviors, noises, and changed parts.
     - Do not invent information that is not mentioned or clearly inferable.
     - Normalize all parts to standard automotive terms.
     - Do not list replaced parts as possible causes unless they are explicitly still suspected to be faulty.
     - Always respond in the same language as the input.
 
-    Car Info: {json.dumps(state.get('car_details', ''), indent=2, ensure_ascii=False)}
-    Problem Description: {state.get('description_text', '')}
-    Affected Behaviors: {json.dumps(state.get('affected_behaviors', ''), indent=2, ensure_ascii=False)}
-    Noises: {json.dumps(state.get('noises', ''), indent=2, ensure_ascii=False)}
-    Changed Parts: {json.dumps(state.get('changed_parts', ''), indent=2, ensure_ascii=False)}
-
     Response format (no explanations outside the structure):
     <Translate "POSSIBLE_CAUSES" into the input language>:
     - cause → reason
@@ -44,17 +36,61 @@ def possible_cause(state: Dict[str, Any]) -> Dict[str, str]:
     If multiple causes are possible, list them in separate lines.
     If no possible causes can be derived, respond exactly with the translation
     of "POSSIBLE_CAUSES: None" in the input language.
+    """,
     """
+    Problem Description: {description}
+    Car Info: {car_details}
+    Affected Behaviors: {affected_behaviors}
+    Noises: {noises}
+    Changed Parts: {changed_parts}
+    """,
+)
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, indent=2, ensure_ascii=False)
+
+
+def _build_prompt(state: Dict[str, Any]) -> str:
+    return PROMPT.render(
+        description=state.get("description_text", ""),
+        car_details=_json(state.get("car_details", "")),
+        affected_behaviors=_json(state.get("affected_behaviors", "")),
+        noises=_json(state.get("noises", "")),
+        changed_parts=_json(state.get("changed_parts", "")),
+    )
+
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("❌ Fehler im Possible-Cause-Agent: %s", exc)
+    language = get_language_from_state(state)
+    fallback = fallback_possible_causes(state, language)
+    if not fallback:
+        fallback = localize_phrase("possible_causes_none", language)
+    return {"possible_causes": fallback, "warning": str(exc)}
+
+
+def possible_cause(
+    state: Dict[str, Any], on_token: Callable[[str], None] | None = None
+) -> Dict[str, str]:
+    """Derive possible causes; with *on_token* the answer is streamed."""
 
     try:
-        result = llm.invoke([HumanMessage(content=prompt)]).content.strip()
+        result = invoke_cascade(
+            AGENT_KEY, state, _build_prompt(state), temperature=TEMPERATURE, on_token=on_token
+        )
         return {"possible_causes": result}
     except Exception as exc:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im Possible-Cause-Agent: %s", exc)
-        language = get_language_from_state(state)
-        fallback = fallback_possible_causes(state, language)
-        if not fallback:
-            fallback = localize_phrase("possible_causes_none", language)
-        return {"possible_causes": fallback, "warning": str(exc)}
+        return _fallback(state, exc)
 
 
+async def apossible_cause(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`possible_cause` bounded by the agent timeout."""
+
+    try:
+        result = await ainvoke_cascade(
+            AGENT_KEY, state, _build_prompt(state), temperature=TEMPERATURE
+        )
+        return {"possible_causes": result}
+    except Exception as exc:  # pylint: disable=broad-except
+        return _fallback(state, exc)
@@ -4,35 +4,29 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Any, Dict
-
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage
+from typing import Any, Callable, Dict
 
+from .cascade import ainvoke_cascade, invoke_cascade
 from .fallbacks import fallback_possible_solutions
-from .utils import get_language_from_state, get_model_name, localize_phrase
+from .prompts import register_prompt
+from .utils import get_language_from_state, localize_phrase
 
 
 logger = logging.getLogger(__name__)
 
 
-def possible_solution(state: Dict[str, Any]) -> Dict[str, str]:
-    llm = ChatOllama(
-        model=get_model_name("possible_solution_agent", state),
-        base_url="http://localhost:11434",
-        temperature=0,
-    )
+AGENT_KEY = "possible_solution_agent"
+
 
-    prompt = f"""
-    Task: Based on the possible causes provided, generate a structured solution.
+PROMPT = register_prompt(
+    "possible_solution",
+    """
+    Task: Based on the possible causes provided at the end, generate a structured solution.
     - Provide clear step-by-step instructions for a mechanic to solve the issue.
     - Indicate if the user can safely perform any of the steps themselves (e.g., checking fluid levels, visually inspecting parts).
     - Base all instructions only on the given possible causes. Do not invent new causes.
     - Always respond in the same language as the input.
 
-    Possible Causes:
-    {json.dumps(state.get('possible_causes', ''), indent=2, ensure_ascii=False)}
-
     Response format (no extra explanations):
     <Translate "POSSIBLE_SOLUTIONS" into the input language>:
     <Translate "Mechanic instructions" into the input language>:
@@ -46,15 +40,46 @@ def possible_solution(state: Dict[str, Any]) -> Dict[str, str]:
 
     If no possible causes are given, respond exactly with the translation
     of "POSSIBLE_SOLUTIONS: None" in the input language.
+    """,
     """
+    Possible Causes:
+    {possible_causes}
+    """,
+)
+
+
+def _build_prompt(state: Dict[str, Any]) -> str:
+    return PROMPT.render(
+        possible_causes=json.dumps(state.get("possible_causes", ""), indent=2, ensure_ascii=False)
+    )
+
+
+def _fallback(state: Dict[str, Any], exc: BaseException) -> Dict[str, str]:
+    logger.error("❌ Fehler im Possible-Solution-Agent: %s", exc)
+    language = get_language_from_state(state)
+    fallback = fallback_possible_solutions(state, language)
+    if not fallback:
+        fallback = localize_phrase("possible_solutions_none", language)
+    return {"possible_solutions": fallback, "warning": str(exc)}
+
+
+def possible_solution(
+    state: Dict[str, Any], on_token: Callable[[str], None] | None = None
+) -> Dict[str, str]:
+    """Derive possible solutions; with *on_token* the answer is streamed."""
+
+    try:
+        result = invoke_cascade(AGENT_KEY, state, _build_prompt(state), on_token=on_token)
+        return {"possible_solutions": result}
+    except Exception as exc:  # pylint: disable=broad-except
+        return _fallback(state, exc)
+
+
+async def apossible_solution(state: Dict[str, Any]) -> Dict[str, str]:
+    """Async variant of :func:`possible_solution` bounded by the agent timeout."""
 
     try:
-        result = llm.invoke([HumanMessage(content=prompt)]).content
-        return {"possible_solutions": result.strip()}
+        result = await ainvoke_cascade(AGENT_KEY, state, _build_prompt(state))
+        return {"possible_solutions": result}
     except Exception as exc:  # pylint: disable=broad-except
-        logger.error("❌ Fehler im Possible-Solution-Agent: %s", exc)
-        language = get_language_from_state(state)
-        fallback = fallback_possible_solutions(state, language)
-        if not fallback:
-            fallback = localize_phrase("possible_solutions_none", language)
-        return {"possible_solutions": fallback, "warning": str(exc)}
+        return _fallback(state, exc)
@@ -0,0 +1,160 @@
+"""Prompt templates with a static prefix and the variable content last.
+
+Ollama reuses the KV cache of a slot for the longest common token prefix of
+consecutive prompts. The agent prompts used to interpolate the description
+(or, for the chat agent, the whole diagnosis state) before the instructions,
+so no two calls shared more than a few tokens. Every template here is split
+into
+
+- a static *prefix* (task, rules and response format), byte-identical for
+  every call of the agent, and
+- a *suffix* with the variable sections, ordered from the most stable
+  (description, extracted fields) to the most volatile (the chat question),
+
+and compiled once at import. :class:`PromptEvalStats` collects Ollama's
+``prompt_eval_count``/``prompt_eval_duration`` per agent, so the prefill
+savings can be checked per pipeline run (``timing_report["prompt_eval"]``),
+per chat turn (log) and per process (``GET /health``).
+"""
+
+from __future__ import annotations
+
+import logging
+import string
+import textwrap
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+_NANOSECONDS = 1_000_000_000
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """A compiled prompt: static prefix plus a ``str.format`` suffix."""
+
+    name: str
+    prefix: str
+    suffix: str
+    fields: Tuple[str, ...]
+
+    def render(self, **values: Any) -> str:
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Prompt {self.name}: fehlende Felder {missing}")
+        return self.prefix + self.suffix.format_map(values)
+
+
+PROMPTS: Dict[str, PromptTemplate] = {}
+
+
+def register_prompt(name: str, prefix: str, suffix: str) -> PromptTemplate:
+    """Compile and register a template.
+
+    *prefix* is used verbatim (after dedenting), so braces need no escaping;
+    *suffix* holds the ``{placeholders}`` for the variable content.
+    """
+
+    if name in PROMPTS:
+        raise ValueError(f"Prompt {name} ist bereits registriert.")
+    prefix = textwrap.dedent(prefix).strip() + "\n\n"
+    suffix = textwrap.dedent(suffix).strip() + "\n"
+    fields = tuple(
+        dict.fromkeys(field for _, field, _, _ in string.Formatter().parse(suffix) if field)
+    )
+    template = PromptTemplate(name, prefix, suffix, fields)
+    PROMPTS[name] = template
+    return template
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    return PROMPTS[name]
+
+
+class PromptEvalStats:
+    """Prompt tokens Ollama had to evaluate, and how long that took, per agent."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, float]] = {}
+
+    def record(self, agent_key: str, tokens: int, seconds: float, prompt_chars: int) -> None:
+        with self._lock:
+            stats = self._agents.setdefault(
+                agent_key, {"calls": 0, "prompt_tokens": 0, "prompt_seconds": 0.0, "prompt_chars": 0}
+            )
+            stats["calls"] += 1
+            stats["prompt_tokens"] += tokens
+            stats["prompt_seconds"] += seconds
+            stats["prompt_chars"] += prompt_chars
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                agent_key: {
+                    "calls": int(stats["calls"]),
+                    "prompt_tokens": int(stats["prompt_tokens"]),
+                    "prompt_seconds": round(stats["prompt_seconds"], 3),
+                    "avg_prompt_tokens": round(stats["prompt_tokens"] / stats["calls"], 1),
+                    # Evaluated tokens per prompt character; drops when
+                    # prefixes are served from the KV cache.
+                    "tokens_per_char": round(
+                        stats["prompt_tokens"] / max(stats["prompt_chars"], 1), 3
+                    ),
+                }
+                for agent_key, stats in self._agents.items()
+            }
+
+
+_process_stats = PromptEvalStats()
+_run_stats: ContextVar[PromptEvalStats | None] = ContextVar("prompt_eval_stats", default=None)
+
+
+@contextmanager
+def prompt_eval_run(stats: PromptEvalStats | None = None):
+    """Collect the prompt evaluation of all calls in the block in *stats*.
+
+    Worker threads started with a copied context report into the same
+    :class:`PromptEvalStats`, which is yielded.
+    """
+
+    stats = stats if stats is not None else PromptEvalStats()
+    token = _run_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _run_stats.reset(token)
+
+
+def observe_prompt_eval(
+    agent_key: str, model: str, metadata: Mapping[str, Any] | None, prompt_chars: int
+) -> None:
+    """Record ``prompt_eval_count``/``prompt_eval_duration`` of one response."""
+
+    metadata = metadata or {}
+    tokens = int(metadata.get("prompt_eval_count") or 0)
+    seconds = (metadata.get("prompt_eval_duration") or 0) / _NANOSECONDS
+    _process_stats.record(agent_key, tokens, seconds, prompt_chars)
+    run_stats = _run_stats.get()
+    if run_stats is not None:
+        run_stats.record(agent_key, tokens, seconds, prompt_chars)
+    logger.debug(
+        "[Prompt] %s (%s): %s Token in %.3fs ausgewertet (%s Zeichen)",
+        agent_key,
+        model,
+        tokens,
+        seconds,
+        prompt_chars,
+    )
+
+
+def prompt_eval_stats() -> Dict[str, Dict[str, Any]]:
+    """Prompt evaluation per agent since the process started."""
+
+    return _process_stats.snapshot()
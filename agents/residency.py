@@ -0,0 +1,272 @@
+"""Keep the configured Ollama models resident according to demand.
+
+On CPU-only machines a cold load of a large model dominates the latency of
+the first request. The :class:`ModelResidencyManager` therefore
+
+- preloads the models of the configured tiers at startup, through the
+  scheduler and the circuit breaker and at most ``max_loaded_models`` of them,
+- keeps every model loaded for at least its tier's idle limit after its last
+  use, longer when it had many recent requests,
+- unloads models that have been idle longer than that itself, and
+- logs every model load reported by Ollama together with its duration.
+
+The ``keep_alive`` sent to Ollama always outlasts this residency by one
+check interval, so the unloading is done by the manager and not by Ollama
+evicting a model early.
+
+Settings live in the ``residency`` section of ``bots_settings.json``.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterable, List, Mapping
+
+from .circuit_breaker import OllamaUnavailable, check_ollama, ollama_call
+from .ollama_pool import OLLAMA_BASE_URL, get_http_session
+from .scheduler import get_scheduler, request_priority
+from .utils import get_model_tier, load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Ollama reports durations in nanoseconds.
+_NANOSECONDS = 1_000_000_000
+
+# Loads shorter than this are warm starts and not worth a log line.
+_LOAD_LOG_THRESHOLD = 0.25
+
+_TIERS = ("simple", "moderate", "complex")
+
+
+def configured_models(settings: Mapping[str, Any], tiers: Iterable[str] = _TIERS) -> List[str]:
+    """Return the models referenced by *tiers* in the agent settings, smallest tier first."""
+
+    sections = [
+        section
+        for name, section in settings.items()
+        if (name == "defaults" or name.endswith("_agent")) and isinstance(section, dict)
+    ]
+    models: List[str] = []
+    for tier in tiers:
+        for section in sections:
+            model = section.get(tier)
+            if isinstance(model, str) and model not in models:
+                models.append(model)
+    return models
+
+
+class ModelResidencyManager:
+    """Preloads, keeps alive and unloads the models used by the agents."""
+
+    def __init__(
+        self,
+        base_url: str,
+        keep_alive_min: float = 300,
+        keep_alive_max: float = 3600,
+        hot_requests: int = 20,
+        demand_window: float = 3600,
+        idle_unload: float | Mapping[str, float] = 900,
+        check_interval: float = 60,
+    ):
+        self.base_url = base_url
+        self.keep_alive_min = keep_alive_min
+        self.keep_alive_max = keep_alive_max
+        self.hot_requests = max(hot_requests, 1)
+        self.demand_window = demand_window
+        self.idle_unload = idle_unload
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._requests: Dict[str, Deque[float]] = {}
+        self._last_used: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self.preloaded = threading.Event()
+        self._reaper: threading.Thread | None = None
+
+    def _demand(self, model: str, now: float) -> int:
+        history = self._requests.setdefault(model, deque())
+        while history and now - history[0] > self.demand_window:
+            history.popleft()
+        return len(history)
+
+    def _residency(self, model: str, now: float) -> float:
+        """Seconds *model* stays loaded after its last use; needs ``self._lock``.
+
+        The demand-scaled value between min and max, but never less than the
+        tier's idle limit.
+        """
+
+        share = min(self._demand(model, now) / self.hot_requests, 1.0)
+        residency = self.keep_alive_min + (self.keep_alive_max - self.keep_alive_min) * share
+        return max(residency, self._idle_limit(model) or 0)
+
+    def keep_alive_for(self, model: str) -> int:
+        """``keep_alive`` in seconds: the residency plus one check interval of slack."""
+
+        with self._lock:
+            residency = self._residency(model, time.time())
+        return int(residency + self.check_interval)
+
+    def before_call(self, model: str) -> int:
+        """Record a request for *model* and return the ``keep_alive`` to send."""
+
+        now = time.time()
+        with self._lock:
+            self._requests.setdefault(model, deque()).append(now)
+            self._last_used[model] = now
+        return self.keep_alive_for(model)
+
+    def observe_response(self, model: str, metadata: Mapping[str, Any] | None) -> None:
+        """Log a model load reported in the response *metadata*."""
+
+        load_seconds = (metadata or {}).get("load_duration", 0) / _NANOSECONDS
+        if load_seconds >= _LOAD_LOG_THRESHOLD:
+            logger.info("🚚 Modell %s wurde geladen (%.1fs Ladezeit)", model, load_seconds)
+
+    def _generate(self, model: str, keep_alive: float) -> Dict[str, Any]:
+        response = get_http_session().post(
+            f"{self.base_url}/api/generate",
+            json={"model": model, "keep_alive": keep_alive, "stream": False},
+            timeout=600,
+        )
+        response.raise_for_status()
+        lines = [line for line in response.text.splitlines() if line.strip()]
+        return json.loads(lines[-1]) if lines else {}
+
+    def preload(self, models: Iterable[str]) -> None:
+        """Load *models* one after another; CPU nodes cannot load them in parallel.
+
+        The loads go through the scheduler (as ``batch`` work) and the circuit
+        breaker like any model call, and never more models are warmed than
+        the scheduler's ``max_loaded_models`` allows.
+        """
+
+        models = list(models)
+        limit = get_scheduler().max_loaded_models
+        if limit is not None and len(models) > limit:
+            logger.info(
+                "📦 Nur %s von %s Modellen werden vorgeladen (max_loaded_models): %s",
+                limit,
+                len(models),
+                ", ".join(models[:limit]),
+            )
+            models = models[:limit]
+
+        for model in models:
+            started = time.perf_counter()
+            try:
+                check_ollama()
+                with request_priority("batch"), get_scheduler().slot(model), ollama_call():
+                    result = self._generate(model, self.keep_alive_for(model))
+            except OllamaUnavailable as exc:
+                logger.warning("⚠️ Vorladen abgebrochen: %s", exc)
+                return
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("⚠️ Vorladen von %s fehlgeschlagen: %s", model, exc)
+                continue
+
+            with self._lock:
+                self._last_used[model] = time.time()
+            load_seconds = result.get("load_duration", 0) / _NANOSECONDS
+            logger.info(
+                "📦 Modell %s vorgeladen (Ladezeit %.1fs, gesamt %.1fs)",
+                model,
+                load_seconds,
+                time.perf_counter() - started,
+            )
+
+    def unload(self, model: str) -> bool:
+        try:
+            self._generate(model, 0)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.warning("⚠️ Entladen von %s fehlgeschlagen: %s", model, exc)
+            return False
+
+        with self._lock:
+            self._last_used.pop(model, None)
+        logger.info("💤 Modell %s entladen.", model)
+        return True
+
+    def unload_all(self) -> None:
+        with self._lock:
+            models = list(self._last_used)
+        for model in models:
+            self.unload(model)
+
+    def _idle_limit(self, model: str) -> float | None:
+        if isinstance(self.idle_unload, Mapping):
+            tier = get_model_tier(model) or "default"
+            return self.idle_unload.get(tier, self.idle_unload.get("default"))
+        return self.idle_unload
+
+    def unload_idle(self) -> List[str]:
+        """Unload models that have been idle longer than their residency."""
+
+        now = time.time()
+        with self._lock:
+            idle = [
+                model
+                for model, last_used in self._last_used.items()
+                if self._idle_limit(model) and now - last_used > self._residency(model, now)
+            ]
+        return [model for model in idle if self.unload(model)]
+
+    def start(self, preload_models: Iterable[str] = ()) -> None:
+        """Preload *preload_models* and watch for idle models in the background."""
+
+        if self._reaper is not None:
+            return
+
+        models = list(preload_models)
+
+        def run() -> None:
+            self.preload(models)
+            self.preloaded.set()
+            while not self._stop.wait(self.check_interval):
+                self.unload_idle()
+
+        self._reaper = threading.Thread(target=run, name="model-residency", daemon=True)
+        self._reaper.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+@lru_cache(maxsize=1)
+def get_residency_manager() -> ModelResidencyManager | None:
+    """Return the shared manager, ``None`` when ``residency`` is disabled."""
+
+    settings = load_bot_settings().get("residency")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+
+    return ModelResidencyManager(
+        OLLAMA_BASE_URL,
+        keep_alive_min=settings.get("keep_alive_min_seconds", 300),
+        keep_alive_max=settings.get("keep_alive_max_seconds", 3600),
+        hot_requests=settings.get("hot_requests", 20),
+        demand_window=settings.get("demand_window_seconds", 3600),
+        idle_unload=settings.get("idle_unload_seconds", 900),
+        check_interval=settings.get("check_interval_seconds", 60),
+    )
+
+
+@lru_cache(maxsize=1)
+def start_model_residency() -> ModelResidencyManager | None:
+    """Start preloading and idle unloading once per process."""
+
+    manager = get_residency_manager()
+    if manager is None:
+        return None
+
+    settings = load_bot_settings()
+    tiers = settings["residency"].get("preload_tiers", _TIERS)
+    manager.start(configured_models(settings, tiers) if tiers else ())
+    return manager
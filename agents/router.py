@@ -0,0 +1,259 @@
+"""Latency-aware model routing.
+
+The complexity score picks a tier from fixed cutoffs, no matter how busy the
+machine is. :class:`LatencyRouter` instead learns the prompt and generation
+throughput (tokens/s) and the slot queue wait of every model from the
+metadata Ollama returns, and for each call picks the largest configured tier
+whose estimated latency still fits the call's budget. A short generation
+probe at startup calibrates the models before the first real request.
+
+Until a model has been observed it is not considered; without any observed
+candidate the router defers to the complexity heuristic.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Mapping
+
+from .circuit_breaker import OllamaUnavailable, check_ollama, ollama_call
+from .ollama_pool import OLLAMA_BASE_URL, get_http_session
+from .residency import configured_models, start_model_residency
+from .scheduler import get_scheduler, request_priority
+from .utils import get_tier_models, input_word_count, load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+_NANOSECONDS = 1_000_000_000
+
+# Rough prompt size estimate: tokens per input word plus the prompt template.
+_TOKENS_PER_WORD = 1.4
+_TEMPLATE_TOKENS = 250
+
+_PROBE_PROMPT = "Antworte nur mit OK."
+
+
+@dataclass
+class ModelThroughput:
+    """Smoothed throughput observations of one model."""
+
+    prompt_tps: float | None = None
+    generation_tps: float | None = None
+    queue_wait: float = 0.0
+    samples: int = 0
+
+
+def _smooth(previous: float | None, value: float, alpha: float) -> float:
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+def _rounded(value: float | None) -> float | None:
+    return round(value, 1) if value else None
+
+
+class LatencyRouter:
+    """Chooses the largest tier whose estimated latency fits the budget."""
+
+    def __init__(
+        self,
+        budgets: Mapping[str, float],
+        alpha: float = 0.3,
+        default_output_tokens: int = 300,
+    ):
+        self.budgets = dict(budgets)
+        self.alpha = alpha
+        self.default_output_tokens = default_output_tokens
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelThroughput] = {}
+        self._output_tokens: Dict[str, float] = {}
+
+    def budget_for(self, agent_key: str, state: Mapping[str, Any] | None) -> float | None:
+        """Per-request budget from ``state["latency_budget"]``, else the agent's setting."""
+
+        if state and state.get("latency_budget"):
+            return float(state["latency_budget"])
+        return self.budgets.get(agent_key, self.budgets.get("default"))
+
+    def observe(
+        self,
+        model: str,
+        metadata: Mapping[str, Any] | None,
+        queue_wait: float = 0.0,
+        agent_key: str | None = None,
+    ) -> None:
+        """Fold the token counts and durations of one response into the averages."""
+
+        metadata = metadata or {}
+        with self._lock:
+            stats = self._models.setdefault(model, ModelThroughput())
+            previous_wait = stats.queue_wait if stats.samples else None
+            stats.queue_wait = _smooth(previous_wait, queue_wait, self.alpha)
+
+            prompt_tokens = metadata.get("prompt_eval_count") or 0
+            prompt_duration = metadata.get("prompt_eval_duration") or 0
+            if prompt_tokens and prompt_duration:
+                rate = prompt_tokens / (prompt_duration / _NANOSECONDS)
+                stats.prompt_tps = _smooth(stats.prompt_tps, rate, self.alpha)
+
+            output_tokens = metadata.get("eval_count") or 0
+            output_duration = metadata.get("eval_duration") or 0
+            if output_tokens and output_duration:
+                rate = output_tokens / (output_duration / _NANOSECONDS)
+                stats.generation_tps = _smooth(stats.generation_tps, rate, self.alpha)
+                if agent_key:
+                    self._output_tokens[agent_key] = _smooth(
+                        self._output_tokens.get(agent_key), output_tokens, self.alpha
+                    )
+            stats.samples += 1
+
+    def estimate(self, model: str, prompt_tokens: float, output_tokens: float) -> float | None:
+        """Expected seconds for a call, ``None`` while *model* is uncalibrated."""
+
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None or not stats.generation_tps:
+                return None
+            prompt_seconds = prompt_tokens / stats.prompt_tps if stats.prompt_tps else 0.0
+            return stats.queue_wait + prompt_seconds + output_tokens / stats.generation_tps
+
+    def route(self, agent_key: str, state: Mapping[str, Any] | None) -> str | None:
+        """Return the model for this call, or ``None`` to use the complexity heuristic."""
+
+        candidates = get_tier_models(agent_key)
+        budget = self.budget_for(agent_key, state)
+        if len(set(candidates.values())) < 2 or not budget:
+            return None
+
+        prompt_tokens = _TOKENS_PER_WORD * input_word_count(agent_key, dict(state or {}))
+        prompt_tokens += _TEMPLATE_TOKENS
+        with self._lock:
+            output_tokens = self._output_tokens.get(agent_key, self.default_output_tokens)
+
+        estimates = {
+            tier: estimate
+            for tier, model in candidates.items()
+            if (estimate := self.estimate(model, prompt_tokens, output_tokens)) is not None
+        }
+        if not estimates:
+            return None
+
+        fitting = [
+            tier
+            for tier in ("complex", "moderate", "simple")
+            if tier in estimates and estimates[tier] <= budget
+        ]
+        # Nothing fits: take the fastest model rather than failing.
+        tier = fitting[0] if fitting else min(estimates, key=estimates.get)
+        logger.debug(
+            "[Router] Agent: %s | Budget: %.1fs | Schätzungen: %s | Stufe: %s",
+            agent_key,
+            budget,
+            {key: round(value, 1) for key, value in estimates.items()},
+            tier,
+        )
+        return candidates[tier]
+
+    def probe(
+        self, models: Iterable[str], base_url: str = OLLAMA_BASE_URL, tokens: int = 32
+    ) -> None:
+        """Measure each model with a short generation (includes a cold load if needed).
+
+        Probes queue as ``batch`` work in the scheduler and are skipped while
+        the circuit breaker is open.
+        """
+
+        for model in models:
+            started = time.perf_counter()
+            try:
+                check_ollama()
+                with request_priority("batch"), get_scheduler().slot(model), ollama_call():
+                    response = get_http_session().post(
+                        f"{base_url}/api/generate",
+                        json={
+                            "model": model,
+                            "prompt": _PROBE_PROMPT,
+                            "stream": False,
+                            "options": {"num_predict": tokens},
+                        },
+                        timeout=600,
+                    )
+                    response.raise_for_status()
+                lines = [line for line in response.text.splitlines() if line.strip()]
+                metadata = json.loads(lines[-1]) if lines else {}
+            except OllamaUnavailable as exc:
+                logger.warning("⚠️ Durchsatzmessung für %s übersprungen: %s", model, exc)
+                continue
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("⚠️ Durchsatzmessung für %s fehlgeschlagen: %s", model, exc)
+                continue
+
+            self.observe(model, metadata)
+            stats = self.snapshot().get(model, {})
+            logger.info(
+                "📏 %s: %s Token/s Generierung, %s Token/s Prompt (Messung %.1fs)",
+                model,
+                stats.get("generation_tps"),
+                stats.get("prompt_tps"),
+                time.perf_counter() - started,
+            )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                model: {
+                    "prompt_tps": _rounded(stats.prompt_tps),
+                    "generation_tps": _rounded(stats.generation_tps),
+                    "queue_wait": round(stats.queue_wait, 3),
+                    "samples": stats.samples,
+                }
+                for model, stats in self._models.items()
+            }
+
+
+@lru_cache(maxsize=1)
+def get_router() -> LatencyRouter | None:
+    """Return the shared router, ``None`` when ``router`` is disabled."""
+
+    settings = load_bot_settings().get("router")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+
+    return LatencyRouter(
+        settings.get("latency_budget_seconds", {}),
+        alpha=settings.get("smoothing", 0.3),
+        default_output_tokens=settings.get("default_output_tokens", 300),
+    )
+
+
+@lru_cache(maxsize=1)
+def start_model_router() -> LatencyRouter | None:
+    """Calibrate the router in the background once per process."""
+
+    router = get_router()
+    if router is None:
+        return None
+
+    settings = load_bot_settings()
+    if not settings["router"].get("probe", True):
+        return router
+
+    models = configured_models(settings)
+    tokens = settings["router"].get("probe_tokens", 32)
+    residency = start_model_residency()
+
+    def run() -> None:
+        # Probing while the residency manager preloads would load two models
+        # at once; on CPU nodes that only slows both down.
+        if residency is not None:
+            residency.preloaded.wait(timeout=900)
+        router.probe(models, tokens=tokens)
+
+    threading.Thread(target=run, name="model-router-probe", daemon=True).start()
+    return router
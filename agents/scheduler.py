@@ -0,0 +1,320 @@
+"""Process-wide scheduler for the Ollama calls of all sessions.
+
+Every Streamlit session, batch job and service worker runs in the same
+process, but until now each call only waited on its model's semaphore. Calls
+for ``llama3.2:1b``, ``3b`` and ``llama3.1:8b`` then reached Ollama
+interleaved, and a machine that can only keep one or two models in memory
+spent its time swapping them.
+
+:class:`ModelScheduler` keeps one queue per model and hands out slots:
+
+- at most ``max_in_flight`` concurrent calls per model (the server's
+  parallel slots),
+- at most ``max_loaded_models`` models busy at the same time; a request for
+  another model waits until one of them drains, and
+- queued requests for a model that is already busy are admitted first, so
+  requests are grouped by model. Once a busy model has been admitted
+  ``max_batch`` times in a row and other models wait, it stops taking new
+  requests and is allowed to drain.
+
+Every call also carries a priority class, set with :func:`request_priority`
+for everything running inside the block: interactive ``chat`` answers go
+ahead of ``regeneration`` (diagnosis pipeline runs, the default), which go
+ahead of ``batch`` jobs. A higher class also makes a busy model of a lower
+class drain, so a chat reply does not wait behind someone's full pipeline.
+To keep bulk work moving, a waiting call is promoted by one class for every
+``aging_seconds`` it has waited.
+
+:meth:`ModelScheduler.stats` reports the queue depth per model and class.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List
+
+from .utils import get_max_in_flight, load_bot_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Priority classes, most urgent first.
+PRIORITY_CLASSES = ("chat", "regeneration", "batch")
+DEFAULT_PRIORITY = "regeneration"
+
+_priority: ContextVar[str] = ContextVar("request_priority", default=DEFAULT_PRIORITY)
+
+
+@contextmanager
+def request_priority(priority: str):
+    """Run the model calls inside the block with the given priority class."""
+
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unbekannte Prioritätsklasse: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@dataclass
+class _Ticket:
+    """One waiting call; exactly one of ``event`` and ``future`` is set."""
+
+    model: str
+    sequence: int
+    rank: int
+    enqueued: float = field(default_factory=time.perf_counter)
+    event: threading.Event | None = None
+    future: asyncio.Future | None = None
+    loop: asyncio.AbstractEventLoop | None = None
+    granted: bool = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        elif self.future is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+@dataclass
+class _ModelQueue:
+    waiting: List[_Ticket] = field(default_factory=list)
+    in_flight: int = 0
+    streak: int = 0
+    granted: int = 0
+    total_wait: float = 0.0
+
+
+def _rank() -> int:
+    return PRIORITY_CLASSES.index(_priority.get())
+
+
+class ModelScheduler:
+    """Per-model queues with concurrency limits and grouping by model."""
+
+    def __init__(
+        self,
+        max_loaded_models: int | None = 2,
+        max_batch: int = 8,
+        aging_seconds: float | None = 30,
+    ):
+        self.max_loaded_models = max_loaded_models
+        self.max_batch = max(max_batch, 1)
+        self.aging_seconds = aging_seconds
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._sequence = itertools.count()
+        # Most recently dispatched models, newest last; with a model limit
+        # this approximates what Ollama still has in memory.
+        self._recent: List[str] = []
+        self._switches = 0
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue()
+        return queue
+
+    def _effective_rank(self, ticket: _Ticket, now: float) -> int:
+        if not self.aging_seconds:
+            return ticket.rank
+        return max(ticket.rank - int((now - ticket.enqueued) / self.aging_seconds), 0)
+
+    def _head(self, queue: _ModelQueue, now: float) -> tuple[int, int, _Ticket]:
+        """The next ticket of *queue* with its sort key (effective rank, sequence)."""
+
+        return min(
+            (self._effective_rank(ticket, now), ticket.sequence, ticket) for ticket in queue.waiting
+        )
+
+    def _admissible(
+        self,
+        model: str,
+        queue: _ModelQueue,
+        active: List[str],
+        rank: int,
+        heads: Dict[str, tuple[int, int, _Ticket]],
+    ) -> bool:
+        limit = get_max_in_flight(model)
+        if limit and queue.in_flight >= limit:
+            return False
+        loaded_full = bool(self.max_loaded_models) and len(active) >= self.max_loaded_models
+        if model in active:
+            # Keep grouping while nobody else waits; otherwise let it drain.
+            # A more urgent call for a model that cannot start makes it
+            # drain at once.
+            others = {name: head[0] for name, head in heads.items() if name != model}
+            if loaded_full and any(
+                other < rank and name not in active for name, other in others.items()
+            ):
+                return False
+            return not others or queue.streak < self.max_batch
+        return not loaded_full
+
+    def _next_ticket(self) -> _Ticket | None:
+        now = time.perf_counter()
+        active = [name for name, queue in self._queues.items() if queue.in_flight]
+        heads = {
+            name: self._head(queue, now) for name, queue in self._queues.items() if queue.waiting
+        }
+        candidates = [
+            (name, head)
+            for name, head in heads.items()
+            if self._admissible(name, self._queues[name], active, head[0], heads)
+        ]
+        if not candidates:
+            return None
+        # Most urgent class first; within a class busy models (no swap),
+        # then the longest-waiting request.
+        name, (_, _, ticket) = min(
+            candidates, key=lambda item: (item[1][0], item[0] not in active, item[1][1])
+        )
+        queue = self._queues[name]
+        if name not in active:
+            queue.streak = 0
+        self._note_dispatch(name)
+        queue.streak += 1
+        queue.waiting.remove(ticket)
+        return ticket
+
+    def _note_dispatch(self, model: str) -> None:
+        """Count a model switch when *model* has to replace a loaded one."""
+
+        if model in self._recent:
+            self._recent.remove(model)
+        elif self.max_loaded_models and len(self._recent) >= self.max_loaded_models:
+            self._recent.pop(0)
+            self._switches += 1
+        self._recent.append(model)
+
+    def _dispatch(self) -> None:
+        """Grant as many waiting tickets as the limits allow (lock held)."""
+
+        while (ticket := self._next_ticket()) is not None:
+            queue = self._queues[ticket.model]
+            queue.in_flight += 1
+            queue.granted += 1
+            queue.total_wait += time.perf_counter() - ticket.enqueued
+            ticket.grant()
+
+    def _enqueue(self, ticket: _Ticket) -> None:
+        with self._lock:
+            self._queue(ticket.model).waiting.append(ticket)
+            self._dispatch()
+
+    def _release(self, model: str) -> None:
+        with self._lock:
+            queue = self._queues[model]
+            queue.in_flight -= 1
+            if not queue.in_flight:
+                queue.streak = 0
+            self._dispatch()
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        """Forget a ticket whose caller gave up; release it if it was granted."""
+
+        with self._lock:
+            queue = self._queues[ticket.model]
+            if not ticket.granted:
+                queue.waiting.remove(ticket)
+                return
+        self._release(ticket.model)
+
+    @contextmanager
+    def slot(self, model: str) -> Iterator[float]:
+        """Block until *model* may be called; yields the seconds spent waiting."""
+
+        ticket = _Ticket(
+            model, next(self._sequence), _rank(), event=threading.Event()
+        )
+        self._enqueue(ticket)
+        ticket.event.wait()
+        waited = time.perf_counter() - ticket.enqueued
+        if waited > 0.001:
+            logger.debug("[Scheduler] Slot für %s nach %.3fs erhalten", model, waited)
+        try:
+            yield waited
+        finally:
+            self._release(model)
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        """Async variant of :meth:`slot` that never blocks the event loop."""
+
+        loop = asyncio.get_running_loop()
+        ticket = _Ticket(
+            model, next(self._sequence), _rank(), future=loop.create_future(), loop=loop
+        )
+        self._enqueue(ticket)
+        try:
+            await ticket.future
+        except BaseException:
+            self._withdraw(ticket)
+            raise
+        try:
+            yield time.perf_counter() - ticket.enqueued
+        finally:
+            self._release(model)
+
+    def queue_depth(self) -> int:
+        """Number of calls currently waiting for a slot."""
+
+        with self._lock:
+            return sum(len(queue.waiting) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": sum(len(queue.waiting) for queue in self._queues.values()),
+                "model_switches": self._switches,
+                "models": {
+                    name: {
+                        "queued": len(queue.waiting),
+                        "queued_by_priority": {
+                            priority: sum(ticket.rank == rank for ticket in queue.waiting)
+                            for rank, priority in enumerate(PRIORITY_CLASSES)
+                        },
+                        "in_flight": queue.in_flight,
+                        "limit": get_max_in_flight(name),
+                        "granted": queue.granted,
+                        "avg_wait_seconds": round(queue.total_wait / queue.granted, 3)
+                        if queue.granted
+                        else 0.0,
+                    }
+                    for name, queue in self._queues.items()
+                },
+            }
+
+
+@lru_cache(maxsize=1)
+def get_scheduler() -> ModelScheduler:
+    """Return the scheduler shared by all sessions of this process."""
+
+    settings = load_bot_settings().get("scheduler")
+    settings = settings if isinstance(settings, dict) else {}
+    return ModelScheduler(
+        max_loaded_models=settings.get("max_loaded_models", 2),
+        max_batch=settings.get("max_batch", 8),
+        aging_seconds=settings.get("aging_seconds", 30),
+    )
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    return get_scheduler().stats()
@@ -4,10 +4,17 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Tuple
 
-from langdetect import DetectorFactory, LangDetectException, detect
+from langdetect import DetectorFactory, LangDetectException
+from langdetect.detector_factory import PROFILES_DIRECTORY
+
+from .language_model import NgramLanguageModel
 
 
 logger = logging.getLogger(__name__)
@@ -81,6 +88,38 @@ _LOCALIZED_FALLBACKS: Dict[str, Dict[str, str]] = {
 }
 
 
+# Below this confidence the n-gram model defers to langdetect.
+_MIN_NGRAM_CONFIDENCE = 0.1
+
+
+@lru_cache(maxsize=1)
+def _get_ngram_model() -> NgramLanguageModel:
+    return NgramLanguageModel(_SUPPORTED_LANGUAGES)
+
+
+@lru_cache(maxsize=1)
+def _get_langdetect_factory() -> DetectorFactory:
+    """langdetect factory with only the supported language profiles loaded."""
+
+    factory = DetectorFactory()
+    factory.seed = 0
+    profiles = []
+    for language in _SUPPORTED_LANGUAGES:
+        with open(f"{PROFILES_DIRECTORY}/{language}", encoding="utf-8") as file:
+            profiles.append(file.read())
+    factory.load_json_profile(profiles)
+    return factory
+
+
+def warm_up_language_detection() -> None:
+    """Load the language models up front so the first request does not pay for it."""
+
+    _get_ngram_model()
+    _get_langdetect_factory()
+    logger.debug("🌐 Sprachmodelle für %s geladen.", ", ".join(_SUPPORTED_LANGUAGES))
+
+
+@lru_cache(maxsize=1024)
 def detect_language(text: str, fallback: str = "en") -> str:
     """Best-effort detection of the language used in *text*."""
 
@@ -89,20 +128,36 @@ def detect_language(text: str, fallback: str = "en") -> str:
 
     candidate = text.strip()
 
+    language, confidence = _get_ngram_model().detect(candidate)
+    if language is not None and confidence >= _MIN_NGRAM_CONFIDENCE:
+        return language
+
     try:
-        detected = detect(candidate)
+        detector = _get_langdetect_factory().create()
+        detector.append(candidate)
+        detected = detector.detect()
     except LangDetectException:
         logger.debug("⚠️ Sprachenerkennung fehlgeschlagen, verwende Fallback '%s'", fallback)
-        return fallback
+        return language or fallback
 
-    language = detected.split("-")[0]
-    return _SUPPORTED_LANGUAGES.get(language, fallback)
+    return _SUPPORTED_LANGUAGES.get(detected.split("-")[0], fallback)
 
 
 def get_language_from_state(state: Dict[str, Any], fallback: str = "en") -> str:
-    """Infer the most likely language from the diagnostic *state*."""
+    """Infer the most likely language from the diagnostic *state*.
+
+    A pending ``user_question`` wins; otherwise the ``language`` resolved for
+    the state (see :func:`resolve_language`) is used without detecting again.
+    """
 
-    for key in ("user_question", "description_text", "car_details"):
+    question = state.get("user_question") or ""
+    if question.strip():
+        return detect_language(question, fallback=fallback)
+
+    if state.get("language"):
+        return state["language"]
+
+    for key in ("description_text", "car_details"):
         value = state.get(key, "")
         if value and value.strip():
             return detect_language(value, fallback=fallback)
@@ -110,6 +165,17 @@ def get_language_from_state(state: Dict[str, Any], fallback: str = "en") -> str:
     return fallback
 
 
+def resolve_language(state: Dict[str, Any], fallback: str = "en") -> str:
+    """Return ``state["language"]``, detecting and storing it on first use."""
+
+    if not state.get("language"):
+        state["language"] = get_language_from_state(
+            {key: state.get(key, "") for key in ("description_text", "car_details")},
+            fallback=fallback,
+        )
+    return state["language"]
+
+
 def localize_phrase(key: str, language: str) -> str:
     """Return a localized fallback phrase for *key* in the requested language."""
 
@@ -121,6 +187,12 @@ def localize_phrase(key: str, language: str) -> str:
     return default_phrases.get(key, key)
 
 
+def localized_variants(key: str) -> List[str]:
+    """Return the phrase for *key* in every supported language."""
+
+    return [phrases[key] for phrases in _LOCALIZED_FALLBACKS.values() if key in phrases]
+
+
 @lru_cache(maxsize=1)
 def load_bot_settings() -> Dict[str, Any]:
     """Load the model configuration for the agents.
@@ -138,124 +210,400 @@ def load_bot_settings() -> Dict[str, Any]:
         return {}
 
 
-def _gather_relevant_text(agent_key: str, state: Dict[str, Any] | None) -> str:
-    """Collect text snippets that describe the agent task context."""
-
-    if not state:
-        return ""
-
-    key_map: Dict[str, Iterable[str]] = {
-        "identify_car_agent": ("description_text",),
-        "behavior_agent": ("description_text",),
-        "noise_agent": ("description_text",),
-        "new_parts_agent": ("description_text",),
-        "possible_cause_agent": (
-            "description_text",
-            "car_details",
-            "affected_behaviors",
-            "noises",
-            "changed_parts",
-        ),
-        "possible_solution_agent": (
-            "description_text",
-            "car_details",
-            "affected_behaviors",
-            "noises",
-            "possible_causes",
-            "changed_parts",
-        ),
-        "chat_agent": ("user_question",),
-    }
-
-    relevant_keys = key_map.get(agent_key)
-    if not relevant_keys:
-        return state.get("description_text", "")
-
-    parts: List[str] = []
-    for key in relevant_keys:
-        value = state.get(key)
-        if isinstance(value, str) and value.strip():
-            parts.append(value.strip())
-
-    return "\n\n".join(parts)
-
-
-def _score_text_complexity(text: str) -> int:
-    """Return a heuristic complexity score for *text*."""
+def get_pipeline_setting(name: str, default: Any = None) -> Any:
+    """Return an entry of the ``pipeline`` section in ``bots_settings.json``."""
 
-    if not text or not text.strip():
-        return 0
-
-    words = text.split()
-    word_count = len(words)
-    unique_terms = len({word.lower().strip(",.;:") for word in words if word})
-    sentence_markers = sum(text.count(marker) for marker in ".!?")
-    list_markers = text.count("\n-") + text.count("\n*")
-    paragraph_breaks = text.count("\n\n")
-
-    score = word_count
-    score += unique_terms // 2
-    score += sentence_markers * 3
-    score += list_markers * 6
-    score += paragraph_breaks * 4
-
-    return score
-
-
-def _additional_context_score(agent_key: str, state: Dict[str, Any] | None) -> int:
-    if not state:
-        return 0
-
-    supporting_keys: Dict[str, Iterable[str]] = {
-        "possible_cause_agent": (
-            "car_details",
-            "affected_behaviors",
-            "noises",
-            "changed_parts",
-        ),
-        "possible_solution_agent": (
-            "car_details",
-            "affected_behaviors",
-            "noises",
-            "possible_causes",
-            "changed_parts",
-        ),
-        "chat_agent": ("chat_history",),
-    }
-
-    keys = supporting_keys.get(agent_key, ())
-    bonus = 0
-    for key in keys:
-        value = state.get(key)
-        if isinstance(value, str) and value.strip():
-            bonus += 25
-        elif isinstance(value, list) and value:
-            bonus += 15 + 5 * len(value)
-    return bonus
+    pipeline = load_bot_settings().get("pipeline")
+    if isinstance(pipeline, dict) and name in pipeline:
+        return pipeline[name]
+    return default
 
 
-def determine_task_complexity(agent_key: str, state: Dict[str, Any] | None) -> str:
-    """Estimate the complexity tier for the agent call."""
+def get_agent_timeout(agent_key: str, default: float | None = None) -> float | None:
+    """Return the deadline in seconds for async calls of *agent_key*.
+
+    Looks up the agent in the ``timeouts`` section of ``bots_settings.json``
+    and falls back to its ``default`` entry. ``None`` disables the deadline.
+    """
+
+    timeouts = load_bot_settings().get("timeouts")
+    if not isinstance(timeouts, dict):
+        return default
+
+    value = timeouts.get(agent_key, timeouts.get("default", default))
+    return float(value) if value else None
+
+
+def get_model_tier(model_name: str) -> str | None:
+    """Return the tier (``simple``/``moderate``/``complex``) *model_name* serves."""
+
+    defaults = load_bot_settings().get("defaults", {})
+    for tier, configured in defaults.items():
+        if configured == model_name:
+            return tier
+    return None
+
+
+def get_max_in_flight(model_name: str) -> int | None:
+    """Return how many concurrent requests *model_name* may receive.
+
+    The ``max_in_flight`` section of ``bots_settings.json`` is keyed by model
+    name or by tier; ``None`` means unlimited.
+    """
+
+    limits = load_bot_settings().get("max_in_flight")
+    if not isinstance(limits, dict):
+        return None
+
+    value = limits.get(model_name)
+    if value is None:
+        value = limits.get(get_model_tier(model_name) or "", limits.get("default"))
+    return int(value) if value else None
+
+
+# State fields each agent reads. Used both for the complexity estimate and to
+# decide which agents have to run again after the state changed.
+AGENT_INPUTS: Dict[str, Tuple[str, ...]] = {
+    "identify_car_agent": ("description_text",),
+    "behavior_agent": ("description_text",),
+    "noise_agent": ("description_text",),
+    "new_parts_agent": ("description_text",),
+    "combined_extraction_agent": ("description_text",),
+    "possible_cause_agent": (
+        "description_text",
+        "car_details",
+        "affected_behaviors",
+        "noises",
+        "changed_parts",
+    ),
+    "possible_solution_agent": (
+        "description_text",
+        "car_details",
+        "affected_behaviors",
+        "noises",
+        "possible_causes",
+        "changed_parts",
+    ),
+    "chat_agent": ("user_question",),
+}
+
+
+# State field written by each pipeline agent, in pipeline order.
+AGENT_OUTPUTS: Dict[str, str] = {
+    "identify_car_agent": "car_details",
+    "behavior_agent": "affected_behaviors",
+    "noise_agent": "noises",
+    "new_parts_agent": "changed_parts",
+    "possible_cause_agent": "possible_causes",
+    "possible_solution_agent": "possible_solutions",
+}
+
+
+EXTRACTION_AGENT_KEYS = (
+    "identify_car_agent",
+    "behavior_agent",
+    "noise_agent",
+    "new_parts_agent",
+)
+
+
+def plan_agent_run(
+    changed_fields: Iterable[str], locked_fields: Iterable[str] | None = None
+) -> List[str]:
+    """Return the pipeline agents that have to run after *changed_fields* changed.
+
+    An agent is dirty when one of its inputs changed; its output then counts as
+    changed for the agents further down the pipeline. Agents whose output is
+    locked by the user are skipped because their result would be discarded.
+
+    When the chat agent appended to the description *and* already filled in
+    an extracted field, the appended facts are considered absorbed by that
+    field: the description change alone does not re-trigger the extraction
+    agent writing it. The other extraction agents still re-run, since the
+    appended text may hold facts for them too.
+    """
+
+    changed = set(changed_fields)
+    locked = set(locked_fields or [])
+    description_changed = "description_text" in changed
+    filled_by_chat = set(changed)
 
-    text = _gather_relevant_text(agent_key, state)
-    score = _score_text_complexity(text)
-    score += _additional_context_score(agent_key, state)
+    planned: List[str] = []
+    for agent_key, output in AGENT_OUTPUTS.items():
+        if output in locked:
+            continue
 
-    if score <= 160:
-        complexity = "simple"
-    elif score <= 340:
-        complexity = "moderate"
-    else:
-        complexity = "complex"
+        inputs = set(AGENT_INPUTS[agent_key])
+        if description_changed and agent_key in EXTRACTION_AGENT_KEYS and output in filled_by_chat:
+            inputs.discard("description_text")
+
+        if inputs & changed:
+            planned.append(agent_key)
+            changed.add(output)
 
     logger.debug(
-        "[Model Selector] Agent: %s | Score: %s | Complexity: %s",
-        agent_key,
-        score,
-        complexity,
+        "[Pipeline] Geänderte Felder: %s | Neu auszuführen: %s",
+        sorted(set(changed_fields)),
+        planned,
     )
+    return planned
+
+
+# Agents whose tier also depends on already produced context.
+_CONTEXT_BONUS_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "possible_cause_agent": (
+        "car_details",
+        "affected_behaviors",
+        "noises",
+        "changed_parts",
+    ),
+    "possible_solution_agent": (
+        "car_details",
+        "affected_behaviors",
+        "noises",
+        "possible_causes",
+        "changed_parts",
+    ),
+    "chat_agent": ("chat_history",),
+}
+
+
+# Text fields tracked by ComplexityAnalysis; chat_history only counts entries.
+_COMPLEXITY_FIELDS = tuple(
+    sorted(
+        (
+            {field for fields in AGENT_INPUTS.values() for field in fields}
+            | {field for fields in _CONTEXT_BONUS_FIELDS.values() for field in fields}
+        )
+        - {"chat_history"}
+    )
+)
+
+
+def _chat_turns_in_prompt(history_length: int) -> int:
+    """Turns that reach the chat prompt: the verbatim window plus the summary."""
+
+    settings = load_bot_settings().get("chat_context")
+    recent_turns = settings.get("recent_turns", 4) if isinstance(settings, dict) else 4
+    return min(history_length, recent_turns + 1)
+
+
+def _agent_fields(agent_key: str) -> Tuple[str, ...]:
+    return AGENT_INPUTS.get(agent_key, ("description_text",)) + _CONTEXT_BONUS_FIELDS.get(
+        agent_key, ()
+    )
+
+
+@dataclass(frozen=True)
+class FieldStats:
+    """Size statistics of a single state field used for tier selection."""
+
+    word_count: int
+    terms: frozenset
+    sentence_markers: int
+    list_markers: int
+    paragraph_breaks: int
+    starts_with_list: bool
+
+    @classmethod
+    def from_text(cls, text: str) -> "FieldStats":
+        text = text.strip()
+        words = text.split()
+        return cls(
+            word_count=len(words),
+            terms=frozenset(word.lower().strip(",.;:") for word in words),
+            sentence_markers=sum(text.count(marker) for marker in ".!?"),
+            list_markers=text.count("\n-") + text.count("\n*"),
+            paragraph_breaks=text.count("\n\n"),
+            starts_with_list=text.startswith(("-", "*")),
+        )
+
+
+class ComplexityAnalysis:
+    """Text statistics of one pipeline run, shared by all its agents.
+
+    :meth:`update` re-tokenizes only the fields whose value changed since the
+    last call, and the tier of an agent is cached until one of its input
+    fields changes, so repeated :func:`get_model_name` calls are lookups.
+    The score matches scoring the agent's input fields joined by blank lines.
+    """
+
+    def __init__(self, state: Dict[str, Any] | None = None):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        self._stats: Dict[str, FieldStats] = {}
+        self._history_length = 0
+        self._tiers: Dict[str, str] = {}
+        if state:
+            self.update(state)
+
+    def update(self, state: Dict[str, Any]) -> None:
+        """Refresh the statistics of fields that differ from *state*."""
+
+        with self._lock:
+            for field in _COMPLEXITY_FIELDS:
+                value = state.get(field)
+                cached = self._values.get(field)
+                if value is cached or value == cached:
+                    continue
+                self._values[field] = value
+                if isinstance(value, str) and value.strip():
+                    self._stats[field] = FieldStats.from_text(value)
+                else:
+                    self._stats.pop(field, None)
+                self._invalidate(field)
+
+            history = state.get("chat_history")
+            history_length = len(history) if isinstance(history, list) else 0
+            if history_length != self._history_length:
+                self._history_length = history_length
+                self._invalidate("chat_history")
+
+    def _invalidate(self, field: str) -> None:
+        for agent_key in [key for key in self._tiers if field in _agent_fields(key)]:
+            del self._tiers[agent_key]
+
+    def score(self, agent_key: str) -> int:
+        with self._lock:
+            return self._score(agent_key)
+
+    def word_count(self, agent_key: str) -> int:
+        """Number of words in the input fields of *agent_key*."""
+
+        with self._lock:
+            return sum(
+                self._stats[field].word_count
+                for field in AGENT_INPUTS.get(agent_key, ("description_text",))
+                if field in self._stats
+            )
+
+    def _score(self, agent_key: str) -> int:
+        parts = [
+            self._stats[field]
+            for field in AGENT_INPUTS.get(agent_key, ("description_text",))
+            if field in self._stats
+        ]
+        score = 0
+        if parts:
+            # Joining the fields adds one paragraph break per boundary and a
+            # list marker where the next field starts with a bullet.
+            boundaries = len(parts) - 1
+            score += sum(part.word_count for part in parts)
+            score += len(frozenset().union(*(part.terms for part in parts))) // 2
+            score += sum(part.sentence_markers for part in parts) * 3
+            score += (
+                sum(part.list_markers for part in parts)
+                + sum(part.starts_with_list for part in parts[1:])
+            ) * 6
+            score += (sum(part.paragraph_breaks for part in parts) + boundaries) * 4
+
+        for field in _CONTEXT_BONUS_FIELDS.get(agent_key, ()):
+            if field == "chat_history":
+                if self._history_length:
+                    score += 15 + 5 * _chat_turns_in_prompt(self._history_length)
+            elif field in self._stats:
+                score += 25
+        return score
+
+    def tier(self, agent_key: str) -> str:
+        """Return the cached complexity tier for *agent_key*."""
+
+        with self._lock:
+            complexity = self._tiers.get(agent_key)
+            if complexity is not None:
+                return complexity
+
+            score = self._score(agent_key)
+            if score <= 160:
+                complexity = "simple"
+            elif score <= 340:
+                complexity = "moderate"
+            else:
+                complexity = "complex"
+            self._tiers[agent_key] = complexity
+
+        logger.debug(
+            "[Model Selector] Agent: %s | Score: %s | Complexity: %s",
+            agent_key,
+            score,
+            complexity,
+        )
+        return complexity
+
+
+_active_analysis: ContextVar[ComplexityAnalysis | None] = ContextVar(
+    "complexity_analysis", default=None
+)
+
+
+@contextmanager
+def complexity_analysis(state: Dict[str, Any]):
+    """Share one :class:`ComplexityAnalysis` for all agent calls in the block.
+
+    Threads started inside the block need ``contextvars.copy_context().run``
+    to see it; nested blocks reuse the outer analysis.
+    """
+
+    analysis = _active_analysis.get()
+    if analysis is not None:
+        analysis.update(state)
+        yield analysis
+        return
+
+    analysis = ComplexityAnalysis(state)
+    token = _active_analysis.set(analysis)
+    try:
+        yield analysis
+    finally:
+        _active_analysis.reset(token)
+
+
+def _current_analysis(state: Dict[str, Any] | None) -> ComplexityAnalysis:
+    """The run's shared analysis (or a fresh one) brought up to date with *state*."""
+
+    analysis = _active_analysis.get()
+    if analysis is None:
+        analysis = ComplexityAnalysis()
+    analysis.update(state or {})
+    return analysis
+
+
+def determine_task_complexity(agent_key: str, state: Dict[str, Any] | None) -> str:
+    """Estimate the complexity tier for the agent call.
+
+    Inside :func:`complexity_analysis` the run's shared statistics are
+    reused; otherwise *state* is analysed for this call only.
+    """
+
+    return _current_analysis(state).tier(agent_key)
 
-    return complexity
+
+def input_word_count(agent_key: str, state: Dict[str, Any] | None) -> int:
+    """Number of words the agent's prompt will carry from *state*."""
+
+    return _current_analysis(state).word_count(agent_key)
+
+
+def get_tier_models(agent_key: str) -> Dict[str, str]:
+    """Return the ``tier -> model`` candidates for *agent_key*.
+
+    Tiers missing in the agent's entry are taken from ``defaults``; an agent
+    configured with a single model name has no candidates to choose from.
+    """
+
+    settings = load_bot_settings()
+    config = settings.get(agent_key)
+    if isinstance(config, str):
+        return {}
+
+    defaults = settings.get("defaults", {})
+    config = config if isinstance(config, dict) else {}
+    candidates: Dict[str, str] = {}
+    for tier in ("simple", "moderate", "complex"):
+        model = config.get(tier) or defaults.get(tier)
+        if model:
+            candidates[tier] = model
+    return candidates
 
 
 def get_model_name(
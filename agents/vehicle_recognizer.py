@@ -0,0 +1,352 @@
+"""Local vehicle recognition from the vehicle catalog.
+
+Recognizes make, model and generation in a normalized description with one
+pass of a trie-shaped pattern over all catalog aliases (see
+:func:`agents.keyword_matcher.trie_pattern`), plus regular expressions for
+engine, transmission and build year. Every result carries a confidence
+score:
+
+- an explicit brand alias gives 0.5, a catalog model of that brand 0.3 more
+  and 0.1 if it directly follows the brand ("volvo c30");
+- a model without its brand only implies the brand (0.5 in total);
+- generation, engine and build year add 0.05 each;
+- several brands halve the score, several models of the brand multiply it
+  by 0.6.
+
+``identify_car`` skips its model call when the score reaches
+``vehicle_recognizer.min_confidence`` in ``bots_settings.json``; with the
+default of 0.8 that needs at least brand and catalog model. The rule-based
+``fallback_car_details`` renders the same result, so this only applies to
+descriptions in a language it has labels for (English, German). To see how many calls a
+corpus would save::
+
+    python -m agents.vehicle_recognizer fleet.jsonl --text-field description
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .keyword_matcher import trie_pattern
+from .knowledge_base import VehicleCatalog, get_knowledge_base
+from .utils import load_bot_settings
+
+
+_START = r"(?<![a-z0-9])"
+# A token ends before letters and digits, but "golf 1.6" is not a "golf 1".
+_END = r"(?![a-z0-9]|[.,]\d)"
+
+_BRAND, _MODEL, _GENERATION = "brand", "model", "generation"
+
+_ENGINE_CODES = {
+    "tdi": "TDI", "tsi": "TSI", "tfsi": "TFSI", "fsi": "FSI", "cdi": "CDI", "hdi": "HDi",
+    "tdci": "TDCi", "crdi": "CRDi", "dci": "dCi", "ecoboost": "EcoBoost", "vtec": "VTEC",
+    "diesel": "Diesel", "benzin": "Benzin", "benziner": "Benzin", "petrol": "Petrol",
+    "gasoline": "Gasoline", "hybrid": "Hybrid", "elektro": "Elektro", "electric": "Electric",
+    "v6": "V6", "v8": "V8",
+}
+_TRANSMISSIONS = {
+    "dsg": "DSG", "s tronic": "S tronic", "s-tronic": "S tronic", "steptronic": "Steptronic",
+    "cvt": "CVT", "automatik": "Automatik", "automatikgetriebe": "Automatik",
+    "automatic": "Automatic", "schaltgetriebe": "Schaltgetriebe", "handschalter": "Schaltgetriebe",
+    "manual": "Manual", "manuell": "Manuell",
+}
+
+_ENGINE_SIZE_PATTERN = re.compile(
+    rf"(?<![a-z0-9.,])([0-6][.,]\d)\s*(l|liter|litre)?\s*({trie_pattern(_ENGINE_CODES)})?{_END}"
+)
+_ENGINE_CODE_PATTERN = re.compile(rf"{_START}({trie_pattern(_ENGINE_CODES)}){_END}")
+_POWER_PATTERN = re.compile(r"(?<![\d.,])(\d{2,3})\s*(ps|hp|kw)(?![a-z])")
+_TRANSMISSION_PATTERN = re.compile(rf"{_START}({trie_pattern(_TRANSMISSIONS)}){_END}")
+_YEAR_PATTERN = re.compile(
+    r"(?<![\d.,])((?:19[5-9]|20[0-4])\d)"
+    r"(?!\d|[.,]\d|\s*(?:u/min|rpm|km|kilomet|meilen|miles|umdrehungen|touren|nm|ps|hp|kw|ccm|€|eur))"
+)
+_YEAR_KEYWORDS = re.compile(
+    r"(?<![a-z])(?:baujahr|bj\.?|ez|erstzulassung|jahrgang|modelljahr|model year|year|built|année)\s*:?\s*$"
+)
+# Characters between a vehicle mention and a year that still belongs to it
+# ("golf 7 (2015)", "volvo c30 von 2012").
+_YEAR_AFTER_VEHICLE = 20
+_UNLISTED_MODEL_PATTERN = re.compile(
+    rf"[\s-]+(?=[a-z0-9-]*[a-z])(?=[a-z0-9-]*\d)([a-z0-9-]+){_END}"
+)
+
+
+@dataclass(frozen=True)
+class VehicleMatch:
+    """Vehicle details found in a description; ``None`` where nothing was found."""
+
+    brand: str | None = None
+    model: str | None = None
+    generation: str | None = None
+    engine: str | None = None
+    transmission: str | None = None
+    year: str | None = None
+    confidence: float = 0.0
+
+    @property
+    def model_name(self) -> str | None:
+        """Model with its generation, e.g. ``Golf 7``."""
+
+        if self.model and self.generation:
+            return f"{self.model} {self.generation}"
+        return self.model
+
+
+# Catalog hit: kind, make index, model index and generation label.
+_Hit = Tuple[str, int, int, str]
+
+
+class VehicleRecognizer:
+    """Recognizes catalog vehicles in normalized (lower-case) descriptions."""
+
+    def __init__(self, catalog: VehicleCatalog):
+        self.catalog = catalog
+        entries: Dict[str, List[_Hit]] = {}
+        codes: Dict[str, List[_Hit]] = {}
+        self._generations: Dict[Tuple[int, int], Tuple[re.Pattern[str], Dict[str, str]]] = {}
+
+        for make_id, make in enumerate(catalog.makes):
+            for alias in make["aliases"]:
+                # Also the genitive/plural: "meines volvos".
+                for form in (alias, f"{alias}s"):
+                    entries.setdefault(form, []).append((_BRAND, make_id, -1, ""))
+            for model_id, model in enumerate(make["models"]):
+                for alias in model["aliases"]:
+                    entries.setdefault(alias, []).append((_MODEL, make_id, model_id, ""))
+                labels: Dict[str, str] = {}
+                for label, aliases in model["generations"].items():
+                    for alias in aliases:
+                        labels.setdefault(alias, label)
+                        # Chassis codes such as "e90" name the model on their own.
+                        if len(alias) >= 3 and re.search(r"[a-z]", alias) and re.search(r"\d", alias):
+                            codes.setdefault(alias, []).append((_GENERATION, make_id, model_id, label))
+                if labels:
+                    pattern = re.compile(rf"[\s-]*(?:mk\s*)?({trie_pattern(labels)}){_END}")
+                    self._generations[(make_id, model_id)] = (pattern, labels)
+
+        for code, hits in codes.items():
+            if len(hits) == 1 and code not in entries:
+                entries[code] = hits
+        self._entries = entries
+        self._pattern = re.compile(f"{_START}({trie_pattern(entries)}){_END}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _generation(self, text: str, make_id: int, model_id: int, end: int) -> Tuple[str, int]:
+        generation = self._generations.get((make_id, model_id))
+        if generation is None:
+            return "", end
+        pattern, labels = generation
+        match = pattern.match(text, end)
+        if match is None:
+            return "", end
+        return labels[match.group(1)], match.end()
+
+    def recognize(self, text: str) -> VehicleMatch:
+        """Vehicle details in the normalized *text* with their confidence."""
+
+        brands: Dict[int, List[Tuple[int, int]]] = {}
+        models: Dict[Tuple[int, int], Tuple[int, int, str]] = {}
+        for match in self._pattern.finditer(text):
+            start, end = match.span(1)
+            for kind, make_id, model_id, label in self._entries[match.group(1)]:
+                if kind == _BRAND:
+                    brands.setdefault(make_id, []).append((start, end))
+                    continue
+                model_end = end
+                if kind == _MODEL:
+                    label, model_end = self._generation(text, make_id, model_id, end)
+                known = models.get((make_id, model_id))
+                if known is None or (label and not known[2]):
+                    models[(make_id, model_id)] = (start, model_end, label)
+
+        engine = _find_engine(text)
+        transmission = _find_transmission(text)
+        if not brands and not models:
+            return VehicleMatch(engine=engine, transmission=transmission, year=_find_year(text, ()))
+
+        if brands:
+            make_id = min(brands, key=lambda key: brands[key][0][0])
+            confidence = 0.5
+        else:
+            make_id = min(models, key=lambda key: models[key][0])[0]
+            confidence = 0.2
+        make = self.catalog.makes[make_id]
+        spans = list(brands.get(make_id, ()))
+
+        own_models = sorted(
+            (span, model_id) for (model_make, model_id), span in models.items() if model_make == make_id
+        )
+        model_name = generation = None
+        if own_models:
+            (start, end, label), model_id = own_models[0]
+            model_name = make["models"][model_id]["name"]
+            generation = label or None
+            confidence += 0.3
+            if any(not text[brand_end:start].strip(" -") for _, brand_end in spans):
+                confidence += 0.1
+            if generation:
+                confidence += 0.05
+            spans.append((start, end))
+        else:
+            # A brand followed by a model code that is not in the catalog ("volvo v50").
+            for _, brand_end in spans:
+                unlisted = _UNLISTED_MODEL_PATTERN.match(text, brand_end)
+                if unlisted:
+                    model_name = unlisted.group(1).upper()
+                    confidence += 0.1
+                    spans.append(unlisted.span(1))
+                    break
+
+        year = _find_year(text, spans)
+        confidence += 0.05 * (engine is not None) + 0.05 * (year is not None)
+        if len(brands) > 1:
+            confidence *= 0.5
+        if len(own_models) > 1:
+            confidence *= 0.6
+        return VehicleMatch(
+            brand=make["brand"],
+            model=model_name,
+            generation=generation,
+            engine=engine,
+            transmission=transmission,
+            year=year,
+            confidence=round(min(confidence, 1.0), 2),
+        )
+
+
+def _find_engine(text: str) -> str | None:
+    parts: List[str] = []
+    for match in _ENGINE_SIZE_PATTERN.finditer(text):
+        size, unit, code = match.groups()
+        if unit or code:
+            parts.append(size.replace(",", "."))
+            if code:
+                parts.append(_ENGINE_CODES[code])
+            break
+    if not parts:
+        code = _ENGINE_CODE_PATTERN.search(text)
+        if code:
+            parts.append(_ENGINE_CODES[code.group(1)])
+    engine = " ".join(parts)
+    power = _POWER_PATTERN.search(text)
+    if power:
+        power_text = f"{power.group(1)} {power.group(2).upper()}"
+        engine = f"{engine}, {power_text}" if engine else power_text
+    return engine or None
+
+
+def _find_transmission(text: str) -> str | None:
+    match = _TRANSMISSION_PATTERN.search(text)
+    return _TRANSMISSIONS[match.group(1)] if match else None
+
+
+def _find_year(text: str, spans: List[Tuple[int, int]] | Tuple[()]) -> str | None:
+    """A build year: after a year keyword or shortly after the vehicle mention.
+
+    Other years ("seit 2023") describe the problem, not the car.
+    """
+
+    latest = datetime.date.today().year + 1
+    for match in _YEAR_PATTERN.finditer(text):
+        if int(match.group(1)) > latest:
+            continue
+        start = match.start(1)
+        if _YEAR_KEYWORDS.search(text, max(start - 25, 0), start):
+            return match.group(1)
+        if any(0 <= start - end <= _YEAR_AFTER_VEHICLE for _, end in spans):
+            return match.group(1)
+    return None
+
+
+@lru_cache(maxsize=1)
+def get_vehicle_recognizer() -> VehicleRecognizer:
+    """Return the recognizer for the knowledge base's vehicle catalog."""
+
+    return VehicleRecognizer(get_knowledge_base().catalog)
+
+
+@lru_cache(maxsize=1)
+def get_min_confidence() -> float | None:
+    """Score from which ``identify_car`` trusts the recognizer, ``None`` when disabled."""
+
+    settings = load_bot_settings().get("vehicle_recognizer")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+    return float(settings.get("min_confidence", 0.8))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Count the identify_car calls the local vehicle recognizer saves on a corpus."
+    )
+    parser.add_argument("input", type=Path, help="JSONL file with one description per line.")
+    parser.add_argument(
+        "--text-field", default="description", help="Field holding the problem description."
+    )
+    parser.add_argument(
+        "--min-confidence", type=float, default=None,
+        help="Threshold (default: vehicle_recognizer.min_confidence).",
+    )
+    parser.add_argument("--show", action="store_true", help="Print the result of every description.")
+    args = parser.parse_args()
+
+    # Imported here: the fallbacks themselves use this module.
+    from .fallbacks import is_localized
+    from .utils import detect_language
+
+    threshold = args.min_confidence
+    if threshold is None:
+        threshold = get_min_confidence() or 0.8
+    recognizer = get_vehicle_recognizer()
+
+    total = recognized = other_language = 0
+    buckets: Dict[str, int] = {}
+    with args.input.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            description = record.get(args.text_field) if isinstance(record, dict) else None
+            if not isinstance(description, str) or not description.strip():
+                continue
+            total += 1
+            vehicle = recognizer.recognize(description.lower().replace("ß", "ss"))
+            bucket = f"{int(vehicle.confidence * 10) / 10:.1f}"
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            if vehicle.confidence >= threshold:
+                if is_localized(detect_language(description)):
+                    recognized += 1
+                else:
+                    other_language += 1
+            if args.show:
+                print(
+                    f"{vehicle.confidence:.2f} {vehicle.brand or '-'} {vehicle.model_name or '-'} "
+                    f"| {vehicle.engine or '-'} | {vehicle.year or '-'} :: {description[:60]!r}"
+                )
+
+    print(f"Beschreibungen: {total}")
+    for bucket in sorted(buckets):
+        print(f"  Konfidenz ≥ {bucket}: {buckets[bucket]}")
+    if other_language:
+        print(f"Erkannt, aber ohne lokalisierte Ausgabe (Modellaufruf bleibt): {other_language}")
+    share = recognized / total * 100 if total else 0.0
+    print(
+        f"Lokal erkannt (≥ {threshold:.2f}): {recognized} "
+        f"→ {recognized} von {total} identify_car-Aufrufen eingespart ({share:.1f} %)"
+    )
+
+
+if __name__ == "__main__":
+    main()
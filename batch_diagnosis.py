@@ -0,0 +1,198 @@
+"""Headless batch diagnosis over JSONL files.
+
+Every input line is a JSON object with an identifier and a problem
+description. Results are appended to the output JSONL as soon as they are
+finished, so an interrupted run can simply be restarted: records whose
+identifier is already present in the output are skipped, failed ones are
+diagnosed again.
+
+Example::
+
+    python batch_diagnosis.py fleet.jsonl diagnoses.jsonl --workers 4
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, Set, Tuple
+
+from agents.residency import start_model_residency
+from agents.router import start_model_router
+from agents.scheduler import request_priority
+from agents.utils import warm_up_language_detection
+from diagnosis_engine import EXTRACTION_MODE, diagnose
+
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FIELDS = (
+    "description_text",
+    "car_details",
+    "affected_behaviors",
+    "noises",
+    "changed_parts",
+    "possible_causes",
+    "possible_solutions",
+    "timing_report",
+)
+
+
+def load_done_ids(output_path: Path, id_field: str) -> Set[str]:
+    """Return the identifiers already written to *output_path*.
+
+    A line cut off by an interrupted run and a failed diagnosis (a record
+    with an ``"error"`` field) are ignored, so that record is diagnosed
+    again.
+    """
+
+    done: Set[str] = set()
+    if not output_path.exists():
+        return done
+
+    with output_path.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and id_field in record and "error" not in record:
+                done.add(str(record[id_field]))
+    return done
+
+
+def iter_records(
+    input_path: Path, id_field: str, text_field: str
+) -> Iterator[Tuple[str, str]]:
+    """Yield ``(identifier, description)`` pairs from *input_path*.
+
+    Records without an identifier fall back to their line number.
+    """
+
+    with input_path.open(encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                logger.warning("⚠️ Zeile %s ist kein gültiges JSON: %s", line_number, exc)
+                continue
+            description = str(record.get(text_field) or "").strip()
+            if not description:
+                logger.warning("⚠️ Zeile %s enthält kein Feld '%s'.", line_number, text_field)
+                continue
+            yield str(record.get(id_field, line_number)), description
+
+
+def _diagnose_record(record_id: str, description: str, extraction_mode: str) -> Dict[str, Any]:
+    try:
+        with request_priority("batch"):
+            state = diagnose(description, extraction_mode=extraction_mode)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("❌ Diagnose für %s fehlgeschlagen: %s", record_id, exc)
+        return {"description_text": description, "error": str(exc)}
+    return {field: state.get(field, "") for field in OUTPUT_FIELDS}
+
+
+def run_batch(
+    input_path: Path,
+    output_path: Path,
+    workers: int = 2,
+    id_field: str = "id",
+    text_field: str = "description",
+    extraction_mode: str = EXTRACTION_MODE,
+) -> int:
+    """Diagnose all pending records and return how many were written."""
+
+    done = load_done_ids(output_path, id_field)
+    if done:
+        logger.info("⏭️ %s bereits vorhandene Ergebnisse werden übersprungen.", len(done))
+
+    written = 0
+    started = time.perf_counter()
+    # Keep only a small window of submitted records so huge inputs are not
+    # loaded into the executor queue at once.
+    max_pending = max(workers, 1) * 2
+    pending: Dict[Future, str] = {}
+
+    with output_path.open("a", encoding="utf-8") as output, ThreadPoolExecutor(
+        max_workers=max(workers, 1)
+    ) as executor:
+
+        def drain(return_when: str) -> None:
+            nonlocal written
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                record_id = pending.pop(future)
+                result = {id_field: record_id, **future.result()}
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                written += 1
+                logger.info("✅ %s fertig (%s geschrieben)", record_id, written)
+
+        for record_id, description in iter_records(input_path, id_field, text_field):
+            if record_id in done:
+                continue
+            done.add(record_id)
+            future = executor.submit(_diagnose_record, record_id, description, extraction_mode)
+            pending[future] = record_id
+            if len(pending) >= max_pending:
+                drain(FIRST_COMPLETED)
+
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    logger.info(
+        "🏁 Batch beendet: %s Diagnosen in %.1fs", written, time.perf_counter() - started
+    )
+    return written
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run the diagnosis pipeline over a JSONL file of descriptions."
+    )
+    parser.add_argument("input", type=Path, help="JSONL file with one description per line.")
+    parser.add_argument("output", type=Path, help="JSONL file the results are appended to.")
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of descriptions diagnosed concurrently."
+    )
+    parser.add_argument("--id-field", default="id", help="Field holding the record identifier.")
+    parser.add_argument(
+        "--text-field", default="description", help="Field holding the problem description."
+    )
+    parser.add_argument(
+        "--extraction-mode",
+        choices=("parallel", "combined", "sequential"),
+        default=EXTRACTION_MODE,
+        help="Extraction mode, defaults to pipeline.extraction_mode in bots_settings.json.",
+    )
+    parser.add_argument("--log-level", default="INFO", help="Logging level for stderr.")
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    warm_up_language_detection()
+    start_model_residency()
+    start_model_router()
+    written = run_batch(
+        args.input,
+        args.output,
+        workers=args.workers,
+        id_field=args.id_field,
+        text_field=args.text_field,
+        extraction_mode=args.extraction_mode,
+    )
+    print(f"{written} Diagnosen geschrieben nach {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark the model tier selection for long service-history descriptions.
+
+Simulates the ``get_model_name`` calls of one pipeline run (each agent asks
+for its tier after the previous agents filled in their fields) and compares
+scoring every call from scratch with the shared per-run
+:class:`agents.utils.ComplexityAnalysis`.
+
+Example::
+
+    python benchmark_complexity.py --entries 200 --runs 50
+"""
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from agents.utils import (
+    AGENT_OUTPUTS,
+    ComplexityAnalysis,
+    complexity_analysis,
+    determine_task_complexity,
+)
+
+
+_SERVICE_ITEMS = (
+    "Bremsbeläge vorne ersetzt",
+    "Ölwechsel inkl. Filter",
+    "Spurstange rechts getauscht",
+    "Reifen gewuchtet, Vibration bleibt",
+    "Fehlerspeicher ausgelesen: P0300",
+    "Zahnriemen und Wasserpumpe erneuert",
+    "Querlenkerbuchse links ausgeschlagen",
+    "Klappern bei Bodenwellen gemeldet",
+)
+
+
+def build_service_history(entries: int, seed: int = 0) -> str:
+    """Return a description followed by *entries* dated workshop visits."""
+
+    rng = random.Random(seed)
+    lines = [
+        "Mein Volvo C30 vibriert stark beim Fahren, abhängig von der Geschwindigkeit.",
+        "",
+        "Servicehistorie:",
+    ]
+    for number in range(entries):
+        year = 2012 + number % 12
+        items = ", ".join(rng.sample(_SERVICE_ITEMS, 3))
+        lines.append(f"- {year}-{1 + number % 12:02d}-{1 + number % 28:02d}: {items}.")
+    return "\n".join(lines)
+
+
+def _pipeline_states(description: str) -> List[tuple[str, Dict[str, Any]]]:
+    """The (agent, state) pairs a sequential run asks tiers for."""
+
+    state: Dict[str, Any] = {"description_text": description, "chat_history": []}
+    calls = []
+    for agent_key, output in AGENT_OUTPUTS.items():
+        calls.append((agent_key, dict(state)))
+        state[output] = f"{output.upper()}:\n- " + "\n- ".join(description.split("\n")[3:13])
+    return calls
+
+
+def _time_runs(runs: int, run_once: Callable[[], None]) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        run_once()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def run_benchmark(entries: int, runs: int) -> Dict[str, float]:
+    """Return milliseconds per pipeline run for both strategies."""
+
+    calls = _pipeline_states(build_service_history(entries))
+
+    def per_call() -> None:
+        for agent_key, state in calls:
+            ComplexityAnalysis(state).tier(agent_key)
+
+    def per_run() -> None:
+        with complexity_analysis(calls[0][1]):
+            for agent_key, state in calls:
+                determine_task_complexity(agent_key, state)
+
+    return {
+        "words": len(calls[0][1]["description_text"].split()),
+        "per_call_ms": round(_time_runs(runs, per_call), 3),
+        "per_run_ms": round(_time_runs(runs, per_run), 3),
+    }
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark model tier selection.")
+    parser.add_argument(
+        "--entries", type=int, nargs="+", default=[10, 100, 1000],
+        help="Service-history entries in the description.",
+    )
+    parser.add_argument("--runs", type=int, default=50, help="Pipeline runs per measurement.")
+    args = parser.parse_args()
+
+    print(f"{'Einträge':>9} {'Wörter':>8} {'pro Aufruf ms':>14} {'pro Lauf ms':>12}")
+    for entries in args.entries:
+        result = run_benchmark(entries, args.runs)
+        print(
+            f"{entries:>9} {result['words']:>8} "
+            f"{result['per_call_ms']:>14.3f} {result['per_run_ms']:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark profile matching of the fallback knowledge base against its size.
+
+Generates synthetic issue-profile sources with a growing number of
+profiles, compiles them with :mod:`agents.knowledge_base` and compares the
+trigram index with testing every keyword of every profile (what
+``fallbacks.py`` used to do). Both must find the same profiles.
+
+Example::
+
+    python benchmark_knowledge_base.py --profiles 10 100 1000 10000 --runs 200
+"""
+from __future__ import annotations
+
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from agents.knowledge_base import KnowledgeBase, text_grams
+
+
+_SYLLABLES = (
+    "ba", "bre", "ch", "de", "el", "fe", "ga", "hu", "in", "ka", "kl", "le", "mo",
+    "ne", "or", "pf", "qu", "ra", "sch", "st", "te", "un", "ve", "wa", "zi", "ß",
+)
+
+_DESCRIPTIONS = (
+    "Mein Volvo C30 vibriert stark beim Fahren, unabhängig von der Geschwindigkeit. "
+    "Die Spurstange rechts wurde ersetzt, das Zittern bleibt.",
+    "Beim Bremsen quietscht es vorne links, außerdem klackert der Motor im Leerlauf "
+    "und die Motorkontrollleuchte leuchtet seit gestern.",
+    Path(__file__).with_name("test_text.txt").read_text(encoding="utf-8"),
+)
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def build_profiles(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """*count* synthetic profiles with German keywords; a few use real symptom words."""
+
+    rng = random.Random(seed)
+    real_words = ("vibr", "zittern", "quietsch", "klacker", "leerlauf", "bremsen", "leuchte")
+    profiles = []
+    for number in range(count):
+        keywords = [_word(rng) for _ in range(rng.randint(3, 8))]
+        if number % 50 == 0:
+            keywords.append(rng.choice(real_words))
+        profiles.append(
+            {
+                "id": f"profile-{number}",
+                "keywords": {"de": keywords},
+                "behaviors": {"de": [f"- Verhalten {number}"]},
+                "causes": {"de": [f"- Ursache {number}"]},
+                "mechanic_steps": {"de": [f"Prüfschritt {number}"]},
+                "user_advice": {"de": [f"Hinweis {number}"]},
+                "replaced_parts": {"de": []},
+            }
+        )
+    return profiles
+
+
+def _time_runs(runs: int, run_once: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        run_once()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def run_benchmark(count: int, runs: int) -> Dict[str, float]:
+    """Return build/open times, index size and milliseconds per description."""
+
+    profiles = build_profiles(count)
+    texts = [description.lower().replace("ß", "ss") for description in _DESCRIPTIONS]
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = Path(directory) / "issue_profiles.json"
+        source.write_text(json.dumps({"version": 1, "profiles": profiles}), encoding="utf-8")
+        knowledge_base = KnowledgeBase(profiles_path=source, cache_dir=Path(directory) / "cache")
+
+        started = time.perf_counter()
+        path = knowledge_base.build("de")
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = knowledge_base.profiles("de")
+        open_ms = (time.perf_counter() - started) * 1000
+
+        def linear() -> List[List[int]]:
+            return [
+                [
+                    number
+                    for number, profile in enumerate(profiles)
+                    if any(keyword in text for keyword in profile["keywords"]["de"])
+                ]
+                for text in texts
+            ]
+
+        def indexed() -> List[List[int]]:
+            return [index.match(text, text_grams(text)) for text in texts]
+
+        if linear() != indexed():
+            raise AssertionError(f"Index und linearer Abgleich unterscheiden sich ({count} Profile).")
+
+        return {
+            "size_kb": round(path.stat().st_size / 1024, 1),
+            "build_s": round(build_seconds, 3),
+            "open_ms": round(open_ms, 3),
+            "linear_ms": round(_time_runs(runs, linear) / len(texts), 3),
+            "index_ms": round(_time_runs(runs, indexed) / len(texts), 3),
+        }
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the fallback knowledge base.")
+    parser.add_argument(
+        "--profiles", type=int, nargs="+", default=[10, 100, 1000, 10000],
+        help="Number of synthetic issue profiles.",
+    )
+    parser.add_argument("--runs", type=int, default=50, help="Matches per measurement.")
+    args = parser.parse_args()
+
+    print(
+        f"{'Profile':>8} {'Index KB':>9} {'Build s':>8} {'Öffnen ms':>10} "
+        f"{'linear ms':>10} {'Index ms':>9}"
+    )
+    for count in args.profiles:
+        result = run_benchmark(count, args.runs)
+        print(
+            f"{count:>8} {result['size_kb']:>9.1f} {result['build_s']:>8.3f} "
+            f"{result['open_ms']:>10.3f} {result['linear_ms']:>10.3f} {result['index_ms']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Near-duplicate detection for problem descriptions.
+
+Descriptions are normalized (case, umlauts, punctuation, whitespace) and cut
+into word shingles. A MinHash signature approximates the Jaccard similarity
+between two descriptions, and LSH banding turns the lookup into a handful of
+dictionary probes, so its cost does not grow with the number of stored
+diagnoses. Identical descriptions after normalization are found through an
+exact hash before any MinHash work is done.
+
+Signatures are kept in one flat ``array('Q')`` (8 bytes per value) and the
+band buckets are keyed by a single integer per band, so a stored diagnosis
+costs well under 2 KB of memory; descriptions and states of a file-backed
+index stay on disk.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+_MAX_HASH = (1 << 64) - 1
+_TOKEN_PATTERN = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize_description(text: str) -> str:
+    """Lower-case *text*, fold umlauts and drop punctuation and extra whitespace."""
+
+    text = text.casefold()
+    text = text.replace("ß", "ss").replace("ä", "ae").replace("ö", "oe").replace("ü", "ue")
+    return " ".join(token for token in _TOKEN_PATTERN.split(text) if token)
+
+
+def _shingles(normalized: str, size: int) -> set[str]:
+    tokens = normalized.split()
+    if len(tokens) <= size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+@dataclass(frozen=True)
+class SimilarDiagnosis:
+    """A stored diagnosis whose description resembles the submitted one."""
+
+    similarity: float
+    description: str
+    state: Dict[str, Any]
+
+
+class DescriptionIndex:
+    """MinHash/LSH index of diagnosed descriptions.
+
+    With a *path* every added diagnosis is appended to a JSONL file together
+    with its signature, and the index is rebuilt from that file on start-up.
+    Only the file offset of each record is kept in memory then; description
+    and state are read back when a lookup hits it. With *ttl_seconds* entries
+    older than that are no longer returned (and not loaded on start-up).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 3,
+        path: str | Path | None = None,
+        ttl_seconds: float | None = None,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.path = Path(path) if path else None
+        self.ttl_seconds = ttl_seconds
+
+        # Multiply-shift hash family on 64-bit words; numpy wraps the
+        # arithmetic modulo 2**64, which keeps the signature vectorised.
+        rng = random.Random(1)
+        self._multipliers = np.array(
+            [rng.getrandbits(64) | 1 for _ in range(num_perm)], dtype=np.uint64
+        )[:, None]
+        self._offsets = np.array(
+            [rng.getrandbits(64) for _ in range(num_perm)], dtype=np.uint64
+        )[:, None]
+        self._lock = threading.Lock()
+        self._signatures = array("Q")
+        # Per entry: (description, state) in memory, or the record's file offset.
+        self._records: List[Tuple[str, Dict[str, Any]]] = []
+        self._positions = array("q")
+        self._created = array("d")
+        # Exact matches by a 64-bit hash of the normalized text; verified on a hit.
+        self._exact: Dict[int, int] = {}
+        # Band key -> entry id, or a list of ids once a bucket is shared.
+        self._buckets: List[Dict[int, int | List[int]]] = [{} for _ in range(bands)]
+
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._signatures) // self.num_perm
+
+    def signature(self, normalized: str) -> Tuple[int, ...]:
+        hashes = [_hash64(shingle) for shingle in _shingles(normalized, self.shingle_size)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        values = np.array(hashes, dtype=np.uint64)
+        return tuple((self._multipliers * values + self._offsets).min(axis=1).tolist())
+
+    def _band_keys(self, signature: Sequence[int]) -> Iterator[Tuple[int, int]]:
+        # Colliding keys only add candidates; the signatures are compared anyway.
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, hash(tuple(signature[start : start + self.rows]))
+
+    def _insert(
+        self,
+        normalized: str,
+        signature: Sequence[int],
+        record: Tuple[str, Dict[str, Any]] | int,
+        created: float,
+    ) -> None:
+        entry_id = len(self)
+        self._signatures.extend(signature)
+        self._created.append(created)
+        if isinstance(record, int):
+            self._positions.append(record)
+        else:
+            self._records.append(record)
+        self._exact[_hash64(normalized)] = entry_id
+        for band, key in self._band_keys(signature):
+            bucket = self._buckets[band]
+            entries = bucket.get(key)
+            if entries is None:
+                bucket[key] = entry_id
+            elif isinstance(entries, list):
+                entries.append(entry_id)
+            else:
+                bucket[key] = [entries, entry_id]
+
+    def _load(self) -> None:
+        assert self.path is not None
+        with self.path.open("rb") as file:
+            offset = file.tell()
+            for line in iter(file.readline, b""):
+                try:
+                    record = json.loads(line)
+                    description = record["description"]
+                    signature = tuple(record["signature"])
+                    # Records written before expiry existed count as expired.
+                    created = float(record.get("created", 0))
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    signature = ()
+                if len(signature) == self.num_perm and not self._expired(created):
+                    self._insert(normalize_description(description), signature, offset, created)
+                offset = file.tell()
+        logger.info("📚 %s gespeicherte Diagnosen für die Ähnlichkeitssuche geladen.", len(self))
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def _record(self, entry_id: int) -> Tuple[str, Dict[str, Any]]:
+        """Description and state of *entry_id*."""
+
+        if not self.path:
+            return self._records[entry_id]
+
+        with self.path.open("rb") as file:
+            file.seek(self._positions[entry_id])
+            record = json.loads(file.readline())
+        return record["description"], record.get("state", {})
+
+    def add(self, description: str, state: Dict[str, Any]) -> None:
+        """Remember the diagnosis *state* for *description*."""
+
+        normalized = normalize_description(description)
+        if not normalized:
+            return
+
+        signature = self.signature(normalized)
+        created = time.time()
+        with self._lock:
+            if not self.path:
+                self._insert(normalized, signature, (description, state), created)
+                return
+
+            record = {
+                "description": description,
+                "signature": signature,
+                "state": state,
+                "created": round(created, 3),
+            }
+            with self.path.open("ab") as file:
+                offset = file.tell()
+                file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._insert(normalized, signature, offset, created)
+
+    def lookup(self, description: str) -> SimilarDiagnosis | None:
+        """Return the most similar stored diagnosis above the threshold."""
+
+        normalized = normalize_description(description)
+        if not normalized:
+            return None
+
+        with self._lock:
+            entry_id = self._exact.get(_hash64(normalized))
+            if entry_id is not None and self._expired(self._created[entry_id]):
+                entry_id = None
+        if entry_id is not None:
+            stored_description, state = self._record(entry_id)
+            if normalize_description(stored_description) == normalized:
+                return SimilarDiagnosis(1.0, stored_description, state)
+
+        signature = self.signature(normalized)
+        best_id, best_similarity = -1, 0.0
+        with self._lock:
+            candidates = set()
+            for band, key in self._band_keys(signature):
+                entries = self._buckets[band].get(key)
+                if isinstance(entries, list):
+                    candidates.update(entries)
+                elif entries is not None:
+                    candidates.add(entries)
+            for candidate in candidates:
+                if self._expired(self._created[candidate]):
+                    continue
+                start = candidate * self.num_perm
+                stored = self._signatures[start : start + self.num_perm]
+                agreement = sum(1 for a, b in zip(signature, stored) if a == b) / self.num_perm
+                if agreement > best_similarity:
+                    best_id, best_similarity = candidate, agreement
+
+        if best_id < 0 or best_similarity < self.threshold:
+            return None
+        stored_description, state = self._record(best_id)
+        return SimilarDiagnosis(round(best_similarity, 3), stored_description, state)
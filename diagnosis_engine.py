@@ -0,0 +1,662 @@
+"""Diagnosis engine: LangGraph workflow and pipeline runners without any UI.
+
+The Streamlit app, the batch runner and other entry points import the graph
+and the pipeline functions from here.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from functools import lru_cache, partial
+from typing import Annotated, Any, Callable, Dict, Iterable, TypedDict
+
+from langgraph.graph import StateGraph, START, END
+
+from agents import (
+    identify_car,
+    new_parts,
+    noise,
+    behavior,
+    combined_extraction,
+    possible_solution,
+    chat_agent,
+    possible_cause,
+)
+from agents.cascade import cascade_stats
+from agents.circuit_breaker import ollama_status
+from agents.fallbacks import (
+    fallback_behaviors,
+    fallback_car_details,
+    fallback_changed_parts,
+    fallback_possible_causes,
+    fallback_possible_solutions,
+)
+from agents.llm_cache import cache_stats
+from agents.ollama_pool import async_http_session
+from agents.prompts import PromptEvalStats, prompt_eval_run
+from agents.scheduler import request_priority
+from agents.utils import (
+    complexity_analysis,
+    detect_language,
+    get_pipeline_setting,
+    load_bot_settings,
+    plan_agent_run,
+    resolve_language,
+)
+from description_index import DescriptionIndex, SimilarDiagnosis
+
+
+logger = logging.getLogger(__name__)
+
+
+# Statusdefinition
+def _merge_timings(left: Dict[str, float] | None, right: Dict[str, float] | None) -> Dict[str, float]:
+    """Reducer that lets parallel nodes report their runtimes independently."""
+
+    merged = dict(left or {})
+    merged.update(right or {})
+    return merged
+
+
+class GraphState(TypedDict, total=False):
+    """Shared state passed between the different LangGraph nodes."""
+
+    description_text: str
+    car_details: str
+    affected_parts: str
+    affected_behaviors: str
+    possible_causes: str
+    possible_solutions: str
+    noises: str
+    changed_parts: str
+    chat_response: str
+    user_question: str
+    chat_history: list[dict[str, str]]
+    chat_summary: Dict[str, Any]
+    agent_timings: Annotated[Dict[str, float], _merge_timings]
+    timing_report: Dict[str, Any]
+    reused_from: Dict[str, Any]
+    language: str
+    latency_budget: float
+    provisional: bool
+    provisional_fields: list[str]
+    fallback_agents: list[str]
+
+
+EXTRACTION_MODE = get_pipeline_setting("extraction_mode", "parallel")
+
+EXTRACTION_NODES = ("identify_car", "behavior", "noise", "new_parts")
+
+
+def _timed_node(name: str, node_fn: Callable[[Dict[str, Any]], Dict[str, Any]]):
+    """Wrap *node_fn* so that its runtime ends up in ``agent_timings``."""
+
+    def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = node_fn(state)
+        elapsed = time.perf_counter() - started
+        return {**result, "agent_timings": {name: round(elapsed, 3)}}
+
+    return wrapper
+
+
+def build_timing_report(
+    agent_timings: Dict[str, float], wall_seconds: float, mode: str
+) -> Dict[str, Any]:
+    """Summarise a run and compare it with the purely sequential runtime."""
+
+    sequential_seconds = round(sum(agent_timings.values()), 3)
+    wall_seconds = round(wall_seconds, 3)
+    report = {
+        "mode": mode,
+        "wall_seconds": wall_seconds,
+        "sequential_seconds": sequential_seconds,
+        "saved_seconds": round(max(sequential_seconds - wall_seconds, 0.0), 3),
+        "agents": dict(agent_timings),
+    }
+    logger.info(
+        "⏱️ Laufzeit (%s): %.2fs gesamt | %.2fs Summe der Agenten | %.2fs gespart | %s",
+        mode,
+        report["wall_seconds"],
+        report["sequential_seconds"],
+        report["saved_seconds"],
+        ", ".join(f"{name}={seconds:.2f}s" for name, seconds in agent_timings.items()),
+    )
+    return report
+
+
+# Langgraph Workflow
+def build_workflow(extraction_mode: str = EXTRACTION_MODE) -> StateGraph:
+    """Create the diagnosis graph.
+
+    In ``parallel`` mode the four extraction agents only depend on
+    ``description_text`` and therefore fan out from the start node; the
+    cause agent waits until all of them have finished. ``combined`` replaces
+    them with a single extraction call. ``sequential`` keeps the original
+    chain.
+    """
+
+    workflow = StateGraph(GraphState)
+    if extraction_mode == "combined":
+        workflow.add_node(
+            "combined_extraction",
+            _timed_node("combined_extraction", combined_extraction.combined_extraction),
+        )
+    else:
+        workflow.add_node("identify_car", _timed_node("identify_car", identify_car.identify_car))
+        workflow.add_node("new_parts", _timed_node("new_parts", new_parts.new_parts))
+        workflow.add_node("noise", _timed_node("noise", noise.noise))
+        workflow.add_node("behavior", _timed_node("behavior", behavior.behavior))
+    workflow.add_node(
+        "possible_solution",
+        _timed_node("possible_solution", possible_solution.possible_solution),
+    )
+    workflow.add_node(
+        "possible_cause", _timed_node("possible_cause", possible_cause.possible_cause)
+    )
+    workflow.add_node("chat", chat_agent.chat_node)
+    # workflow.add_node("stop_models", stop_models_node)
+
+    if extraction_mode == "combined":
+        workflow.set_entry_point("combined_extraction")
+        workflow.add_edge("combined_extraction", "possible_cause")
+    elif extraction_mode == "parallel":
+        for node_name in EXTRACTION_NODES:
+            workflow.add_edge(START, node_name)
+        workflow.add_edge(list(EXTRACTION_NODES), "possible_cause")
+    else:
+        workflow.set_entry_point("identify_car")
+        workflow.add_edge("identify_car", "behavior")
+        workflow.add_edge("behavior", "noise")
+        workflow.add_edge("noise", "new_parts")
+        workflow.add_edge("new_parts", "possible_cause")
+    workflow.add_edge("possible_cause", "possible_solution")
+    workflow.add_edge("possible_solution", "chat")
+    workflow.add_edge("chat", END)
+    # workflow.add_edge("chat", "stop_models")
+    # workflow.add_edge("stop_models", END)
+    return workflow
+
+
+workflow = build_workflow()
+graph = workflow.compile()
+
+
+EXTRACTION_AGENTS = (
+    ("identify_car_agent", identify_car.identify_car, ("car_details",)),
+    ("behavior_agent", behavior.behavior, ("affected_behaviors",)),
+    ("noise_agent", noise.noise, ("noises",)),
+    ("new_parts_agent", new_parts.new_parts, ("changed_parts",)),
+)
+
+ANALYSIS_AGENTS = (
+    ("possible_cause_agent", possible_cause.possible_cause, ("possible_causes",)),
+    ("possible_solution_agent", possible_solution.possible_solution, ("possible_solutions",)),
+)
+
+AGENT_SEQUENCE = EXTRACTION_AGENTS + ANALYSIS_AGENTS
+
+# Agents that accept an ``on_token`` callback and can stream their answer.
+STREAMING_AGENTS = {"possible_cause_agent", "possible_solution_agent"}
+
+ASYNC_AGENTS = {
+    "identify_car_agent": identify_car.aidentify_car,
+    "behavior_agent": behavior.abehavior,
+    "noise_agent": noise.anoise,
+    "new_parts_agent": new_parts.anew_parts,
+    "possible_cause_agent": possible_cause.apossible_cause,
+    "possible_solution_agent": possible_solution.apossible_solution,
+}
+
+
+def _run_timed(agent_fn, state: Dict[str, Any]) -> tuple[Dict[str, Any], float]:
+    started = time.perf_counter()
+    result = agent_fn(state)
+    return result, time.perf_counter() - started
+
+
+async def _arun_timed(agent_fn, state: Dict[str, Any]) -> tuple[Dict[str, Any], float]:
+    started = time.perf_counter()
+    result = await agent_fn(state)
+    return result, time.perf_counter() - started
+
+
+def _plan_steps(changed_fields: Iterable[str] | None, locked: set[str]):
+    """Split the planned agents into extraction and analysis steps."""
+
+    if changed_fields is None:
+        planned = {agent_key for agent_key, _, _ in AGENT_SEQUENCE}
+    else:
+        planned = set(plan_agent_run(changed_fields, locked))
+    skipped = [agent_key for agent_key, _, _ in AGENT_SEQUENCE if agent_key not in planned]
+    if skipped:
+        logger.info("⏭️ Unveränderte Eingaben, übersprungen: %s", ", ".join(skipped))
+
+    extraction_steps = [step for step in EXTRACTION_AGENTS if step[0] in planned]
+    analysis_steps = [step for step in ANALYSIS_AGENTS if step[0] in planned]
+    return extraction_steps, analysis_steps, skipped
+
+
+def _from_description(
+    generate: Callable[[str, str], str]
+) -> Callable[[Dict[str, Any], str], str]:
+    return lambda state, language: generate(state.get("description_text", ""), language)
+
+
+# Deterministic generators that fill a field before its agent has answered.
+PROVISIONAL_GENERATORS: Dict[str, Callable[[Dict[str, Any], str], str]] = {
+    "car_details": _from_description(fallback_car_details),
+    "affected_behaviors": _from_description(fallback_behaviors),
+    "changed_parts": _from_description(fallback_changed_parts),
+    "possible_causes": fallback_possible_causes,
+    "possible_solutions": fallback_possible_solutions,
+}
+
+PROVISIONAL_TRIAGE = bool(get_pipeline_setting("provisional_triage", True))
+
+
+def provisional_diagnosis(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Rule-based triage of *state*, available before any model has answered.
+
+    Returns the fields the fallback generators can fill, tagged with
+    ``provisional`` and the list of ``provisional_fields`` that the pipeline
+    replaces as its agents complete (see ``on_update`` of
+    :func:`run_diagnosis_pipeline`).
+    """
+
+    started = time.perf_counter()
+    language = resolve_language(state)
+    filled = {
+        field: value
+        for field, generate in PROVISIONAL_GENERATORS.items()
+        if (value := generate(state, language))
+    }
+    updates: Dict[str, Any] = {"language": language, **filled}
+    updates["provisional"] = True
+    updates["provisional_fields"] = [
+        key for _, _, produced_keys in AGENT_SEQUENCE for key in produced_keys
+    ]
+    logger.info(
+        "⚡ Vorläufige Einschätzung nach %.2f ms (%s Felder)",
+        (time.perf_counter() - started) * 1000,
+        len(filled),
+    )
+    return updates
+
+
+class _PipelineRun:
+    """Collects agent results and timings of a single pipeline run."""
+
+    def __init__(
+        self,
+        state: Dict[str, Any],
+        locked: set[str],
+        on_update: Callable[[str, Any], None] | None = None,
+        changed_fields: Iterable[str] | None = None,
+    ):
+        self.working_state: Dict[str, Any] = dict(state)
+        self.locked = locked
+        self.on_update = on_update
+        if changed_fields is not None and "description_text" in changed_fields:
+            # Appended text may be in another language; detect it again.
+            self.working_state["language"] = ""
+        # Detect the language once; fallbacks of all agents reuse it.
+        self.updates: Dict[str, Any] = {"language": resolve_language(self.working_state)}
+        self.agent_timings: Dict[str, float] = {}
+        # Agents that answered from their rule-based fallback (they set "warning").
+        self.fallback_agents: list[str] = []
+        self.started = time.perf_counter()
+        self.first_token_seconds: float | None = None
+        self.prompt_eval = PromptEvalStats()
+
+    def token_callback(
+        self, field: str, on_token: Callable[[str, str], None]
+    ) -> Callable[[str], None]:
+        """Bind *on_token* to *field* and remember when the first token arrived."""
+
+        def callback(token: str) -> None:
+            if self.first_token_seconds is None:
+                self.first_token_seconds = round(time.perf_counter() - self.started, 3)
+            on_token(field, token)
+
+        return callback
+
+    def collect(self, agent_fn, produced_keys, agent_result, elapsed) -> None:
+        self.working_state.update(agent_result)
+        self.agent_timings[agent_fn.__name__] = round(elapsed, 3)
+        if agent_result.get("warning"):
+            self.fallback_agents.append(agent_fn.__name__)
+        for key in produced_keys:
+            if key in agent_result and key not in self.locked:
+                self.updates[key] = agent_result[key]
+                if self.on_update is not None:
+                    self.on_update(key, agent_result[key])
+
+    def finish(self, mode: str, skipped: list[str]) -> Dict[str, Any]:
+        timing_report = build_timing_report(
+            self.agent_timings, time.perf_counter() - self.started, mode
+        )
+        timing_report["skipped_agents"] = skipped
+        timing_report["fallback_agents"] = self.fallback_agents
+        timing_report["cache"] = cache_stats()
+        timing_report["cascade"] = cascade_stats()
+        timing_report["ollama"] = ollama_status()
+        timing_report["prompt_eval"] = self.prompt_eval.snapshot()
+        if self.first_token_seconds is not None:
+            timing_report["first_token_seconds"] = self.first_token_seconds
+            logger.info("⏱️ Erstes gestreamtes Token nach %.2fs", self.first_token_seconds)
+        self.updates["timing_report"] = timing_report
+        # Every field now comes from the agents (or their own fallbacks).
+        self.updates["provisional"] = False
+        self.updates["provisional_fields"] = []
+        self.updates["fallback_agents"] = self.fallback_agents
+        return self.updates
+
+
+def run_diagnosis_pipeline(
+    state: Dict[str, Any],
+    locked_fields: Iterable[str] | None = None,
+    extraction_mode: str = EXTRACTION_MODE,
+    changed_fields: Iterable[str] | None = None,
+    on_token: Callable[[str, str], None] | None = None,
+    on_update: Callable[[str, Any], None] | None = None,
+) -> Dict[str, Any]:
+    """Recalculate the diagnosis when new information is provided via chat.
+
+    Without *changed_fields* every agent runs again. Otherwise only the agents
+    whose inputs changed and their downstream dependents are executed (see
+    :func:`agents.utils.plan_agent_run`).
+
+    With *on_token* the cause and solution agents stream their answers; the
+    callback receives the target field and each token as it arrives.
+    *on_update* receives every field and its final value as soon as the
+    agent producing it is done (e.g. to replace a provisional value).
+    """
+
+    locked = set(locked_fields or [])
+    run = _PipelineRun(state, locked, on_update, changed_fields)
+    extraction_steps, analysis_steps, skipped = _plan_steps(changed_fields, locked)
+
+    with complexity_analysis(run.working_state), prompt_eval_run(run.prompt_eval):
+        if extraction_mode == "combined" and len(extraction_steps) > 1:
+            # One prompt for all pending extraction fields instead of one per agent.
+            fields = tuple(
+                key for _, _, produced_keys in extraction_steps for key in produced_keys
+            )
+            agent_fn = combined_extraction.combined_extraction
+            agent_result, elapsed = _run_timed(
+                partial(agent_fn, fields=fields), run.working_state
+            )
+            run.collect(agent_fn, fields, agent_result, elapsed)
+            remaining = analysis_steps
+        elif extraction_mode == "parallel" and len(extraction_steps) > 1:
+            # All extraction agents read the same snapshot, so they can run concurrently.
+            snapshot = dict(run.working_state)
+            with ThreadPoolExecutor(max_workers=len(extraction_steps)) as executor:
+                # Worker threads need the context to share the complexity analysis.
+                futures = {
+                    executor.submit(copy_context().run, _run_timed, agent_fn, snapshot): (
+                        agent_fn,
+                        produced_keys,
+                    )
+                    for _, agent_fn, produced_keys in extraction_steps
+                }
+                # Collect in completion order, so on_update sees each field early.
+                for future in as_completed(futures):
+                    agent_fn, produced_keys = futures[future]
+                    agent_result, elapsed = future.result()
+                    run.collect(agent_fn, produced_keys, agent_result, elapsed)
+            remaining = analysis_steps
+        else:
+            remaining = extraction_steps + analysis_steps
+
+        for agent_key, agent_fn, produced_keys in remaining:
+            call = agent_fn
+            if on_token is not None and agent_key in STREAMING_AGENTS:
+                call = partial(
+                    agent_fn, on_token=run.token_callback(produced_keys[0], on_token)
+                )
+            agent_result, elapsed = _run_timed(call, run.working_state)
+            run.collect(agent_fn, produced_keys, agent_result, elapsed)
+
+    return run.finish(extraction_mode, skipped)
+
+
+async def arun_diagnosis_pipeline(
+    state: Dict[str, Any],
+    locked_fields: Iterable[str] | None = None,
+    changed_fields: Iterable[str] | None = None,
+    on_update: Callable[[str, Any], None] | None = None,
+) -> Dict[str, Any]:
+    """Async variant of :func:`run_diagnosis_pipeline`.
+
+    The extraction agents are awaited together with :func:`asyncio.gather`;
+    every agent call is bounded by its configured timeout and falls back to
+    the deterministic generators when the deadline expires. All calls of one
+    run share a pooled HTTP session and one complexity analysis.
+    """
+
+    locked = set(locked_fields or [])
+    run = _PipelineRun(state, locked, on_update, changed_fields)
+    extraction_steps, analysis_steps, skipped = _plan_steps(changed_fields, locked)
+
+    async with async_http_session():
+        with complexity_analysis(run.working_state), prompt_eval_run(run.prompt_eval):
+            snapshot = dict(run.working_state)
+            results = await asyncio.gather(
+                *(
+                    _arun_timed(ASYNC_AGENTS[agent_key], snapshot)
+                    for agent_key, _, _ in extraction_steps
+                )
+            )
+            for (_, agent_fn, produced_keys), (agent_result, elapsed) in zip(
+                extraction_steps, results
+            ):
+                run.collect(agent_fn, produced_keys, agent_result, elapsed)
+
+            for agent_key, agent_fn, produced_keys in analysis_steps:
+                agent_result, elapsed = await _arun_timed(
+                    ASYNC_AGENTS[agent_key], run.working_state
+                )
+                run.collect(agent_fn, produced_keys, agent_result, elapsed)
+
+    return run.finish("async", skipped)
+
+
+DIAGNOSIS_FIELDS = (
+    "car_details",
+    "affected_parts",
+    "affected_behaviors",
+    "noises",
+    "changed_parts",
+    "possible_causes",
+    "possible_solutions",
+)
+
+
+def new_diagnosis_state(description: str = "") -> Dict[str, Any]:
+    """Return an empty diagnosis state for *description*."""
+
+    state: Dict[str, Any] = {field: "" for field in DIAGNOSIS_FIELDS}
+    state.update(
+        {
+            "description_text": description,
+            "chat_response": "",
+            "user_question": "",
+            "chat_history": [],
+            "chat_summary": {},
+            "agent_timings": {},
+            "timing_report": {},
+            "reused_from": {},
+            "provisional": False,
+            "provisional_fields": [],
+            "fallback_agents": [],
+            "language": detect_language(description) if description.strip() else "",
+        }
+    )
+    return state
+
+
+DEDUP_MODE = load_bot_settings().get("dedup", {}).get("mode", "offer")
+
+
+@lru_cache(maxsize=1)
+def get_description_index() -> DescriptionIndex | None:
+    """Return the shared similarity index configured in ``bots_settings.json``.
+
+    ``None`` when the ``dedup`` section is missing or disabled.
+    """
+
+    settings = load_bot_settings().get("dedup")
+    if not isinstance(settings, dict) or not settings.get("enabled", False):
+        return None
+    return DescriptionIndex(
+        threshold=float(settings.get("threshold", 0.85)),
+        path=settings.get("path"),
+        ttl_seconds=settings.get("ttl_seconds"),
+    )
+
+
+def find_similar_diagnosis(description: str) -> SimilarDiagnosis | None:
+    """Look up a stored diagnosis for a (near-)identical description."""
+
+    index = get_description_index()
+    if index is None:
+        return None
+
+    started = time.perf_counter()
+    match = index.lookup(description)
+    if match is not None:
+        logger.info(
+            "♻️ Ähnliche Diagnose gefunden (Ähnlichkeit %.2f, %.2f ms)",
+            match.similarity,
+            (time.perf_counter() - started) * 1000,
+        )
+    return match
+
+
+def remember_diagnosis(state: Dict[str, Any]) -> None:
+    """Add a finished diagnosis to the similarity index.
+
+    Diagnoses in which an agent fell back to its rule-based answer (e.g.
+    during an Ollama outage) are not stored, so they are never served as
+    model answers later.
+    """
+
+    index = get_description_index()
+    if index is None or state.get("reused_from") or state.get("chat_history"):
+        return
+    if state.get("fallback_agents"):
+        logger.info(
+            "♻️ Diagnose nicht gespeichert – Fallback-Antworten von %s.",
+            ", ".join(state["fallback_agents"]),
+        )
+        return
+
+    stored = {field: state.get(field, "") for field in DIAGNOSIS_FIELDS}
+    index.add(state.get("description_text", ""), stored)
+
+
+def reuse_diagnosis(description: str, match: SimilarDiagnosis) -> Dict[str, Any]:
+    """Build a fresh state for *description* from the stored *match*."""
+
+    state = new_diagnosis_state(description)
+    state.update({field: match.state.get(field, "") for field in DIAGNOSIS_FIELDS})
+    state["reused_from"] = {
+        "description": match.description,
+        "similarity": match.similarity,
+    }
+    return state
+
+
+def diagnose(
+    description: str,
+    extraction_mode: str = EXTRACTION_MODE,
+    reuse: bool | None = None,
+    latency_budget: float | None = None,
+    on_update: Callable[[str, Any], None] | None = None,
+) -> Dict[str, Any]:
+    """Run the full pipeline for a new *description* and return the final state.
+
+    With *reuse* (default: ``dedup.mode`` is ``serve``) a stored diagnosis of
+    a near-identical description is returned instead of running the agents.
+    *latency_budget* caps the estimated seconds per model call (see
+    :mod:`agents.router`). *on_update* is passed to
+    :func:`run_diagnosis_pipeline`.
+    """
+
+    if reuse is None:
+        reuse = DEDUP_MODE == "serve"
+    if reuse:
+        match = find_similar_diagnosis(description)
+        if match is not None:
+            return reuse_diagnosis(description, match)
+
+    state = new_diagnosis_state(description)
+    if latency_budget:
+        state["latency_budget"] = latency_budget
+    state.update(
+        run_diagnosis_pipeline(state, extraction_mode=extraction_mode, on_update=on_update)
+    )
+    remember_diagnosis(state)
+    return state
+
+
+def answer_chat(
+    state: Dict[str, Any], question: str, on_token: Callable[[str], None] | None = None
+) -> Dict[str, Any]:
+    """Answer *question* and fold new facts back into the diagnosis.
+
+    Returns the updated state. When the chat agent reports new information,
+    only the affected agents run again (see :func:`run_diagnosis_pipeline`).
+    With *on_token* the chat answer is streamed to the callback.
+    """
+
+    working_state: Dict[str, Any] = dict(state)
+    working_state["user_question"] = question
+    with request_priority("chat"), prompt_eval_run() as prompt_eval:
+        result = chat_agent.chat_node(working_state, on_token=on_token)
+    for stats in prompt_eval.snapshot().values():
+        logger.info(
+            "🧮 Chat-Prompt: %s Token in %.2fs ausgewertet",
+            stats["prompt_tokens"],
+            stats["prompt_seconds"],
+        )
+
+    locked_fields = set(result.pop("locked_fields", []))
+    regenerate = bool(result.pop("regenerate", False))
+
+    description = result.get("description_text")
+    if description is not None and description != working_state.get("description_text"):
+        # The cached language belongs to the old description.
+        working_state["language"] = ""
+    working_state.update(result)
+    working_state["user_question"] = ""
+
+    if regenerate:
+        try:
+            logger.info("🔁 Zusätzliche Informationen erkannt – Diagnose wird aktualisiert.")
+            # Only re-run agents affected by the fields the chat updated;
+            # a bare regenerate request without updates re-runs everything.
+            diagnosis_updates = run_diagnosis_pipeline(
+                working_state,
+                locked_fields,
+                changed_fields=locked_fields or None,
+            )
+            working_state.update(diagnosis_updates)
+            logger.debug(
+                "🧮 Aktualisierte Diagnosefelder: %s",
+                json.dumps(diagnosis_updates, indent=2, ensure_ascii=False),
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception(
+                "❌ Fehler beim Aktualisieren der Diagnose nach Chat-Eingabe: %s", exc
+            )
+
+    return working_state
+
@@ -0,0 +1,383 @@
+"""Lightweight HTTP service exposing the diagnosis engine.
+
+Endpoints (JSON in, JSON out):
+
+- ``POST /diagnose`` with ``{"description": "...", "extraction_mode": "parallel"}``
+  returns ``{"state": {...}}`` with the full diagnosis state. ``"reuse": true``
+  returns a stored diagnosis of a near-identical description instead of
+  running the agents (default: ``dedup.mode`` is ``serve``).
+  ``"latency_budget": 20`` limits every model call to an estimated 20 seconds
+  (see ``agents/router.py``). ``"priority": "batch"`` queues the model
+  calls behind interactive work (default ``regeneration``).
+  ``"provisional": true`` answers at once with ``202`` and
+  ``{"job": "...", "state": {...}}``: the rule-based triage, tagged with
+  ``"provisional": true``, while the agents run in the background.
+- ``GET /diagnose/<job>`` returns ``{"job", "done", "state"}`` of such a
+  run; every field is replaced as soon as its agent is done and removed
+  from ``state["provisional_fields"]``.
+- ``POST /chat`` with ``{"state": {...}, "question": "..."}`` answers a
+  follow-up question and returns the updated state.
+- ``GET /health`` reports queue, worker, response cache, cascade, model
+  scheduler, model throughput, prompt evaluation and JSON parse statistics
+  and the state of the Ollama circuit breaker.
+
+Requests are executed on a fixed worker pool; ``/chat`` has its own pool of
+``chat_workers`` threads, so a follow-up question never waits behind queued
+diagnoses. Up to ``max_queue`` requests per pool wait for a free worker,
+further requests are rejected with ``503``. The
+number of concurrent calls per model tier is limited by ``max_in_flight`` in
+``bots_settings.json`` and enforced by the process-wide model scheduler.
+
+Example::
+
+    python diagnosis_service.py --port 8600 --workers 4
+"""
+from __future__ import annotations
+
+import copy
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Tuple
+
+from agents.cascade import cascade_stats
+from agents.circuit_breaker import ollama_status
+from agents.json_stream import json_parse_stats
+from agents.prompts import prompt_eval_stats
+from agents.llm_cache import cache_stats
+from agents.ollama_pool import close_http_sessions
+from agents.residency import start_model_residency
+from agents.router import get_router, start_model_router
+from agents.scheduler import PRIORITY_CLASSES, request_priority, scheduler_stats
+from agents.utils import load_bot_settings, warm_up_language_detection
+from diagnosis_engine import (
+    EXTRACTION_MODE,
+    answer_chat,
+    diagnose,
+    new_diagnosis_state,
+    provisional_diagnosis,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceBusy(Exception):
+    """Raised when the request queue is full."""
+
+
+class DiagnosisWorkerPool:
+    """Runs engine calls on a fixed number of threads with a bounded queue."""
+
+    def __init__(self, workers: int, max_queue: int, name: str = "diagnosis"):
+        self.workers = max(workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self.jobs = DiagnosisJobs()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_system = self._submitted - self._completed
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(in_system, self.workers),
+            "queued": max(in_system - self.workers, 0),
+            "completed": self._completed,
+        }
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Queue *fn* on the pool without waiting for it.
+
+        *fn* runs in a copy of the caller's context, so its model calls keep
+        the caller's :func:`agents.scheduler.request_priority`.
+        """
+
+        with self._lock:
+            if self._submitted - self._completed >= self.workers + self.max_queue:
+                raise ServiceBusy("Zu viele offene Anfragen")
+            self._submitted += 1
+
+        try:
+            future = self._executor.submit(copy_context().run, fn, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future: Future | None) -> None:
+        with self._lock:
+            self._completed += 1
+
+    def run(self, fn: Callable[..., Dict[str, Any]], *args: Any) -> Dict[str, Any]:
+        """Execute *fn* on the pool and wait for its result."""
+
+        return self.submit(fn, *args).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DiagnosisJobs:
+    """Background diagnoses started with ``"provisional": true``.
+
+    Keeps at most ``max_jobs`` runs; the oldest finished ones are dropped
+    first.
+    """
+
+    def __init__(self, max_jobs: int = 256):
+        self.max_jobs = max(max_jobs, 1)
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+
+    def create(self, state: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"job": job_id, "done": False, "state": state}
+            finished = [key for key, job in self._jobs.items() if job["done"]]
+            while len(self._jobs) > self.max_jobs and finished:
+                del self._jobs[finished.pop(0)]
+        return job_id
+
+    def update(self, job_id: str, field: str, value: Any) -> None:
+        """Replace a provisional *field* with the agent's result."""
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            state = job["state"]
+            state[field] = value
+            if field in state.get("provisional_fields", []):
+                state["provisional_fields"].remove(field)
+
+    def finish(self, job_id: str, state: Dict[str, Any] | None = None, error: str = "") -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["done"] = True
+            if state is not None:
+                job["state"] = state
+            if error:
+                job["error"] = error
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+
+def _run_job(jobs: DiagnosisJobs, job_id: str, *args: Any) -> None:
+    try:
+        state = diagnose(*args, on_update=lambda field, value: jobs.update(job_id, field, value))
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("❌ Fehler im Diagnoseauftrag %s: %s", job_id, exc)
+        jobs.finish(job_id, error=str(exc))
+        return
+    jobs.finish(job_id, state)
+
+
+def _handle_diagnose(pool: DiagnosisWorkerPool, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    description = str(payload.get("description") or "").strip()
+    if not description:
+        return HTTPStatus.BAD_REQUEST, {"error": "Feld 'description' fehlt."}
+
+    extraction_mode = payload.get("extraction_mode") or EXTRACTION_MODE
+    if extraction_mode not in ("parallel", "combined", "sequential"):
+        return HTTPStatus.BAD_REQUEST, {"error": f"Unbekannter Modus '{extraction_mode}'."}
+
+    latency_budget = payload.get("latency_budget")
+    try:
+        latency_budget = float(latency_budget) if latency_budget else None
+    except (TypeError, ValueError):
+        return HTTPStatus.BAD_REQUEST, {"error": "Feld 'latency_budget' muss eine Zahl sein."}
+
+    priority = payload.get("priority") or "regeneration"
+    if priority not in PRIORITY_CLASSES[1:]:
+        return HTTPStatus.BAD_REQUEST, {"error": f"Unbekannte Priorität '{priority}'."}
+
+    reuse = payload.get("reuse")
+    args = (description, extraction_mode, None if reuse is None else bool(reuse), latency_budget)
+    if payload.get("provisional"):
+        state = new_diagnosis_state(description)
+        state.update(provisional_diagnosis(state))
+        job_id = pool.jobs.create(copy.deepcopy(state))
+        with request_priority(priority):
+            try:
+                pool.submit(_run_job, pool.jobs, job_id, *args)
+            except ServiceBusy:
+                pool.jobs.finish(job_id, error="Zu viele offene Anfragen")
+                raise
+        return HTTPStatus.ACCEPTED, {"job": job_id, "done": False, "state": state}
+
+    with request_priority(priority):
+        state = pool.run(diagnose, *args)
+    return HTTPStatus.OK, {"state": state}
+
+
+def _handle_chat(pool: DiagnosisWorkerPool, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    question = str(payload.get("question") or "").strip()
+    state = payload.get("state")
+    if not question or not isinstance(state, dict):
+        return HTTPStatus.BAD_REQUEST, {"error": "Felder 'state' und 'question' werden benötigt."}
+
+    updated = pool.run(answer_chat, state, question)
+    return HTTPStatus.OK, {"chat_response": updated.get("chat_response", ""), "state": updated}
+
+
+def make_handler(pool: DiagnosisWorkerPool, chat_pool: DiagnosisWorkerPool | None = None):
+    """Build a request handler class bound to *pool* (and *chat_pool* for ``/chat``)."""
+
+    chat_pool = chat_pool or pool
+    routes = {
+        "/diagnose": (_handle_diagnose, pool),
+        "/chat": (_handle_chat, chat_pool),
+    }
+
+    class DiagnosisRequestHandler(BaseHTTPRequestHandler):
+        server_version = "DiaKari/1"
+
+        def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:  # noqa: N802 - http.server naming
+            if self.path == "/health":
+                router = get_router()
+                self._send_json(
+                    HTTPStatus.OK,
+                    {
+                        "status": "ok",
+                        **pool.stats(),
+                        "chat": chat_pool.stats(),
+                        "cache": cache_stats(),
+                        "cascade": cascade_stats(),
+                        "json_parse": json_parse_stats(),
+                        "ollama": ollama_status(),
+                        "prompt_eval": prompt_eval_stats(),
+                        "scheduler": scheduler_stats(),
+                        "models": router.snapshot() if router is not None else {},
+                    },
+                )
+            elif self.path.startswith("/diagnose/"):
+                job = pool.jobs.get(self.path[len("/diagnose/") :])
+                if job is None:
+                    self._send_json(HTTPStatus.NOT_FOUND, {"error": "Unbekannter Auftrag."})
+                else:
+                    self._send_json(HTTPStatus.OK, job)
+            else:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Unbekannter Pfad."})
+
+        def do_POST(self) -> None:  # noqa: N802 - http.server naming
+            handler, handler_pool = routes.get(self.path, (None, None))
+            if handler is None:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Unbekannter Pfad."})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except (ValueError, json.JSONDecodeError):
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Ungültiges JSON."})
+                return
+            if not isinstance(payload, dict):
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": "JSON-Objekt erwartet."})
+                return
+
+            try:
+                status, body = handler(handler_pool, payload)
+            except ServiceBusy as exc:
+                logger.warning("⚠️ Anfrage abgelehnt: %s", exc)
+                self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(exc)})
+                return
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("❌ Fehler bei %s: %s", self.path, exc)
+                self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(exc)})
+                return
+            self._send_json(status, body)
+
+        def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+            logger.info("%s - %s", self.address_string(), format % args)
+
+    return DiagnosisRequestHandler
+
+
+def create_server(
+    host: str, port: int, workers: int, max_queue: int, chat_workers: int = 2
+) -> ThreadingHTTPServer:
+    """Create (but do not start) the HTTP server and its worker pools."""
+
+    pool = DiagnosisWorkerPool(workers, max_queue)
+    chat_pool = DiagnosisWorkerPool(chat_workers, max_queue, name="chat")
+    server = ThreadingHTTPServer((host, port), make_handler(pool, chat_pool))
+    server.daemon_threads = True
+    server.pool = pool  # type: ignore[attr-defined]
+    server.chat_pool = chat_pool  # type: ignore[attr-defined]
+    return server
+
+
+def main() -> None:
+    import argparse
+
+    settings = load_bot_settings().get("service", {})
+    parser = argparse.ArgumentParser(description="Serve the diagnosis engine over HTTP.")
+    parser.add_argument("--host", default=settings.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=settings.get("port", 8600))
+    parser.add_argument(
+        "--workers", type=int, default=settings.get("workers", 4),
+        help="Number of requests processed concurrently.",
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=settings.get("max_queue", 32),
+        help="Requests allowed to wait for a worker before 503 is returned.",
+    )
+    parser.add_argument(
+        "--chat-workers", type=int, default=settings.get("chat_workers", 2),
+        help="Threads reserved for /chat requests.",
+    )
+    parser.add_argument("--log-level", default="INFO", help="Logging level for stderr.")
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    warm_up_language_detection()
+    start_model_residency()
+    start_model_router()
+    server = create_server(
+        args.host, args.port, args.workers, args.max_queue, args.chat_workers
+    )
+    logger.info("🚀 Diagnose-Service läuft auf http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("🛑 Diagnose-Service wird beendet.")
+    finally:
+        server.pool.shutdown()  # type: ignore[attr-defined]
+        server.chat_pool.shutdown()  # type: ignore[attr-defined]
+        server.server_close()
+        close_http_sessions()
+
+
+if __name__ == "__main__":
+    main()
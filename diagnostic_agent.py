@@ -8,20 +8,37 @@ DiaKari ist ein KI-gestützter Fahrzeugdiagnose-Agent, der auf der Llama3.1 basi
 """
 import streamlit as st
 import json
-from typing import Any, Dict, Iterable, TypedDict
-from langgraph.graph import StateGraph, END
+import time
+from typing import Any, Dict
 import logging
 from agents import (
     identify_car,
-    new_parts,
     noise,
     behavior,
-    possible_solution,
-    chat_agent,
-    possible_cause,
+)
+from agents.circuit_breaker import get_circuit_breaker
+from agents.residency import get_residency_manager, start_model_residency
+from agents.router import start_model_router
+from agents.utils import (
+    complexity_analysis,
+    get_pipeline_setting,
+    warm_up_language_detection,
+)
+from diagnosis_engine import (
+    DEDUP_MODE,
+    EXTRACTION_MODE,
+    PROVISIONAL_TRIAGE,
+    answer_chat,
+    build_timing_report,
+    find_similar_diagnosis,
+    graph,
+    new_diagnosis_state,
+    provisional_diagnosis,
+    remember_diagnosis,
+    reuse_diagnosis,
+    run_diagnosis_pipeline,
 )
 from utils_export import export_to_pdf
-import requests
 
 from version_manager import read_version
 
@@ -37,11 +54,21 @@ APP_VERSION = str(read_version())
 
 logging.info("\U0001f680 DiaKari Diagnostic Agent gestartet")
 logging.info("Aktuelle Anwendungsversion: %s", APP_VERSION)
+warm_up_language_detection()
+start_model_residency()
+start_model_router()
 
 # UI Setup
 st.set_page_config(page_title="AI Car Diag", layout="wide", page_icon="icon.png")
 st.caption(f"Version {APP_VERSION}")
 
+breaker = get_circuit_breaker()
+if breaker is not None and breaker.is_open:
+    st.warning(
+        "🔌 Ollama ist derzeit nicht erreichbar. Diagnosen verwenden die regelbasierten "
+        "Fallbacks, bis der Server wieder antwortet."
+    )
+
 # Testmodus
 debug_mode = True
 if debug_mode:
@@ -51,95 +78,133 @@ else:
     test_text = ""
 
 
-# Statusdefinition
-class GraphState(TypedDict, total=False):
-    """Shared state passed between the different LangGraph nodes."""
-
-    description_text: str
-    car_details: str
-    affected_parts: str
-    affected_behaviors: str
-    possible_causes: str
-    possible_solutions: str
-    noises: str
-    changed_parts: str
-    chat_response: str
-    user_question: str
-    chat_history: list[dict[str, str]]
-
-
-# Langgraph Workflow
-workflow = StateGraph(GraphState)
-workflow.add_node("identify_car", identify_car.identify_car)
-workflow.add_node("new_parts", new_parts.new_parts)
-workflow.add_node("noise", noise.noise)
-workflow.add_node("behavior", behavior.behavior)
-workflow.add_node("possible_solution", possible_solution.possible_solution)
-workflow.add_node("possible_cause", possible_cause.possible_cause)
-workflow.add_node("chat", chat_agent.chat_node)
-# workflow.add_node("stop_models", stop_models_node)
-
-
-workflow.set_entry_point("identify_car")
-workflow.add_edge("identify_car", "behavior")
-workflow.add_edge("behavior", "noise")
-workflow.add_edge("noise", "new_parts")
-workflow.add_edge("new_parts", "possible_cause")
-workflow.add_edge("possible_cause", "possible_solution")
-workflow.add_edge("possible_solution", "chat")
-workflow.add_edge("chat", END)
-# workflow.add_edge("chat", "stop_models")
-# workflow.add_edge("stop_models", END)
-graph = workflow.compile()
-
-
-AGENT_SEQUENCE = (
-    (identify_car.identify_car, ("car_details",)),
-    (behavior.behavior, ("affected_behaviors",)),
-    (noise.noise, ("noises",)),
-    (new_parts.new_parts, ("changed_parts",)),
-    (possible_cause.possible_cause, ("possible_causes",)),
-    (possible_solution.possible_solution, ("possible_solutions",)),
-)
+STREAM_ANALYSIS = bool(get_pipeline_setting("stream_analysis", True))
+
+
+# Live view of a running diagnosis: field → heading.
+LIVE_FIELDS = {
+    "car_details": "#### 🚘 Fahrzeuginfo",
+    "affected_behaviors": "#### 💠 Erkanntes Fehlverhalten",
+    "noises": "#### 🔊 Geräusche",
+    "changed_parts": "#### 🔄 Ersetzte Teile",
+    "possible_causes": "#### ❓ Mögliche Ursachen",
+    "possible_solutions": "#### 💠 Lösungsvorschläge",
+}
+STREAMED_FIELDS = ("possible_causes", "possible_solutions")
+
 
+def _provisional_markdown(value: str) -> str:
+    if not value:
+        return "_⏳ wird ermittelt …_"
+    return f"{value}\n\n_⏳ vorläufig_"
 
-def run_diagnosis_pipeline(
-    state: Dict[str, Any], locked_fields: Iterable[str] | None = None
-) -> Dict[str, Any]:
-    """Recalculate the diagnosis when new information is provided via chat."""
 
-    working_state: Dict[str, Any] = dict(state)
-    locked = set(locked_fields or [])
-    aggregated_updates: Dict[str, Any] = {}
+def run_streaming_diagnosis(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the pipeline and render its fields while they arrive.
 
-    for agent_fn, produced_keys in AGENT_SEQUENCE:
-        agent_result = agent_fn(working_state)
-        working_state.update(agent_result)
+    With ``provisional_triage`` the rule-based triage is shown at once and
+    every field is replaced as soon as its agent is done; with
+    ``stream_analysis`` causes and solutions are rendered token by token.
+    The provisional values only ever appear in the live view and are never
+    written to *state*, so a failed run cannot leave them behind as final.
+    """
+
+    provisional: Dict[str, Any] = {}
+    if PROVISIONAL_TRIAGE:
+        provisional = provisional_diagnosis(state)
+    fields = LIVE_FIELDS if provisional else {field: LIVE_FIELDS[field] for field in STREAMED_FIELDS}
+
+    live_view = st.empty()
+    boxes = {}
+    with live_view.container():
+        if provisional:
+            st.caption(
+                "⚡ Vorläufige regelbasierte Einschätzung – die Felder werden ersetzt, "
+                "sobald die KI-Agenten fertig sind."
+            )
+        for field, heading in fields.items():
+            st.markdown(heading)
+            boxes[field] = st.empty()
+            if provisional:
+                boxes[field].markdown(_provisional_markdown(provisional.get(field, "")))
+
+    streamed = {field: "" for field in boxes}
+
+    def on_token(field: str, token: str) -> None:
+        streamed[field] += token
+        boxes[field].markdown(streamed[field] + "▌")
+
+    def on_update(field: str, value: str) -> None:
+        if field in boxes:
+            boxes[field].markdown(value)
+
+    try:
+        return run_diagnosis_pipeline(
+            state,
+            on_token=on_token if STREAM_ANALYSIS else None,
+            on_update=on_update,
+        )
+    finally:
+        # The regular diagnosis panes take over once the final text is in the state.
+        live_view.empty()
 
-        for key in produced_keys:
-            if key in agent_result and key not in locked:
-                aggregated_updates[key] = agent_result[key]
 
-    return aggregated_updates
+def run_streaming_chat(state: Dict[str, Any], question: str) -> Dict[str, Any]:
+    """Answer *question* and render the chat answer while it streams in."""
+
+    with st.chat_message("user"):
+        st.markdown(question)
+    with st.chat_message("assistant"):
+        answer_box = st.empty()
+    streamed = []
+
+    def on_token(token: str) -> None:
+        streamed.append(token)
+        answer_box.markdown("".join(streamed) + "▌")
+
+    return answer_chat(state, question, on_token=on_token)
+
+
+def run_new_diagnosis(description: str) -> None:
+    """Run all agents for *description* and store the result in the session."""
+
+    st.session_state.state.update(new_diagnosis_state(description))
+    logging.debug(f"📅 Eingabebeschreibung: {description}")
+
+    with st.spinner("Generating Diagnosis..."):
+        try:
+            if STREAM_ANALYSIS or PROVISIONAL_TRIAGE:
+                result = run_streaming_diagnosis(st.session_state.state)
+            else:
+                started = time.perf_counter()
+                with complexity_analysis(st.session_state.state):
+                    result = graph.invoke(st.session_state.state)
+                result["timing_report"] = build_timing_report(
+                    result.get("agent_timings", {}),
+                    time.perf_counter() - started,
+                    EXTRACTION_MODE,
+                )
+            st.session_state.state.update(result)
+            logging.info("✅ Diagnose erfolgreich generiert.")
+            logging.debug(f"📊 Diagnosedaten: {json.dumps(result, indent=2)}")
+
+            if result.get("possible_solutions"):
+                remember_diagnosis(st.session_state.state)
+                st.success("Diagnosis Created")
+            else:
+                st.error("Failed to generate Diagnosis.")
+                logging.warning("⚠️ Keine Lösungsvorschläge gefunden.")
+        except Exception as e:
+            logging.exception(f"❌ Fehler bei der Graph-Ausführung: {e}")
+            st.error("Fehler bei der Diagnoseausführung.")
+
 
 # UI Start
 st.markdown("# AI Car Diagnostic Agent")
 
 if "state" not in st.session_state:
     logging.info("🔄 Session State wird initialisiert.")
-    st.session_state.state = {
-        "description_text": "",
-        "affected_parts": "",
-        "affected_behaviors": "",
-        "possible_causes": "",
-        "possible_solutions": "",
-        "noises": "",
-        "car_details": "",
-        "changed_parts": "",
-        "chat_response": "",
-        "user_question": "",
-        "chat_history": [],
-    }
+    st.session_state.state = new_diagnosis_state()
 
 a = ""
 
@@ -155,43 +220,50 @@ if submit_btn:
         st.warning("Bitte gib eine Beschreibung des Problems ein.")
         st.stop()
 
-    st.session_state.state.update(
-        {
-            "chat_history": [],
-            "user_question": "",
-            "chat_response": "",
-            "car_details": "",
-            "description_text": a,
-            "affected_parts": "",
-            "affected_behaviors": "",
-            "possible_causes": "",
-            "possible_solutions": "",
-            "noises": "",
-            "changed_parts": "",
-        }
+    st.session_state.pending_match = None
+    match = find_similar_diagnosis(a)
+    if match is None:
+        run_new_diagnosis(a)
+    elif DEDUP_MODE == "serve":
+        st.session_state.state = reuse_diagnosis(a, match)
+    else:
+        st.session_state.pending_match = (a, match)
+
+# Ähnliche Diagnose anbieten (dedup.mode = "offer")
+pending_match = st.session_state.get("pending_match")
+if pending_match and st.session_state.get("reuse_match"):
+    st.session_state.pending_match = None
+    st.session_state.state = reuse_diagnosis(*pending_match)
+    logging.info("♻️ Gespeicherte Diagnose übernommen.")
+elif pending_match and st.session_state.get("rediagnose_match"):
+    st.session_state.pending_match = None
+    run_new_diagnosis(pending_match[0])
+elif pending_match:
+    st.info(
+        "♻️ Eine sehr ähnliche Beschreibung wurde bereits diagnostiziert "
+        f"(Ähnlichkeit {pending_match[1].similarity:.0%})."
     )
-    logging.debug(f"📅 Eingabebeschreibung: {a}")
-
-    with st.spinner("Generating Diagnosis..."):
-        try:
-            result = graph.invoke(st.session_state.state)
-            st.session_state.state.update(result)
-            logging.info("✅ Diagnose erfolgreich generiert.")
-            logging.debug(f"📊 Diagnosedaten: {json.dumps(result, indent=2)}")
-
-            if result.get("possible_solutions"):
-                st.success("Diagnosis Created")
-            else:
-                st.error("Failed to generate Diagnosis.")
-                logging.warning("⚠️ Keine Lösungsvorschläge gefunden.")
-        except Exception as e:
-            logging.exception(f"❌ Fehler bei der Graph-Ausführung: {e}")
-            st.error("Fehler bei der Diagnoseausführung.")
+    col_reuse, col_new = st.columns(2)
+    col_reuse.button("Übernehmen", key="reuse_match")
+    col_new.button("Neu diagnostizieren", key="rediagnose_match")
 
 if st.session_state.state.get("possible_solutions"):
     col_itin, col_chat = st.columns([3, 2])
     with col_itin:
         st.markdown("### 🧠 Diagnose")
+        reused_from = st.session_state.state.get("reused_from")
+        if reused_from:
+            st.caption(
+                f"♻️ Übernommen aus einer früheren Diagnose "
+                f"(Ähnlichkeit {reused_from['similarity']:.0%})"
+            )
+        timing_report = st.session_state.state.get("timing_report")
+        if timing_report:
+            st.caption(
+                f"⏱️ {timing_report['wall_seconds']:.1f}s "
+                f"({timing_report['mode']}, sequenziell {timing_report['sequential_seconds']:.1f}s, "
+                f"gespart {timing_report['saved_seconds']:.1f}s)"
+            )
         st.markdown("#### 🚘 Fahrzeuginfo")
         st.markdown(f"> {st.session_state.state['car_details']}")
 
@@ -277,35 +349,16 @@ if st.session_state.state.get("possible_solutions"):
 
         if user_input := st.chat_input("Frage etwas zur Diagnose..."):
             logging.info(f"💬 Neue Benutzerfrage: {user_input}")
-            st.session_state.state["user_question"] = user_input
             with st.spinner("Antwort wird generiert..."):
-                result = chat_agent.chat_node(st.session_state.state)
-                logging.debug(f"🤖 Chat-Agent Antwort: {result.get('chat_response')}")
-
-                locked_fields = set(result.pop("locked_fields", []))
-                regenerate = bool(result.pop("regenerate", False))
-
-                st.session_state.state.update(result)
-                st.session_state.state["user_question"] = ""
-
-                if regenerate:
-                    try:
-                        logging.info(
-                            "🔁 Zusätzliche Informationen erkannt – Diagnose wird aktualisiert."
-                        )
-                        diagnosis_updates = run_diagnosis_pipeline(
-                            st.session_state.state, locked_fields
-                        )
-                        st.session_state.state.update(diagnosis_updates)
-                        logging.debug(
-                            "🧮 Aktualisierte Diagnosefelder: %s",
-                            json.dumps(diagnosis_updates, indent=2, ensure_ascii=False),
-                        )
-                    except Exception as exc:  # pylint: disable=broad-except
-                        logging.exception(
-                            "❌ Fehler beim Aktualisieren der Diagnose nach Chat-Eingabe: %s",
-                            exc,
-                        )
+                if STREAM_ANALYSIS:
+                    st.session_state.state = run_streaming_chat(
+                        st.session_state.state, user_input
+                    )
+                else:
+                    st.session_state.state = answer_chat(st.session_state.state, user_input)
+                logging.debug(
+                    f"🤖 Chat-Agent Antwort: {st.session_state.state.get('chat_response')}"
+                )
 
                 st.rerun()
 else:
@@ -314,11 +367,11 @@ else:
 
 
 def stop_ollama_models():
-    try:
-        response = requests.post("http://localhost:11434/api/stop")
-        print(f"🛑 Ollama stop response: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Fehler beim Modell-Stop: {e}")
+    residency = get_residency_manager()
+    if residency is None:
+        logging.info("🛑 Modellverwaltung deaktiviert, nichts zu entladen.")
+        return
+    residency.unload_all()
 
 
 def stop_models_node(state):